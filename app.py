@@ -68,7 +68,7 @@ elif model_option == "Gemini 1.5 Flash":
 
 with st.sidebar:
     with st.expander("Fetch all files"):
-        st.write("Do this if you are opening the app for first time, otherwise just do update. It will fetch all files along with their paths and save. It will take around 2-3 mins depending on number of files in your laptop. This will fetch files only in C and D drives.")
+        st.write("Do this if you are opening the app for first time, otherwise just do update. It will fetch all files along with their paths and save. If it gets interrupted, fetching again continues from where it stopped. It will take around 2-3 mins depending on number of files in your laptop. This will fetch files only in C and D drives.")
 
         # Display Confirm and Cancel buttons
         col1, col2 = st.columns(2)
@@ -78,14 +78,17 @@ with st.sidebar:
             cancel = st.button('Cancel')
         if fetch:
             st.write("Fetching files.. Don't retry until it's done.")
-            files_handler.all_files_index = files_handler.index_files_and_directories(files_handler.root_paths) 
-            files_handler.save_files()
+            files_handler.wait_ready()
+            files_handler.fetch_all_files()
             st.write('Fetching completed.')    
 
 
 with st.sidebar:
     with st.expander("Create Embeddings"):
-        st.write("Do this if you are opening the app for first time, otherwise just do update. It will create embeddings for fetched files. It will take 2-3 hours depending upon number of files in your laptop.")
+        st.write("Do this if you are opening the app for first time, otherwise just do update. It will create embeddings for fetched files. It will take 2-3 hours depending upon number of files in your laptop. Progress is saved regularly, if it gets interrupted, creating again continues from the last save.")
+
+        # Each drive has its own embeddings, re-creating one leaves the search over the others as it is.
+        roots = st.multiselect('Drives', files_handler.root_paths, default=files_handler.root_paths)
 
         # Display Confirm and Cancel buttons
         col1, col2 = st.columns(2)
@@ -94,10 +97,8 @@ with st.sidebar:
         with col2:
             cancel2 = st.button('Cancel creation')
         if create:
-            st.write("Creating Embeddings... Don't retry until it's done.")
-            files_handler.faiss_index_files_and_directories(files_handler.all_files) 
-            files_handler.save_faiss_files()
-            st.write('Completed.')    
+            st.write(files_handler.create_embeddings(roots))
+        st.caption(files_handler.embedding_status())
 
 with st.sidebar:
     with st.expander("Update all files"):
@@ -111,8 +112,23 @@ with st.sidebar:
             cancel3 = st.button('Cancel Update')
         if update:
             st.write("Updating files.. Don't retry until it's done.")
+            files_handler.wait_ready()
             files_handler.check_updates()
             st.write('Completed.')    
+        if st.button('Compact embeddings', help="Deletes the embeddings of removed and renamed files from the vector store and shows the memory it freed. Also moves the embeddings into the index type set by FAISS_INDEX_TYPE."):
+            files_handler.wait_ready()
+            st.write(files_handler.compact_embeddings())
+
+
+with st.sidebar:
+    # The watcher lives in files_handler, which survives Streamlit reruns.
+    live_watch = st.checkbox("Keep files up to date", value=files_handler.watcher is not None,
+                             help="Watches the C and D drives and applies created, deleted and renamed files to the file search right away, without a full update.")
+    if live_watch and files_handler.watcher is None:
+        st.write(files_handler.start_watcher())
+    elif not live_watch and files_handler.watcher is not None:
+        st.write(files_handler.stop_watcher())
+    st.caption(files_handler.cold_start_report())
 
 
 # Ensure openai_model is initialized in session state
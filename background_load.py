@@ -0,0 +1,33 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Background_Load():
+    """
+    Runs a load function once on a thread of its own. Callers that need what it loads block in wait() until it
+    is done, a load that failed re-raises its error in every wait() instead of leaving them blocked.
+    """
+
+    def __init__(self, load, name='background_load'):
+        self.load = load
+        self.name = name
+        self.future = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        ''' Starts the load unless it already started, returns its future at once. '''
+        with self._lock:
+            if self.future is None:
+                self.future = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.name).submit(self.load)
+            return self.future
+
+    def wait(self, timeout=None):
+        ''' Blocks until the load is done (starting it if needed), re-raising its error if it failed. '''
+        return self.start().result(timeout)
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def error(self):
+        ''' Error of a load that failed, None while it runs or once it succeeded. '''
+        return self.future.exception() if self.done() else None
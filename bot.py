@@ -1,6 +1,6 @@
 from gemini_llm import llm_gem
 from open_ai_llm import llm_gpt
-from handle_system_files import update_search_list, open_file_or_dir, search_files, get_default_paths
+from handle_system_files import update_search_list, open_file_or_dir, search_files, get_default_paths, query_file_metadata, find_duplicate_files
 from basic_tools import repl_tool, youtube_tool, get_brightness, change_brightness, settings_opener, download_image, brave_web_search, open_url
 from pdf_writer import create_and_write_pdf_file
 from display import run_command, github_push_instructions
@@ -13,7 +13,7 @@ from langgraph.checkpoint.memory import MemorySaver
 
 tools = [get_brightness, change_brightness, create_and_write_pdf_file, update_search_list, 
          open_file_or_dir, search_files, alter_files, settings_opener, run_command,  youtube_tool, open_url, download_image, 
-         brave_web_search, file_editor, github_push_instructions, get_default_paths] + final_gmail_tools
+         brave_web_search, file_editor, github_push_instructions, get_default_paths, query_file_metadata, find_duplicate_files] + final_gmail_tools
 
 
 memory = MemorySaver()
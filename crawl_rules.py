@@ -0,0 +1,199 @@
+import os
+import re
+import stat
+import time
+import fnmatch
+import threading
+
+IGNORE_CASE = os.name == 'nt'
+OPTIONS = ('follow_symlinks', 'skip_symlink_loops', 'same_filesystem')
+
+
+class Prune_Rule():
+    """
+    One line of the rules file.
+    glob   : matches the entry name, or the full path if the pattern holds a path separator.
+    regex  : searched in the full path.
+    marker : a directory holding an entry with this name (e.g. pyvenv.cfg) is indexed but none of its subdirectories are.
+    The two crawl options that prune directories are counted as rules too.
+    """
+
+    def __init__(self, kind, pattern):
+        self.kind = kind
+        self.pattern = pattern
+        self.on_path = kind == 'regex' or (kind == 'glob' and ('/' in pattern or '\\' in pattern))
+        flags = re.IGNORECASE if IGNORE_CASE else 0
+        if kind == 'glob':
+            self.regex = re.compile(fnmatch.translate(pattern), flags)
+        elif kind == 'regex':
+            self.regex = re.compile(pattern, flags)
+        else:
+            self.regex = None
+        self.entries = 0
+        self.pruned_dirs = []
+
+    def matches(self, name, path):
+        if self.kind == 'glob':
+            return self.regex.match(path if self.on_path else name) is not None
+        return self.regex.search(path) is not None
+
+    def __str__(self):
+        return f'{self.kind}:{self.pattern}'
+
+
+class Crawl_Rules():
+    """
+    Exclusion rules and options of the file crawler, read from a rules file (see crawl_rules.txt).
+    Matching entries are left out of the index and matching directories are not crawled. Every rule counts the
+    entries it excluded, and with record_pruned the pruned directories are kept so audit_rules can measure
+    what crawling them would have cost.
+    """
+
+    def __init__(self, lines=(), record_pruned=False):
+        self.rules = []
+        self.markers = {}
+        self.follow_symlinks = False
+        self.skip_symlink_loops = False
+        self.same_filesystem = False
+        self.record_pruned = record_pruned
+        self._lock = threading.Lock()
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            kind, _, pattern = line.partition(':')
+            kind, pattern = kind.strip(), pattern.strip()
+            if kind == 'option':
+                option, _, value = pattern.partition('=')
+                if option.strip() not in OPTIONS:
+                    raise ValueError(f'Unknown crawl option: {line}')
+                setattr(self, option.strip(), value.strip().lower() in ('true', 'yes', '1'))
+            elif kind in ('glob', 'regex'):
+                self.rules.append(Prune_Rule(kind, pattern))
+            elif kind == 'marker':
+                self.markers[os.path.normcase(pattern)] = Prune_Rule(kind, pattern)
+            else:
+                raise ValueError(f'Unknown crawl rule: {line}')
+        self.option_rules = {option: Prune_Rule('option', option) for option in ('skip_symlink_loops', 'same_filesystem')}
+        # One combined regex per target rejects most entries in a single match call.
+        self.name_regex = self.combine(rule for rule in self.rules if not rule.on_path)
+        self.path_regex = self.combine(rule for rule in self.rules if rule.on_path)
+
+    def combine(self, rules):
+        parts = []
+        for rule in rules:
+            pattern = rule.regex.pattern if rule.kind == 'glob' else f'.*?(?:{rule.regex.pattern})'
+            parts.append(f'(?:{pattern})')
+        if not parts:
+            return None
+        try:
+            return re.compile('|'.join(parts), re.IGNORECASE if IGNORE_CASE else 0)
+        except re.error:
+            # Patterns with global inline flags can't be combined, every entry is then checked rule by rule.
+            return re.compile('')
+
+    def all_rules(self):
+        return self.rules + list(self.markers.values()) + list(self.option_rules.values())
+
+    def excluded_by(self, name, path):
+        if (self.name_regex is None or not self.name_regex.match(name)) and \
+                (self.path_regex is None or not self.path_regex.match(path)):
+            return None
+        for rule in self.rules:
+            if rule.matches(name, path):
+                return rule
+        return None
+
+    def filter(self, dir_path, entries):
+        ''' Drops the excluded (DirEntry, is_dir) pairs of one listing. Called from the crawler threads. '''
+        marker = None
+        if self.markers:
+            for entry, _ in entries:
+                marker = self.markers.get(os.path.normcase(entry.name))
+                if marker is not None:
+                    break
+        if not self.rules and marker is None:
+            return entries
+        kept, dropped = [], []
+        for entry, is_dir in entries:
+            rule = self.excluded_by(entry.name, entry.path) if self.rules else None
+            if rule is None and is_dir and marker is not None:
+                rule = marker
+            if rule is None:
+                kept.append((entry, is_dir))
+            else:
+                dropped.append((rule, entry.path if is_dir else None))
+        if dropped:
+            self.count(dropped)
+        return kept
+
+    def count(self, dropped):
+        with self._lock:
+            for rule, dir_path in dropped:
+                rule.entries += 1
+                if dir_path is not None and self.record_pruned:
+                    rule.pruned_dirs.append(dir_path)
+
+    def count_option(self, option, dir_path):
+        self.count([(self.option_rules[option], dir_path)])
+
+
+def load_crawl_rules(path, record_pruned=False):
+    ''' Reads a rules file, returns None if there is none (the crawler then indexes everything). '''
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return Crawl_Rules(f.readlines(), record_pruned)
+
+
+def dir_identity(entry):
+    '''
+    (st_dev, st_ino) of the directory an entry points to, None for a plain directory on Windows.
+    DirEntry.stat() leaves st_dev/st_ino at 0 there, so only reparse points (junctions, symlinks, mount points),
+    the only way into a loop or another volume, are stat'ed again, plain directories keep the free scandir data.
+    '''
+    st = entry.stat()
+    if st.st_ino:
+        return st.st_dev, st.st_ino
+    if not entry.stat(follow_symlinks=False).st_file_attributes & stat.FILE_ATTRIBUTE_REPARSE_POINT:
+        return None
+    st = os.stat(entry.path)
+    return st.st_dev, st.st_ino
+
+
+def audit_rules(root_paths, rules_path, max_workers=None):
+    '''
+    Crawls the roots with the rules, then crawls every pruned directory without rules to measure
+    how many entries and how much crawl time each rule saved.
+    '''
+    from file_crawler import Files_Crawler
+    rules = load_crawl_rules(rules_path, record_pruned=True)
+    if rules is None:
+        return f'No crawl rules at {rules_path}.'
+    crawler = Files_Crawler(max_workers, rules)
+    crawler.crawl(root_paths)
+    lines = [str(crawler.report)]
+    total_entries = total_time = 0
+    for rule in rules.all_rules():
+        if not rule.entries:
+            continue
+        if rule is rules.option_rules['skip_symlink_loops']:
+            # Crawling a loop without the option never ends.
+            lines.append(f'{rule}: {rule.entries} directories entered more than once were skipped')
+            continue
+        start = time.perf_counter()
+        pruned = Files_Crawler(max_workers)
+        for _ in pruned.iter_listings(rule.pruned_dirs):
+            pass
+        seconds = time.perf_counter() - start
+        saved = rule.entries + pruned.report.entries
+        total_entries += saved
+        total_time += seconds
+        lines.append(f'{rule}: {rule.entries} entries matched, {saved} entries and ~{seconds:.2f}s of crawling saved')
+    lines.append(f'total: {total_entries} entries and ~{total_time:.2f}s saved')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import sys
+    print(audit_rules(sys.argv[1:] or ['.'], 'crawl_rules.txt'))
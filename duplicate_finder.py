@@ -0,0 +1,209 @@
+import os
+import stat
+import time
+import hashlib
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Duplicate_Report():
+    """Counts of every stage of a duplicate search, so the cost of each one is visible."""
+
+    def __init__(self):
+        self.files = 0
+        self.size_candidates = 0
+        self.hard_links = 0
+        self.partial_hashed = 0
+        self.full_hashed = 0
+        self.bytes_read = 0
+        self.groups = 0
+        self.reclaimable = 0
+        self.stage_times = {}
+
+    def __str__(self):
+        stages = ', '.join(f'{stage} {seconds:.2f}s' for stage, seconds in self.stage_times.items())
+        return (f'duplicate search: {self.files} files, {self.size_candidates} share a size ({self.hard_links} extra hard '
+                f'links skipped), {self.partial_hashed} '
+                f'partially and {self.full_hashed} fully hashed, {self.bytes_read / 2**20:.1f} MB read, '
+                f'{self.groups} groups, {self.reclaimable / 2**20:.1f} MB reclaimable ({stages})')
+
+
+class Duplicate_Finder():
+    """
+    Finds files with identical content in stages, each one only looking at the files the previous one left:
+    1. files are bucketed by size, a file with a unique size has no duplicate, and hard links to the same file
+       (same st_dev and st_ino) are kept once since removing one frees nothing;
+    2. the first and last block of every remaining file are hashed (most same-size files differ there);
+    3. files still colliding are hashed in full.
+    Hashing runs on a thread pool, hashlib releases the GIL so reads and hashing overlap across files.
+    """
+
+    def __init__(self, max_workers=None, block_size=64 * 1024, chunk_size=1 << 20):
+        self.max_workers = max_workers or min(16, (os.cpu_count() or 1) * 2)
+        self.block_size = block_size
+        self.chunk_size = chunk_size
+        self.report = None
+
+    def collapse_links(self, pool, groups):
+        ''' Keeps one path per (st_dev, st_ino) in every group of same-size paths, dropping the groups left with one. '''
+        paths = [path for _, paths in groups for path in paths]
+        identities = iter(pool.map(file_identity, paths, chunksize=64))
+        collapsed = []
+        for size, paths in groups:
+            seen, kept = set(), []
+            for path in paths:
+                identity = next(identities)
+                if identity is not None and identity in seen:
+                    self.report.hard_links += 1
+                    continue
+                seen.add(identity)
+                kept.append(path)
+            if len(kept) > 1:
+                collapsed.append((size, kept))
+        return collapsed
+
+    def partial_hash(self, path, size):
+        ''' Hash of the first and last block (the whole file if it is not larger than two blocks). '''
+        try:
+            with open(path, 'rb') as f:
+                data = f.read(self.block_size)
+                if size > 2 * self.block_size:
+                    f.seek(-self.block_size, os.SEEK_END)
+                    data += f.read(self.block_size)
+                elif size > self.block_size:
+                    data += f.read()
+        except OSError:
+            return path, None, 0
+        return path, hashlib.blake2b(data, digest_size=16).digest(), len(data)
+
+    def full_hash(self, path, size):
+        h = hashlib.blake2b(digest_size=32)
+        read = 0
+        try:
+            with open(path, 'rb', buffering=0) as f:
+                while chunk := f.read(self.chunk_size):
+                    h.update(chunk)
+                    read += len(chunk)
+        except OSError:
+            return path, None, read
+        return path, h.digest(), read
+
+    def split(self, pool, groups, hash_file):
+        ''' Splits every group of same-size paths by the given hash, keeping the sub-groups of two or more. '''
+        # All files of all groups go through one map, small groups don't leave workers idle.
+        jobs = [(size, path) for size, paths in groups for path in paths]
+        buckets = defaultdict(list)
+        for size, (path, digest, read) in zip((size for size, _ in jobs),
+                                              pool.map(hash_file, [path for _, path in jobs], [size for size, _ in jobs])):
+            self.report.bytes_read += read
+            if digest is not None:
+                buckets[size, digest].append(path)
+        return [(size, paths) for (size, _), paths in buckets.items() if len(paths) > 1]
+
+    def find(self, sized_paths, min_size=1):
+        '''
+        Groups the (path, size) pairs by content. Returns [(size, [paths])], largest reclaimable space first.
+        Empty files (below min_size) are ignored.
+        '''
+        self.report = report = Duplicate_Report()
+        start = time.perf_counter()
+        by_size = defaultdict(set)
+        for path, size in sized_paths:
+            report.files += 1
+            if size >= min_size:
+                by_size[size].add(path)
+        groups = [(size, sorted(paths)) for size, paths in by_size.items() if len(paths) > 1]
+        report.size_candidates = sum(len(paths) for _, paths in groups)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            groups = self.collapse_links(pool, groups)
+            report.stage_times['size'] = time.perf_counter() - start
+            start = time.perf_counter()
+            report.partial_hashed = sum(len(paths) for _, paths in groups)
+            groups = self.split(pool, groups, self.partial_hash)
+            report.stage_times['partial hash'] = time.perf_counter() - start
+            start = time.perf_counter()
+            # Files small enough to have been read whole by the partial hash are already compared.
+            done = [(size, paths) for size, paths in groups if size <= 2 * self.block_size]
+            todo = [(size, paths) for size, paths in groups if size > 2 * self.block_size]
+            report.full_hashed = sum(len(paths) for _, paths in todo)
+            groups = done + self.split(pool, todo, self.full_hash)
+            report.stage_times['full hash'] = time.perf_counter() - start
+        groups.sort(key=lambda group: group[0] * (len(group[1]) - 1), reverse=True)
+        report.groups = len(groups)
+        report.reclaimable = sum(size * (len(paths) - 1) for size, paths in groups)
+        return groups
+
+
+def file_identity(path):
+    ''' (st_dev, st_ino) of a file, None if it can't be stat'ed. '''
+    try:
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    return st.st_dev, st.st_ino
+
+
+def sized_files(file_index, metadata=None, under=None, max_workers=None):
+    '''
+    (path, size) of the indexed files, optionally only below the directory under. Sizes come from the
+    recorded File_Metadata when there is one, otherwise the paths of the index are stat'ed on a thread pool.
+    '''
+    from file_metadata import is_under
+    if metadata is not None and len(metadata):
+        return [(path, size) for path, size, _, _ in metadata.query(under=under, kind='file', min_size=1, limit=len(metadata))]
+
+    def file_size(path):
+        try:
+            st = os.stat(path, follow_symlinks=False)
+        except (OSError, ValueError):
+            return path, -1
+        return path, (st.st_size if stat.S_ISREG(st.st_mode) else -1)
+
+    paths = [p for name, ps in file_index.items() if name != 'none' for p in ps if not under or is_under(p, under)]
+    with ThreadPoolExecutor(max_workers=max_workers or 16) as pool:
+        return [(path, size) for path, size in pool.map(file_size, paths, chunksize=256) if size > 0]
+
+
+def benchmark_duplicate_finder(files=3000, directory=None):
+    '''
+    Staged search against hashing every file in full, on a generated tree with duplicate groups and
+    same-size files that only differ in their middle.
+    '''
+    import random
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory(dir=directory) as root:
+        sized = []
+        contents = []
+        for i in range(files):
+            kind = rng.random()
+            if kind < 0.2 and contents:
+                data = rng.choice(contents)
+            elif kind < 0.3 and contents:
+                # Same size, same head and tail, different middle: only the full hash tells them apart.
+                data = bytearray(rng.choice(contents))
+                data[len(data) // 2] ^= 0xFF
+                data = bytes(data)
+            else:
+                data = rng.randbytes(rng.choice([4096, 200_000, 1_000_000, rng.randint(1, 3_000_000)]))
+                contents.append(data)
+            path = os.path.join(root, f'dir_{i % 50}', f'file_{i}.bin')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+            sized.append((path, len(data)))
+        finder = Duplicate_Finder()
+        finder.find(sized)
+        lines = [str(finder.report)]
+        start = time.perf_counter()
+        naive = Duplicate_Finder(finder.max_workers)
+        naive.report = Duplicate_Report()
+        with ThreadPoolExecutor(max_workers=naive.max_workers) as pool:
+            groups = naive.split(pool, [(0, [path for path, _ in sized])], naive.full_hash)
+        lines.append(f'full hash of every file: {time.perf_counter() - start:.2f}s, {naive.report.bytes_read / 2**20:.1f} MB '
+                     f'read, {len(groups)} groups')
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(benchmark_duplicate_finder())
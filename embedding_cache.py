@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import hashlib
+import inspect
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def text_key(model, text):
+    ''' 64 bit content address of a text for one model. '''
+    digest = hashlib.blake2b(f'{model}\0{text}'.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class Embedding_Cache():
+    """
+    Persistent cache of embedding vectors keyed by (model, text hash).
+    Vectors are float16 rows appended to `<path>.vectors`, read through a memory map, and their 64 bit keys are
+    appended to `<path>.keys` in the same order. Lookups binary search a sorted copy of the keys, keys added
+    since it was sorted sit in a small dict until the next merge. Every put is written through, so there is
+    nothing to save and a crash loses at most the rows being written.
+    """
+
+    merge_every = 65536
+
+    def __init__(self, path, model):
+        self.path = path
+        self.model = model
+        self.meta_path = path + '.json'
+        self.keys_path = path + '.keys'
+        self.vectors_path = path + '.vectors'
+        self.dim = None
+        self.rows = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._pending = {}
+        self.sorted_keys = np.zeros(0, dtype=np.uint64)
+        self.sorted_rows = np.zeros(0, dtype=np.int64)
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        if meta['model'] != self.model:
+            raise ValueError(f'{self.path} caches embeddings of {meta["model"]}, not {self.model}.')
+        self.dim = meta['dim']
+        keys = np.fromfile(self.keys_path, dtype=np.uint64) if os.path.exists(self.keys_path) else np.zeros(0, np.uint64)
+        vector_rows = os.path.getsize(self.vectors_path) // (2 * self.dim) if os.path.exists(self.vectors_path) else 0
+        # Rows written only partly before a crash are dropped.
+        self.rows = min(len(keys), vector_rows)
+        keys = keys[:self.rows]
+        order = np.argsort(keys, kind='stable')
+        self.sorted_keys, self.sorted_rows = keys[order], order.astype(np.int64)
+
+    def __len__(self):
+        return self.rows
+
+    def vectors(self):
+        if self._vectors is None or len(self._vectors) < self.rows:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float16, mode='r', shape=(self.rows, self.dim))
+        return self._vectors
+
+    def find(self, keys):
+        ''' Row of every key, -1 where it is not cached. '''
+        keys = np.asarray(keys, dtype=np.uint64)
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        if len(self.sorted_keys):
+            at = np.minimum(np.searchsorted(self.sorted_keys, keys), len(self.sorted_keys) - 1)
+            found = self.sorted_keys[at] == keys
+            rows[found] = self.sorted_rows[at[found]]
+        if self._pending:
+            for i in np.flatnonzero(rows < 0).tolist():
+                rows[i] = self._pending.get(int(keys[i]), -1)
+        return rows
+
+    def get(self, texts):
+        ''' Cached vectors of the texts as a float32 array (rows of zeros for misses) and the mask of hits. '''
+        keys = [text_key(self.model, text) for text in texts]
+        with self._lock:
+            rows = self.find(keys)
+            hit = rows >= 0
+            self.hits += int(hit.sum())
+            self.misses += int((~hit).sum())
+            if self.dim is None:
+                return None, hit
+            result = np.zeros((len(texts), self.dim), dtype=np.float32)
+            if hit.any():
+                result[hit] = self.vectors()[rows[hit]]
+            return result, hit
+
+    def put(self, texts, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(texts):
+            return
+        keys = np.array([text_key(self.model, text) for text in texts], dtype=np.uint64)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self.meta_path, 'w') as f:
+                    json.dump({'model': self.model, 'dim': self.dim}, f)
+            # Texts already cached (e.g. added by another thread meanwhile) are not stored twice.
+            new = self.find(keys) < 0
+            keys, vectors = keys[new], vectors[new]
+            keys, first = np.unique(keys, return_index=True)
+            vectors = vectors[first]
+            if not len(keys):
+                return
+            with open(self.vectors_path, 'ab') as f:
+                f.write(vectors.astype(np.float16).tobytes())
+            with open(self.keys_path, 'ab') as f:
+                f.write(keys.tobytes())
+            for i, key in enumerate(keys.tolist()):
+                self._pending[key] = self.rows + i
+            self.rows += len(keys)
+            if len(self._pending) >= self.merge_every:
+                self.merge()
+
+    def merge(self):
+        pending_keys = np.fromiter(self._pending.keys(), dtype=np.uint64, count=len(self._pending))
+        pending_rows = np.fromiter(self._pending.values(), dtype=np.int64, count=len(self._pending))
+        keys = np.concatenate([self.sorted_keys, pending_keys])
+        rows = np.concatenate([self.sorted_rows, pending_rows])
+        order = np.argsort(keys, kind='stable')
+        self.sorted_keys, self.sorted_rows = keys[order], rows[order]
+        self._pending = {}
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def report(self):
+        return (f'embedding cache: {self.rows} vectors ({self.rows * 2 * (self.dim or 0) / 2**20:.1f} MB), '
+                f'{self.hits} hits, {self.misses} misses, hit rate {100 * self.hit_rate:.1f}%')
+
+
+class Cached_Embeddings(Embeddings):
+    """Embeddings that look every text up in an Embedding_Cache first and only send the misses to the model."""
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        cached, hit = self.cache.get(texts)
+        if hit.all():
+            return cached.tolist()
+        misses = [text for text, h in zip(texts, hit) if not h]
+        vectors = np.asarray(self.embeddings.embed_documents(misses), dtype=np.float32)
+        self.cache.put(misses, vectors)
+        if cached is None:
+            return vectors.tolist()
+        cached[~hit] = vectors
+        return cached.tolist()
+
+    def embed_query(self, text):
+        # Queries go to the model as they are: some models embed them differently from documents, and a query is
+        # rarely asked twice in the same words, so caching them would mostly grow the cache.
+        return self.embeddings.embed_query(text)
+
+    def report(self):
+        return self.cache.report()
+
+
+def embed_queries(embeddings, texts):
+    '''
+    Query vectors of several texts, uncached like Cached_Embeddings.embed_query. Clients whose embed_documents
+    takes a task_type (Gemini) embed them in one request as retrieval queries, others with one embed_query per text.
+    '''
+    client = embeddings.embeddings if isinstance(embeddings, Cached_Embeddings) else embeddings
+    if 'task_type' in inspect.signature(client.embed_documents).parameters:
+        return client.embed_documents(list(texts), task_type='retrieval_query')
+    return [client.embed_query(text) for text in texts]
+
+
+def benchmark_embedding_cache(texts=20_000, latency=0.05, directory='.'):
+    ''' A rebuild of the same names through the cache against the first build, on Fake_Embeddings. '''
+    from embedding_pipeline import Fake_Embeddings, Embedding_Pipeline
+    path = os.path.join(directory, 'benchmark_embedding_cache')
+    names = [f'file_{i}.txt' for i in range(texts)]
+    lines = []
+    try:
+        for run in ('first build', 'rebuild'):
+            fake = Fake_Embeddings(size=768, latency=latency)
+            embeddings = Cached_Embeddings(fake, Embedding_Cache(path, 'fake'))
+            pipeline = Embedding_Pipeline(embeddings, batch_size=100, concurrency=4, requests_per_minute=10**6)
+            start = time.perf_counter()
+            pipeline.run(names, lambda batch, vectors: None)
+            lines.append(f'{run}: {time.perf_counter() - start:.2f}s, {fake.calls} API calls, {embeddings.report()}')
+        error = np.abs(np.array(embeddings.embed_documents(names[:100])) - np.array(fake.embed_documents(names[:100]))).max()
+        lines.append(f'largest float16 rounding error of a cached vector component: {error:.5f}')
+    finally:
+        for suffix in ('.json', '.keys', '.vectors'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(benchmark_embedding_cache())
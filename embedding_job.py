@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import shutil
+
+CURSOR_NAME = 'embedding_cursor.json'
+
+
+def recover_checkpoint(store_path):
+    ''' Finishes a checkpoint swap interrupted between its two renames, so a crash never loses the store. '''
+    if os.path.exists(store_path):
+        return
+    # The temporary folder is complete once its cursor is written, the old folder always is.
+    for leftover, marker in ((store_path + '.tmp', CURSOR_NAME), (store_path + '.old', '')):
+        if os.path.exists(os.path.join(leftover, marker)):
+            os.replace(leftover, store_path)
+            print(f'logs: Recovered the embedding store from {leftover}.')
+            return
+
+
+class Embedding_Job():
+    """
+    Embeds a list of texts in batches through an Embedding_Pipeline, checkpointing the store every
+    checkpoint_every batches. A checkpoint is saved to a temporary folder together with the cursor (the texts
+    in the store) and swapped in with renames, so the store and the cursor always agree. Running the job again
+    only embeds the texts missing from the last checkpoint, even if texts were added or removed meanwhile.
+    """
+
+    def __init__(self, store_path, pipeline, checkpoint_every=20):
+        self.store_path = store_path
+        self.pipeline = pipeline
+        self.checkpoint_every = checkpoint_every
+        self.state = 'idle'
+        self.total = 0
+        self.done = 0
+        self.resumed = 0
+        self.started = None
+        self.checkpoints = 0
+        self.error = None
+
+    def read_cursor(self):
+        ''' Texts already in the stored checkpoint, None if there is no unfinished job. '''
+        path = os.path.join(self.store_path, CURSOR_NAME)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            cursor = json.load(f)
+        # Cursors of older versions numbered the batches of one list of texts, their jobs start over.
+        if 'done' not in cursor or cursor['complete']:
+            return None
+        return set(cursor['done'])
+
+    def checkpoint(self, save, done, complete):
+        tmp_path, old_path = self.store_path + '.tmp', self.store_path + '.old'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        save(tmp_path)
+        cursor = {'total': self.total, 'done': sorted(done), 'complete': complete}
+        with open(os.path.join(tmp_path, CURSOR_NAME), 'w') as f:
+            json.dump(cursor, f)
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(self.store_path):
+            os.replace(self.store_path, old_path)
+        os.replace(tmp_path, self.store_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        self.checkpoints += 1
+
+    def run(self, texts, write, save, reset, remove):
+        '''
+        Embeds the texts, resuming the unfinished job if there is one.
+        write(texts, vectors) adds a batch to the store, save(path) saves the store to a folder, reset() empties
+        it when the job starts from scratch and remove(texts) drops the stored texts that are no longer wanted.
+        '''
+        batch_size = self.pipeline.batch_size
+        done = self.read_cursor()
+        if done is None:
+            reset()
+            done = set()
+        wanted = set(texts)
+        stale = done - wanted
+        if stale:
+            remove(sorted(stale))
+            done -= stale
+        missing = [text for text in texts if text not in done]
+        batches = [(i, missing[i * batch_size:(i + 1) * batch_size])
+                   for i in range((len(missing) + batch_size - 1) // batch_size)]
+        self.total = len(texts)
+        self.done = self.resumed = len(texts) - len(missing)
+        self.started = time.monotonic()
+        self.state = 'running'
+        self.error = None
+        if self.resumed:
+            print(f'logs: Resuming embeddings after {self.resumed} of {self.total} names.')
+        since_checkpoint = 0
+
+        def on_batch(batch_id, batch, vectors):
+            nonlocal since_checkpoint
+            write(batch, vectors)
+            done.update(batch)
+            self.done += len(batch)
+            since_checkpoint += 1
+            if since_checkpoint >= self.checkpoint_every:
+                self.checkpoint(save, done, complete=False)
+                since_checkpoint = 0
+
+        try:
+            self.pipeline.run_batches(batches, on_batch, 'embedding job')
+            self.checkpoint(save, done, complete=True)
+        except BaseException as e:
+            self.state = 'failed'
+            self.error = e
+            raise
+        self.state = 'done'
+        return self.pipeline.report
+
+    def status(self):
+        ''' Progress line: done/total, throughput of this run and the estimated time left. '''
+        if self.state == 'idle':
+            return 'No embedding job has run yet.'
+        text = f'Embedding job {self.state}: {self.done}/{self.total} names'
+        if self.total:
+            text += f' ({100 * self.done / self.total:.1f}%)'
+        elapsed = time.monotonic() - self.started
+        rate = (self.done - self.resumed) / elapsed if elapsed else 0
+        if self.state == 'running' and rate > 0:
+            eta = (self.total - self.done) / rate
+            text += f', {rate:.0f} names/sec, about {eta / 60:.0f} min left'
+        text += f', {self.checkpoints} checkpoints'
+        if self.error is not None:
+            text += f', error: {self.error}'
+        return text
@@ -0,0 +1,233 @@
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from langchain_core.embeddings import Embeddings
+
+
+class Token_Bucket():
+    """
+    Request rate limiter shared by the embedding threads: holds up to `capacity` tokens, refilled at `rate` per
+    second. The rate is adaptive (AIMD): halved on a rate limit error, then raised by a step for every
+    success until it is back at its configured maximum.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.slowed_at = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, cost=1):
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+                wait_time = (cost - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    def slow_down(self):
+        with self._lock:
+            self._refill()
+            now = time.monotonic()
+            # The requests in flight all fail at once, halve the rate once per burst, not once per request.
+            if now - self.slowed_at < 1.0:
+                return
+            self.slowed_at = now
+            self.rate = max(self.max_rate / 64, self.rate / 2)
+            # Drop the burst too, the server just said it had enough.
+            self.tokens = min(self.tokens, 0)
+
+    def speed_up(self):
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+def is_rate_limit_error(error):
+    ''' True for HTTP 429 / quota errors, whatever client raised them. '''
+    text = f'{type(error).__name__} {error}'.lower()
+    return any(marker in text for marker in ('429', 'resourceexhausted', 'resource exhausted', 'rate limit', 'quota'))
+
+
+class Embedding_Report():
+    """Throughput numbers of one embedding run."""
+
+    def __init__(self, name):
+        self.name = name
+        self.texts = 0
+        self.batches = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    @property
+    def texts_per_sec(self):
+        return self.texts / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f'{self.name}: {self.texts} texts in {self.batches} batches in {self.elapsed:.2f}s '
+                f'({self.texts_per_sec:.0f} texts/sec, {self.rate_limited} rate limited, {self.retries} retries)')
+
+
+class Embedding_Pipeline():
+    """
+    Embeds texts with up to `concurrency` batches in flight, each request first taking a token from a
+    Token_Bucket. Rate limit errors are retried with exponential backoff (with jitter) and slow the bucket down.
+    Finished batches are handed to `write(texts, vectors)` on the calling thread only, so the FAISS store has
+    a single writer.
+    """
+
+    def __init__(self, embeddings, batch_size=100, concurrency=4, requests_per_minute=1500, max_retries=8,
+                 backoff=1.0, max_backoff=60.0):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.bucket = Token_Bucket(requests_per_minute / 60, capacity=concurrency)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.report = None
+
+    def embed_batch(self, texts):
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+            except Exception as e:
+                if attempt == self.max_retries or not is_rate_limit_error(e):
+                    raise
+                self.report.rate_limited += 1
+                self.report.retries += 1
+                self.bucket.slow_down()
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+                continue
+            self.bucket.speed_up()
+            return texts, vectors
+
+    def embed_numbered(self, batch_id, texts):
+        return (batch_id, *self.embed_batch(texts))
+
+    def run_batches(self, batches, write, name='embedding pipeline'):
+        ''' Embeds (batch_id, texts) pairs, calling write(batch_id, texts, vectors) for every batch as it completes. '''
+        self.report = Embedding_Report(name)
+        batches = deque(batches)
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            try:
+                while batches or in_flight:
+                    while batches and len(in_flight) < self.concurrency:
+                        in_flight.add(pool.submit(self.embed_numbered, *batches.popleft()))
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        batch_id, batch, vectors = future.result()
+                        write(batch_id, batch, vectors)
+                        self.report.texts += len(batch)
+                        self.report.batches += 1
+            except BaseException:
+                for future in in_flight:
+                    future.cancel()
+                raise
+        self.report.finish()
+        return self.report
+
+    def run(self, texts, write, name='embedding pipeline'):
+        ''' Embeds all texts, calling write(texts, vectors) for every batch as it completes. '''
+        batches = ((i, texts[i:i + self.batch_size]) for i in range(0, len(texts), self.batch_size))
+        return self.run_batches(batches, lambda _, batch, vectors: write(batch, vectors), name)
+
+
+class Rate_Limit_Error(Exception):
+    pass
+
+
+class Fake_Embeddings(Embeddings):
+    """
+    Stand-in for the embeddings client in tests and benchmarks: answers embed_documents after `latency`
+    seconds with deterministic vectors, and raises a 429 once more than `requests_per_sec` calls arrive
+    within a second, like the real API.
+    """
+
+    def __init__(self, size=768, latency=0.05, requests_per_sec=None):
+        self.size = size
+        self.latency = latency
+        self.requests_per_sec = requests_per_sec
+        self.calls = 0
+        self.rejected = 0
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    def check_rate(self):
+        if self.requests_per_sec is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.requests_per_sec:
+                self.rejected += 1
+                raise Rate_Limit_Error('429 Resource has been exhausted (e.g. check quota).')
+            self._recent.append(now)
+
+    def embed_documents(self, texts, task_type=None):
+        self.check_rate()
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.vector(text)
+
+    def vector(self, text):
+        rng = random.Random(text)
+        return [rng.uniform(-1, 1) for _ in range(self.size)]
+
+
+def benchmark_embedding_pipeline(texts=6000, batch_size=100, latency=0.5, requests_per_sec=10, concurrency=8):
+    '''
+    Sequential batches (the old loop) against the pipeline on Fake_Embeddings with the given per request
+    latency and server side rate limit, writing into a plain FAISS index.
+    '''
+    import faiss
+    import numpy as np
+    names = [f'file_{i}.txt' for i in range(texts)]
+    lines = []
+
+    fake = Fake_Embeddings(size=64, latency=latency, requests_per_sec=requests_per_sec)
+    index = faiss.IndexFlatL2(fake.size)
+    start = time.perf_counter()
+    for i in range(0, len(names), batch_size):
+        index.add(np.array(fake.embed_documents(names[i:i + batch_size]), dtype=np.float32))
+    sequential = time.perf_counter() - start
+    lines.append(f'sequential: {texts} texts in {sequential:.2f}s ({texts / sequential:.0f} texts/sec)')
+
+    fake = Fake_Embeddings(size=64, latency=latency, requests_per_sec=requests_per_sec)
+    index = faiss.IndexFlatL2(fake.size)
+    # Configured above the server limit on purpose, the backoff has to find the real one.
+    pipeline = Embedding_Pipeline(fake, batch_size, concurrency, requests_per_minute=60 * requests_per_sec * 1.5,
+                                  backoff=0.1)
+    report = pipeline.run(names, lambda batch, vectors: index.add(np.array(vectors, dtype=np.float32)))
+    assert index.ntotal == texts
+    lines.append(f'{report}, speedup {sequential / report.elapsed:.1f}x, {fake.rejected} requests rejected by the server')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(benchmark_embedding_pipeline())
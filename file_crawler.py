@@ -0,0 +1,416 @@
+import os
+import time
+import pickle
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from crawl_rules import dir_identity
+
+
+class Crawl_Report():
+    """Throughput numbers of a single crawl."""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.entries = 0
+        self.dirs = 0
+        self.errors = 0
+        self.elapsed = 0.0
+        self._start = time.perf_counter()
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self._start
+        return self
+
+    @property
+    def entries_per_sec(self):
+        return self.entries / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def dirs_per_sec(self):
+        return self.dirs / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f'{self.name}: {self.entries} entries in {self.dirs} dirs in {self.elapsed:.2f}s '
+                f'({self.entries_per_sec:.0f} entries/sec, {self.dirs_per_sec:.0f} dirs/sec, '
+                f'{self.workers} workers, {self.errors} errors)')
+
+
+class Update_Report(Crawl_Report):
+    """Numbers of an incremental update, dirs counts every directory checked."""
+
+    def __init__(self, name, workers):
+        super().__init__(name, workers)
+        self.relisted = 0
+        self.added = 0
+        self.removed = 0
+
+    def __str__(self):
+        return (f'{self.name}: checked {self.dirs} dirs, re-listed {self.relisted}, '
+                f'+{self.added}/-{self.removed} entries in {self.elapsed:.2f}s ({self.workers} workers, {self.errors} errors)')
+
+
+class Files_Crawler():
+    """
+    Parallel crawler built on os.scandir.
+    Every directory listing is one task on a bounded thread pool, so the roots and all of their
+    subtrees are listed in parallel. The DirEntry objects are handed back as they are, which keeps
+    the file type (and on Windows the stat data) that scandir already fetched.
+
+    With a dir_state dict the crawler also records {dir_path: (mtime_ns, entry_count)} for every directory,
+    which update() uses to re-list only the directories that changed since. The names of a listing are not
+    kept twice: update() reads them, and the subdirectories to check, back from the File_Metadata of the crawl.
+    Crawl_Rules leave out excluded entries and decide about symlinks, loops and filesystem boundaries.
+    With a File_Metadata (or stat_entries set) every listing is also stat'ed in the worker threads, and handed to
+    the File_Metadata.
+    """
+
+    # Directories modified this close to their listing may still change within the same mtime tick
+    # (FAT has 2s resolution), they are stored with mtime -1 so the next update re-lists them.
+    racy_window_ns = 2_000_000_000
+
+    def __init__(self, max_workers=None, rules=None, metadata=None):
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) * 4)
+        # Directories waiting for a worker are kept as plain paths, only this many listings are in flight.
+        self.max_in_flight = self.max_workers * 2
+        self.rules = rules
+        self.metadata = metadata
+        self.stat_entries = metadata is not None
+        self.dir_state = None
+        self.report = None
+        # (st_dev, st_ino) of the entered directories and st_dev of the queued ones, only kept for the rule options.
+        self.entered = set()
+        self.queued_devs = {}
+
+    def start(self, root_paths):
+        self.entered = set()
+        self.queued_devs = {}
+        if self.rules is None or not (self.rules.skip_symlink_loops or self.rules.same_filesystem):
+            return
+        for root_path in root_paths:
+            try:
+                st = os.stat(root_path)
+            except OSError:
+                continue
+            self.entered.add((st.st_dev, st.st_ino))
+            self.queued_devs[root_path] = st.st_dev
+
+    def list_dir(self, dir_path, mtime_ns=None):
+        track = self.dir_state is not None
+        stat_all = self.stat_entries
+        listed_at = time.time_ns()
+        if track and mtime_ns is None:
+            try:
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+            except OSError:
+                return dir_path, mtime_ns, None
+        entries = []
+        try:
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                        if stat_all or (is_dir and track):
+                            # Cached on the DirEntry, free on Windows where FindNextFile already returned it.
+                            entry.stat(follow_symlinks=False)
+                    except OSError:
+                        is_dir = False
+                    entries.append((entry, is_dir))
+        except OSError:
+            return dir_path, mtime_ns, None
+        if self.rules is not None:
+            entries = self.rules.filter(dir_path, entries)
+        if track and listed_at - mtime_ns < self.racy_window_ns:
+            mtime_ns = -1
+        return dir_path, mtime_ns, entries
+
+    def check_dir(self, dir_path, mtime_ns, record, force=False):
+        ''' Lists the directory only if its mtime differs from the recorded one (or force is set). '''
+        if mtime_ns is None:
+            try:
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+            except OSError:
+                return 'gone', dir_path, None, None
+        if not force and record is not None and record[0] == mtime_ns:
+            return 'same', dir_path, mtime_ns, None
+        dir_path, mtime_ns, entries = self.list_dir(dir_path, mtime_ns)
+        return ('error' if entries is None else 'listed'), dir_path, mtime_ns, entries
+
+    def select_subdirs(self, dir_path, entries):
+        ''' The directory entries of a listing to descend into. '''
+        rules = self.rules
+        follow_symlinks = rules is not None and rules.follow_symlinks
+        check_identity = rules is not None and (rules.skip_symlink_loops or rules.same_filesystem)
+        parent_dev = self.queued_devs.pop(dir_path, None)
+        if parent_dev is None and check_identity and rules.same_filesystem:
+            # Directories re-listed by update() whose parent was not listed.
+            try:
+                parent_dev = os.stat(dir_path).st_dev
+            except OSError:
+                pass
+        subdirs = []
+        for entry, is_dir in entries:
+            if not is_dir:
+                continue
+            try:
+                # Same as os.walk(followlinks=False): symlinked directories are indexed but not entered.
+                if not follow_symlinks and entry.is_symlink():
+                    continue
+                identity = dir_identity(entry) if check_identity else None
+                if identity is None:
+                    # A plain directory on Windows stays on its parent's volume and can't close a loop.
+                    if check_identity and rules.same_filesystem and parent_dev is not None:
+                        self.queued_devs[entry.path] = parent_dev
+                else:
+                    dev, ino = identity
+                    if rules.same_filesystem and parent_dev is not None and dev != parent_dev:
+                        rules.count_option('same_filesystem', entry.path)
+                        continue
+                    if rules.skip_symlink_loops:
+                        if (dev, ino) in self.entered:
+                            rules.count_option('skip_symlink_loops', entry.path)
+                            continue
+                        self.entered.add((dev, ino))
+                    if rules.same_filesystem:
+                        self.queued_devs[entry.path] = dev
+            except OSError:
+                continue
+            subdirs.append(entry)
+        return subdirs
+
+    def subdirs_to_visit(self, subdirs):
+        track = self.dir_state is not None
+        for entry in subdirs:
+            yield entry.path, (dir_mtime(entry) if track else None)
+
+    def record_dir(self, dir_path, mtime_ns, entries):
+        self.dir_state[dir_path] = (mtime_ns, len(entries))
+
+    def recorded_subdirs(self, dir_path):
+        ''' Paths of the subdirectories the last listing of dir_path descended into (the ones with a record). '''
+        paths = (os.path.join(dir_path, name) for name in self.metadata.subdir_names(dir_path))
+        return [path for path in paths if path in self.dir_state]
+
+    def iter_listings(self, root_paths, skip=frozenset()):
+        '''
+        Yields (dir_path, [(DirEntry, is_dir), ...], subdirs) for every directory under the roots, subdirs being
+        the DirEntry of the directories descended into. The subtrees of the directory paths in skip are left out.
+        '''
+        self.report = Crawl_Report('scandir crawler', self.max_workers)
+        self.start(root_paths)
+        todo = deque((root_path, None) for root_path in root_paths if root_path not in skip)
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while todo or in_flight:
+                while todo and len(in_flight) < self.max_in_flight:
+                    # LIFO keeps the queue small (depth first), like os.walk.
+                    in_flight.add(pool.submit(self.list_dir, *todo.pop()))
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dir_path, mtime_ns, entries = future.result()
+                    if entries is None:
+                        self.report.errors += 1
+                        continue
+                    self.report.dirs += 1
+                    self.report.entries += len(entries)
+                    subdirs = self.select_subdirs(dir_path, entries)
+                    if self.dir_state is not None:
+                        self.record_dir(dir_path, mtime_ns, entries)
+                    if self.metadata is not None:
+                        self.metadata.set_dir(dir_path, entries)
+                    todo.extend(self.subdirs_to_visit(entry for entry in subdirs if entry.path not in skip))
+                    yield dir_path, entries, subdirs
+        self.report.finish()
+
+    def crawl(self, root_paths, dir_state=None):
+        ''' Returns the {name: [paths]} index of all files and directories under the roots. '''
+        self.dir_state = dir_state
+        file_index = {}
+        for _, entries, _ in self.iter_listings(root_paths):
+            for entry, _ in entries:
+                add_path(file_index, entry.name, entry.path)
+        return file_index
+
+    def update(self, root_paths, file_index, dir_state, refresh=False):
+        '''
+        Brings file_index up to date using the dir_state of an earlier crawl.
+        Unchanged directories cost one stat, only directories whose mtime changed are listed again and the
+        difference is spliced into file_index and dir_state in place.
+        With refresh the given (already crawled) directories are re-listed without looking at their mtime and
+        only directories that are new below them are crawled, which is what the files watcher needs.
+        Needs the File_Metadata the crawl recording dir_state filled, the earlier listings are read from it.
+        Returns the names that are new to the index and the names that are gone from it.
+        '''
+        if self.metadata is None:
+            raise ValueError('update() needs the File_Metadata of the crawl that recorded dir_state.')
+        self.dir_state = dir_state
+        self.report = Update_Report('refresh' if refresh else 'incremental update', self.max_workers)
+        self.start(root_paths)
+        new_names, gone_names = set(), set()
+        if refresh:
+            root_paths = [dir_path for dir_path in root_paths if dir_path in dir_state]
+        todo = deque((root_path, None) for root_path in root_paths)
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while todo or in_flight:
+                while todo and len(in_flight) < self.max_in_flight:
+                    dir_path, mtime_ns = todo.pop()
+                    in_flight.add(pool.submit(self.check_dir, dir_path, mtime_ns, dir_state.get(dir_path), refresh))
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    status, dir_path, mtime_ns, entries = future.result()
+                    if status == 'gone':
+                        self.drop_subtree(dir_path, file_index, new_names, gone_names)
+                        continue
+                    if status == 'error':
+                        self.report.errors += 1
+                        continue
+                    self.report.dirs += 1
+                    if status == 'same':
+                        todo.extend((path, None) for path in self.recorded_subdirs(dir_path))
+                        continue
+                    self.report.relisted += 1
+                    old_names = set(self.metadata.dir_names(dir_path))
+                    old_subdirs = set(self.recorded_subdirs(dir_path))
+                    subdirs = self.select_subdirs(dir_path, entries)
+                    self.record_dir(dir_path, mtime_ns, entries)
+                    self.metadata.set_dir(dir_path, entries)
+                    current = set()
+                    for entry, _ in entries:
+                        current.add(entry.name)
+                        if entry.name not in old_names:
+                            if add_path(file_index, entry.name, entry.path):
+                                new_names.add(entry.name)
+                                gone_names.discard(entry.name)
+                            self.report.added += 1
+                    for name in old_names - current:
+                        if remove_path(file_index, name, os.path.join(dir_path, name)):
+                            gone_names.add(name)
+                            new_names.discard(name)
+                        self.report.removed += 1
+                    for path in old_subdirs - {entry.path for entry in subdirs}:
+                        self.drop_subtree(path, file_index, new_names, gone_names)
+                    if refresh:
+                        subdirs = [entry for entry in subdirs if entry.path not in dir_state]
+                    todo.extend(self.subdirs_to_visit(subdirs))
+        self.report.finish()
+        return new_names, gone_names
+
+    def drop_subtree(self, dir_path, file_index, new_names, gone_names):
+        ''' Removes everything recorded below a directory that no longer exists. '''
+        stack = [dir_path]
+        while stack:
+            dir_path = stack.pop()
+            if self.dir_state.pop(dir_path, None) is None:
+                continue
+            stack.extend(self.recorded_subdirs(dir_path))
+            for name in self.metadata.dir_names(dir_path):
+                if remove_path(file_index, name, os.path.join(dir_path, name)):
+                    gone_names.add(name)
+                    new_names.discard(name)
+                self.report.removed += 1
+            self.metadata.drop_dir(dir_path)
+
+
+def write_dir_state(path, chunks):
+    '''
+    Saves a dir_state from chunks of (dir_path, record) pairs, each pickled on its own so a dir_state being built
+    (see index_shards.py) is never held in memory whole. Written to a temporary file and renamed into place.
+    '''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for chunk in chunks:
+            pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def read_dir_state(path):
+    ''' The {dir_path: record} dict of a write_dir_state() file (or of an older single pickled dict). '''
+    dir_state = {}
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                chunk = pickle.load(f)
+            except EOFError:
+                return dir_state
+            dir_state.update(chunk)
+
+
+def dir_mtime(entry):
+    try:
+        return entry.stat(follow_symlinks=False).st_mtime_ns
+    except OSError:
+        return None
+
+
+def add_path(file_index, name, path):
+    ''' Adds a path to the index (once, a re-listed directory may hand it in again), returns True if the name is new. '''
+    paths = file_index.get(name)
+    if paths is None:
+        file_index[name] = [path]
+        return True
+    if path in paths:
+        return False
+    paths.append(path)
+    # Files_Index returns a copy of the paths of a name it hasn't changed yet.
+    file_index[name] = paths
+    return False
+
+
+def remove_path(file_index, name, path):
+    ''' Removes a path from the index, returns True if the name has no paths left. '''
+    paths = file_index.get(name)
+    if paths is None:
+        return False
+    try:
+        paths.remove(path)
+    except ValueError:
+        return False
+    if not paths:
+        del file_index[name]
+        return True
+    file_index[name] = paths
+    return False
+
+
+def walk_index(root_paths):
+    ''' The original single threaded os.walk indexer, kept as the baseline for benchmarks. '''
+    report = Crawl_Report('os.walk', 1)
+    file_index = {}
+    for root_path in root_paths:
+        for root, dirs, files in os.walk(root_path):
+            report.dirs += 1
+            report.entries += len(dirs) + len(files)
+            for name in files + dirs:
+                if name not in file_index.keys():
+                    file_index[name] = []
+                file_index[name].append(os.path.join(root, name))
+    return file_index, report.finish()
+
+
+def benchmark_crawlers(root_paths, max_workers=None):
+    ''' Crawls the roots with os.walk and with the scandir crawler and compares throughput and results. '''
+    walk_result, walk_report = walk_index(root_paths)
+    crawler = Files_Crawler(max_workers)
+    crawl_result = crawler.crawl(root_paths)
+    same = (walk_result.keys() == crawl_result.keys()
+            and all(sorted(v) == sorted(crawl_result[k]) for k, v in walk_result.items()))
+    speedup = walk_report.elapsed / crawler.report.elapsed if crawler.report.elapsed else 0.0
+    return f'{walk_report}\n{crawler.report}\nspeedup: {speedup:.2f}x, same index: {same}'
+
+
+def benchmark_update(root_paths, max_workers=None):
+    ''' Times a full crawl against an incremental update of the same (unchanged) roots. '''
+    from file_metadata import File_Metadata
+    crawler = Files_Crawler(max_workers, metadata=File_Metadata())
+    dir_state = {}
+    file_index = crawler.crawl(root_paths, dir_state)
+    crawl_report = crawler.report
+    crawler.update(root_paths, file_index, dir_state)
+    return f'{crawl_report}\n{crawler.report}'
+
+
+if __name__ == '__main__':
+    import sys
+    print(benchmark_crawlers(sys.argv[1:] or ['.']))
+    print(benchmark_update(sys.argv[1:] or ['.']))
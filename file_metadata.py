@@ -0,0 +1,323 @@
+import os
+import time
+import pickle
+import threading
+from array import array
+import numpy as np
+
+COLUMNS = {'size': 'q', 'mtime_ns': 'q', 'ext': 'H', 'dir': 'I', 'is_dir': 'B', 'alive': 'B',
+           'name_start': 'Q', 'name_stop': 'Q'}
+MAX_EXTENSIONS = 65535
+
+
+def extension(name):
+    ext = os.path.splitext(name)[1].lower()
+    return ext if len(ext) <= 16 else ''
+
+
+def is_under(path, dir_path):
+    ''' True if path is dir_path or below it, comparing case-insensitively on Windows. '''
+    path, dir_path = os.path.normcase(path), os.path.normcase(dir_path.rstrip('\\/'))
+    return path.startswith(dir_path) and (len(path) == len(dir_path) or path[len(dir_path)] in '\\/')
+
+
+def listing_rows(entries):
+    ''' [(name, is_dir, size, mtime_ns), ...] of a listing of (DirEntry, is_dir), size -1 if the entry can't be stat'ed. '''
+    rows = []
+    for entry, is_dir in entries:
+        try:
+            # Cached on the DirEntry, the crawler already called it in its worker thread.
+            st = entry.stat(follow_symlinks=False)
+            size, mtime_ns = (0 if is_dir else st.st_size), st.st_mtime_ns
+        except OSError:
+            size, mtime_ns = -1, 0
+        rows.append((entry.name, is_dir, size, mtime_ns))
+    return rows
+
+
+class File_Metadata():
+    """
+    Size, mtime and extension of every indexed entry in typed columns (one array per field), so filters like
+    "pdf files modified this week" or "files over 1 GB in Downloads" are a few vectorized numpy comparisons.
+    The crawler hands every directory listing to set_dir(), whose rows replace the earlier rows of that
+    directory. Replaced rows are only marked dead and compacted away on save.
+    Files edited in place keep the size and mtime of the last time their directory was listed.
+    """
+
+    def __init__(self):
+        self.columns = {column: array(typecode) for column, typecode in COLUMNS.items()}
+        self.names = bytearray()
+        self.dir_paths = []
+        self.dir_ids = {}
+        self.dir_rows = {}
+        self.extensions = ['']
+        self.extension_ids = {'': 0}
+        self.dead = 0
+        self._lock = threading.RLock()
+        self._arrays = None
+        self._dir_index = None
+
+    def __len__(self):
+        return len(self.columns['size']) - self.dead
+
+    def dir_id(self, dir_path):
+        i = self.dir_ids.get(dir_path)
+        if i is None:
+            i = self.dir_ids[dir_path] = len(self.dir_paths)
+            self.dir_paths.append(dir_path)
+            self._dir_index = None
+        return i
+
+    def extension_id(self, name):
+        ext = extension(name)
+        i = self.extension_ids.get(ext)
+        if i is None:
+            if len(self.extensions) >= MAX_EXTENSIONS:
+                return 0
+            i = self.extension_ids[ext] = len(self.extensions)
+            self.extensions.append(ext)
+        return i
+
+    def set_dir(self, dir_path, entries):
+        ''' Replaces the rows of a directory with its new listing, [(DirEntry, is_dir), ...]. '''
+        self.set_rows(dir_path, listing_rows(entries))
+
+    def set_rows(self, dir_path, listing):
+        ''' Replaces the rows of a directory with [(name, is_dir, size, mtime_ns), ...], see listing_rows(). '''
+        rows = {column: [] for column in COLUMNS}
+        names = []
+        for name, is_dir, size, mtime_ns in listing:
+            rows['size'].append(size)
+            rows['mtime_ns'].append(mtime_ns)
+            rows['is_dir'].append(is_dir)
+            names.append(name.encode('utf-8', 'surrogatepass'))
+        with self._lock:
+            self.drop_dir(dir_path)
+            d = self.dir_id(dir_path)
+            start = len(self.columns['size'])
+            offset = len(self.names)
+            for (name, *_), encoded in zip(listing, names):
+                rows['ext'].append(self.extension_id(name))
+                rows['name_start'].append(offset)
+                offset += len(encoded)
+                rows['name_stop'].append(offset)
+            rows['dir'] = [d] * len(names)
+            rows['alive'] = [1] * len(names)
+            for column, values in rows.items():
+                self.columns[column].extend(values)
+            self.names += b''.join(names)
+            self.dir_rows[d] = (start, start + len(names))
+            self._arrays = None
+
+    def drop_dir(self, dir_path):
+        ''' Marks the rows of a directory that is gone (or about to be re-listed) as dead. '''
+        with self._lock:
+            d = self.dir_ids.get(dir_path)
+            if d is None or d not in self.dir_rows:
+                return
+            start, stop = self.dir_rows.pop(d)
+            alive = self.columns['alive']
+            for row in range(start, stop):
+                alive[row] = 0
+            self.dead += stop - start
+            self._arrays = None
+
+    def dir_names(self, dir_path, dirs_only=False):
+        ''' Names of the last listing of a directory (only its subdirectories with dirs_only), empty if it has none. '''
+        with self._lock:
+            rows = self.dir_rows.get(self.dir_ids.get(dir_path))
+            if rows is None:
+                return []
+            starts, stops, is_dir = self.columns['name_start'], self.columns['name_stop'], self.columns['is_dir']
+            return [self.name_at(starts[row], stops[row]) for row in range(*rows) if is_dir[row] or not dirs_only]
+
+    def subdir_names(self, dir_path):
+        return self.dir_names(dir_path, dirs_only=True)
+
+    def arrays(self):
+        ''' numpy copies of the columns, rebuilt on the first query after a change. '''
+        with self._lock:
+            if self._arrays is None:
+                self._arrays = {column: np.array(values, dtype=values.typecode) for column, values in self.columns.items()}
+            return self._arrays
+
+    def dir_index(self):
+        ''' (sorted normcased directory paths, their dir ids), rebuilt on the first "under" query after a directory is added. '''
+        with self._lock:
+            if self._dir_index is None:
+                keys = [os.path.normcase(p) for p in self.dir_paths]
+                order = sorted(range(len(keys)), key=keys.__getitem__)
+                self._dir_index = (np.array([keys[d] for d in order], dtype=object), np.array(order, dtype=np.int64))
+            return self._dir_index
+
+    def dirs_under(self, dir_path):
+        ''' Ids of the directories that are dir_path or below it (see is_under), a prefix range of the sorted paths. '''
+        keys, order = self.dir_index()
+        prefix = os.path.normcase(dir_path.rstrip('\\/'))
+        # normcase turns '/' into '\\' on Windows, so everything below the prefix sorts between prefix + sep and the
+        # character after sep.
+        below = order[np.searchsorted(keys, prefix + os.sep):np.searchsorted(keys, prefix + chr(ord(os.sep) + 1))]
+        return np.concatenate([order[np.searchsorted(keys, prefix):np.searchsorted(keys, prefix, 'right')], below])
+
+    def name_at(self, start, stop):
+        return self.names[start:stop].decode('utf-8', 'surrogatepass')
+
+    def compact(self):
+        ''' Drops the dead rows (and the names and directories they held). '''
+        with self._lock:
+            if not self.dead:
+                return
+            columns, names = self.columns, self.names
+            self.columns = {column: array(typecode) for column, typecode in COLUMNS.items()}
+            self.names = bytearray()
+            dir_paths, self.dir_paths, self.dir_ids = self.dir_paths, [], {}
+            dir_rows, self.dir_rows = self.dir_rows, {}
+            for d, (start, stop) in dir_rows.items():
+                new_d = self.dir_id(dir_paths[d])
+                new_start = len(self.columns['size'])
+                for column in ('size', 'mtime_ns', 'ext', 'is_dir', 'alive'):
+                    self.columns[column].extend(columns[column][start:stop])
+                self.columns['dir'].extend([new_d] * (stop - start))
+                base = columns['name_start'][start] if stop > start else 0
+                shift = len(self.names) - base
+                self.columns['name_start'].extend(offset + shift for offset in columns['name_start'][start:stop])
+                self.columns['name_stop'].extend(offset + shift for offset in columns['name_stop'][start:stop])
+                if stop > start:
+                    self.names += names[base:columns['name_stop'][stop - 1]]
+                self.dir_rows[new_d] = (new_start, new_start + stop - start)
+            self.dead = 0
+            self._arrays = None
+            self._dir_index = None
+
+    def query(self, extensions=None, min_size=None, max_size=None, modified_after=None, modified_before=None,
+              under=None, kind=None, name_contains=None, sort_by='mtime', descending=True, limit=50):
+        '''
+        Rows matching every given filter, as [(path, size, mtime_ns, is_dir)] sorted by 'mtime', 'size' or 'name'.
+        extensions are like ['.pdf'], sizes in bytes, modified_after/before are unix times in seconds,
+        under is a directory prefix and kind is 'file' or 'dir'.
+        '''
+        a = self.arrays()
+        mask = a['alive'].astype(bool)
+        if extensions:
+            ids = [self.extension_ids[ext] for ext in (e.lower() if e.startswith('.') else f'.{e.lower()}' for e in extensions)
+                   if ext in self.extension_ids]
+            mask &= np.isin(a['ext'], ids)
+        if min_size is not None:
+            mask &= a['size'] >= min_size
+        if max_size is not None:
+            mask &= a['size'] <= max_size
+        if modified_after is not None:
+            mask &= a['mtime_ns'] >= int(modified_after * 1e9)
+        if modified_before is not None:
+            mask &= a['mtime_ns'] <= int(modified_before * 1e9)
+        if kind is not None:
+            mask &= a['is_dir'] == (kind == 'dir')
+        if under:
+            in_dir = np.zeros(len(self.dir_paths), dtype=bool)
+            in_dir[self.dirs_under(under)] = True
+            mask &= in_dir[a['dir']]
+        rows = np.flatnonzero(mask)
+        if name_contains:
+            needle = name_contains.lower()
+            rows = np.array([r for r in rows.tolist() if needle in
+                             self.name_at(a['name_start'][r], a['name_stop'][r]).lower()], dtype=np.int64)
+        if sort_by == 'name':
+            rows = np.array(sorted(rows.tolist(), key=lambda r: self.name_at(a['name_start'][r], a['name_stop'][r]).lower(),
+                                   reverse=descending), dtype=np.int64)[:limit]
+        else:
+            key = a['size' if sort_by == 'size' else 'mtime_ns'][rows]
+            key = -key if descending else key
+            if len(rows) > limit:
+                # Top-k without sorting every match.
+                top = np.argpartition(key, limit - 1)[:limit]
+                rows, key = rows[top], key[top]
+            rows = rows[np.argsort(key, kind='stable')]
+        return [(os.path.join(self.dir_paths[a['dir'][r]], self.name_at(a['name_start'][r], a['name_stop'][r])),
+                 int(a['size'][r]), int(a['mtime_ns'][r]), bool(a['is_dir'][r])) for r in rows.tolist()]
+
+
+def save_file_metadata(path, metadata):
+    metadata.compact()
+    state = {'columns': metadata.columns, 'names': bytes(metadata.names), 'dir_paths': metadata.dir_paths,
+             'dir_rows': metadata.dir_rows, 'extensions': metadata.extensions}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def write_file_metadata(path, chunks):
+    '''
+    Saves metadata from chunks of (dir_path, rows) pairs (see listing_rows()), each pickled on its own so the
+    metadata of a crawl (see index_shards.py) is never held in memory whole. load_file_metadata() reads it back.
+    '''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for chunk in chunks:
+            pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_file_metadata(path):
+    ''' Loads the saved metadata (of save_file_metadata or write_file_metadata), an empty File_Metadata if there is none yet. '''
+    metadata = File_Metadata()
+    if not os.path.exists(path):
+        return metadata
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                state = pickle.load(f)
+            except EOFError:
+                return metadata
+            if not isinstance(state, list):
+                break
+            for dir_path, rows in state:
+                metadata.set_rows(dir_path, rows)
+    metadata.columns = state['columns']
+    metadata.names = bytearray(state['names'])
+    metadata.dir_paths = state['dir_paths']
+    metadata.dir_ids = {p: i for i, p in enumerate(metadata.dir_paths)}
+    metadata.dir_rows = state['dir_rows']
+    metadata.extensions = state['extensions']
+    metadata.extension_ids = {ext: i for i, ext in enumerate(metadata.extensions)}
+    return metadata
+
+
+def benchmark_file_metadata(rows=2_000_000, queries=20):
+    ''' Latency of filtered top-k queries over generated metadata columns. '''
+    rng = np.random.default_rng(0)
+    metadata = File_Metadata()
+    exts = ['.pdf', '.docx', '.txt', '.jpg', '.exe', '.mp4', '.py', '.zip']
+    per_dir = 50
+    now = time.time_ns()
+    for column, values in (('size', rng.lognormal(10, 3, rows).astype(np.int64)),
+                           ('mtime_ns', now - rng.integers(0, 3 * 365 * 86400, rows) * 1_000_000_000),
+                           ('ext', rng.integers(1, len(exts) + 1, rows)),
+                           ('dir', np.arange(rows) // per_dir), ('is_dir', np.zeros(rows, dtype=np.uint8)),
+                           ('alive', np.ones(rows, dtype=np.uint8)),
+                           ('name_start', np.arange(rows) * 12), ('name_stop', np.arange(rows) * 12 + 12)):
+        metadata.columns[column] = array(COLUMNS[column], values.astype(COLUMNS[column]).tobytes())
+    metadata.names = bytearray(b''.join(f'file_{i:07d}'.encode() for i in range(rows)))
+    metadata.extensions += exts
+    metadata.extension_ids = {ext: i for i, ext in enumerate(metadata.extensions)}
+    home = os.path.join(os.path.abspath(os.sep), 'Users', 'me')
+    metadata.dir_paths = [os.path.join(home, 'Downloads' if d % 10 == 0 else 'Documents', f'folder_{d}')
+                          for d in range(rows // per_dir)]
+    start = time.perf_counter()
+    metadata.arrays()
+    lines = [f'file metadata over {rows} rows: columns ready in {time.perf_counter() - start:.3f}s']
+    week_ago = time.time() - 7 * 86400
+    for label, kwargs in (('pdfs modified this week', {'extensions': ['.pdf'], 'modified_after': week_ago}),
+                          ('largest files', {'sort_by': 'size'}),
+                          ('over 1 GB in Downloads', {'min_size': 2**30, 'under': os.path.join(home, 'Downloads')})):
+        timings = []
+        for _ in range(queries):
+            start = time.perf_counter()
+            found = metadata.query(limit=50, **kwargs)
+            timings.append(time.perf_counter() - start)
+        lines.append(f'  {label}: {len(found)} rows, p50 {1e3 * np.percentile(timings, 50):.2f}ms')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(benchmark_file_metadata())
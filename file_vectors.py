@@ -0,0 +1,653 @@
+import os
+import json
+import time
+import shutil
+
+TOMBSTONES_NAME = 'tombstones.json'
+INDEX_TYPE_NAME = 'index_type.json'
+# Memory-mappable copy of the pickled docstore, see mapped_docstore.py.
+DOCSTORE_NAME = 'docstore.bin'
+# Files of a saved store, the other files in its folder are kept when it is saved again.
+STORE_FILES = ('index.faiss', 'index.pkl', DOCSTORE_NAME)
+# Index types File_Vectors.rebuild() understands, any other faiss.index_factory string is used as it is.
+INDEX_TYPES = ('Flat', 'HNSW', 'IVF-Flat', 'IVF-PQ', 'SQfp16')
+# Fewest vectors the trained index types train on: an IVF list needs a centroid, a PQ codebook its 256 centroids.
+MIN_TRAIN_SIZES = {'IVF-Flat': 1, 'IVF-PQ': 256}
+
+
+def factory_string(index_type, n, d):
+    '''
+    faiss.index_factory string of an index type for n vectors of d dimensions, a flat index when there are too
+    few vectors to train the type (a small root, a store emptied by compaction).
+    '''
+    if n < MIN_TRAIN_SIZES.get(index_type, 0):
+        return 'Flat'
+    # About 4 sqrt(n) lists, but no more than the training sample can fill (faiss wants 39 points per list).
+    nlist = max(1, min(int(4 * n ** 0.5), n // 39))
+    # PQ codes of one byte per 8 dimensions, 32x smaller than float32.
+    m = next(m for m in (d // 8, d // 4, d // 2, d) if m and d % m == 0)
+    return {'Flat': 'Flat', 'HNSW': 'HNSW32', 'IVF-Flat': f'IVF{nlist},Flat', 'IVF-PQ': f'IVF{nlist},PQ{m}',
+            'SQfp16': 'SQfp16'}.get(index_type, index_type)
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    ''' Sets the IVF nprobe and the HNSW efSearch, an index without the parameter ignores it. '''
+    import faiss
+    params = faiss.ParameterSpace()
+    for name, value in (('nprobe', nprobe), ('efSearch', ef_search)):
+        if value is None:
+            continue
+        try:
+            params.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass
+
+
+def index_bytes(index):
+    ''' Memory held by a FAISS index: its codes plus the HNSW links or the IVF centroids and ids. '''
+    import faiss
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return index_bytes(index.storage) + index.hnsw.neighbors.size() * 4
+    size = index.ntotal * getattr(index, 'code_size', 4 * index.d)
+    if isinstance(index, faiss.IndexIVF):
+        size += index_bytes(index.quantizer) + index.ntotal * 8
+    return size
+
+
+def search_parameters(index, selector):
+    ''' SearchParameters restricting a search to the selected rows, with the nprobe / efSearch the index has. '''
+    import faiss
+    index = faiss.downcast_index(index)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def mmap_flags(index_type):
+    '''
+    faiss.read_index flags memory-mapping a saved index of index_type, None if this faiss build can't map it.
+    IO_FLAG_MMAP maps the inverted lists of IVF indexes (every faiss version), IO_FLAG_MMAP_IFC the codes of flat,
+    HNSW and scalar quantizer indexes (newer faiss builds only, faiss-cpu 1.8 doesn't have it).
+    '''
+    import faiss
+    if 'IVF' in index_type:
+        return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    ifc = getattr(faiss, 'IO_FLAG_MMAP_IFC', None)
+    return None if ifc is None else ifc | faiss.IO_FLAG_READ_ONLY
+
+
+def file_stamp(path):
+    ''' Changes whenever a store is saved into the folder. '''
+    st = os.stat(os.path.join(path, DOCSTORE_NAME))
+    return st.st_mtime_ns, st.st_size
+
+
+def iter_vectors(index, rows, chunk_size=100_000):
+    '''
+    (rows, vectors) of the given sorted rows of an index, chunk_size rows at a time. The vectors are decoded,
+    so approximate for quantized indexes.
+    '''
+    import faiss
+    # IVF indexes only reconstruct through a direct map, which would block remove_ids if it was kept.
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    try:
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            vectors = index.reconstruct_n(int(chunk[0]), int(chunk[-1] - chunk[0] + 1))
+            yield chunk, vectors[chunk - chunk[0]]
+    finally:
+        if ivf is not None:
+            ivf.make_direct_map(False)
+
+
+class Compaction_Report():
+    """What a compaction of the FAISS store removed and how much memory it gave back."""
+
+    def __init__(self):
+        self.names = 0
+        self.vectors = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.docstore_bytes = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    @property
+    def reclaimed(self):
+        return self.bytes_before - self.bytes_after + self.docstore_bytes
+
+    def __str__(self):
+        return (f'compaction: {self.vectors} vectors of {self.names} removed names deleted in {self.elapsed:.2f}s, '
+                f'vectors {self.bytes_before / 2**20:.1f} MB -> {self.bytes_after / 2**20:.1f} MB, '
+                f'{self.reclaimed / 2**20:.1f} MB reclaimed')
+
+
+class File_Vectors():
+    """
+    The FAISS store of file names, kept in step with the files index. Vectors are added under their name as
+    docstore id, so the vectors of a name are found without a search (stores saved before that have random ids,
+    the name -> ids map is built from their docstore on first use).
+    Removing a name only tombstones it: searches skip it and adding it back (a rename undone, a file restored)
+    reuses its vector. compact() deletes the vectors of all tombstoned names in one pass over the index, it runs
+    on save once they are compact_ratio of the store.
+    The store starts as a flat (exact) index, rebuild() moves the vectors into another index type (HNSW, IVF,
+    PQ, float16) for less memory or faster queries, searched with the nprobe and ef_search knobs.
+    A store loaded with mapped=True is read through memory maps (see load_file_vectors) and loaded into memory
+    the first time it is changed.
+    Searches can be limited to names with given extensions (apps: .exe, .lnk): the extension of every row is kept
+    in an array next to the index and the search only visits the matching rows, so k results are k matches.
+    """
+
+    # Fewer matching rows than this are searched exactly, a graph or IVF search visiting few of them misses most.
+    exact_filter_rows = 50_000
+
+    def __init__(self, store=None, compact_ratio=0.2, index_type='Flat', nprobe=16, ef_search=64):
+        self.store = store
+        self.compact_ratio = compact_ratio
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.removed = set()
+        self._ids = None
+        self.mapped_path = None
+        self.mapped_stamp = None
+        # (store, extension id of every row) and {extensions: (row extensions, rows, vectors)}, see filter_rows().
+        self.extension_ids = {}
+        self._row_extensions = None
+        self._filtered = {}
+        if store is not None:
+            set_search_params(store.index, nprobe, ef_search)
+
+    def unmap(self):
+        ''' Loads a memory-mapped store into memory, the mapped files are never written. '''
+        if self.mapped_path is None:
+            return
+        from langchain_community.vectorstores import FAISS
+        self.store = FAISS.load_local(self.mapped_path, self.store.embedding_function, allow_dangerous_deserialization=True)
+        set_search_params(self.store.index, self.nprobe, self.ef_search)
+        self.mapped_path = self.mapped_stamp = None
+        self._ids = None
+
+    def refresh(self):
+        ''' Maps the store again if another process saved a new one into its folder. '''
+        if self.mapped_path is None:
+            return
+        try:
+            if file_stamp(self.mapped_path) == self.mapped_stamp:
+                return
+            fresh = load_file_vectors(self.mapped_path, self.store.embedding_function, self.nprobe, self.ef_search, mapped=True)
+        except OSError:
+            # Caught between the renames of a save, the old mapping is still good.
+            return
+        self.store, self.index_type, self.removed = fresh.store, fresh.index_type, fresh.removed
+        self.mapped_stamp = fresh.mapped_stamp
+        self._ids = None
+
+    def __len__(self):
+        if self.store is None:
+            return 0
+        return self.store.index.ntotal - self.removed_vectors()
+
+    def ids(self):
+        ''' name -> docstore ids of its vectors. '''
+        if self._ids is None:
+            self._ids = {}
+            if self.store is not None:
+                docstore = self.store.docstore
+                for id_ in self.store.index_to_docstore_id.values():
+                    self._ids.setdefault(docstore.search(id_).page_content, []).append(id_)
+        return self._ids
+
+    def removed_vectors(self):
+        if not self.removed:
+            return 0
+        ids = self.ids()
+        return sum(len(ids[name]) for name in self.removed)
+
+    def is_live(self, name):
+        return name in self.ids() and name not in self.removed
+
+    def add(self, names, vectors, embeddings):
+        ''' Adds the names that have no live vector yet, returns how many vectors were added. '''
+        from langchain_community.vectorstores import FAISS
+        self.unmap()
+        ids = self.ids()
+        pairs, new_ids = [], []
+        for name, vector in zip(names, vectors):
+            if name in ids:
+                self.removed.discard(name)
+                continue
+            ids[name] = [name]
+            pairs.append((name, vector))
+            new_ids.append(name)
+        if not pairs:
+            return 0
+        if self.store is None:
+            self.store = FAISS.from_embeddings(pairs, embeddings, ids=new_ids)
+        else:
+            self.store.add_embeddings(pairs, ids=new_ids)
+        return len(pairs)
+
+    def remove(self, names):
+        ''' Tombstones the names, returns how many had vectors. '''
+        self.unmap()
+        ids = self.ids()
+        removed = [name for name in names if name in ids and name not in self.removed]
+        self.removed.update(removed)
+        return len(removed)
+
+    def needs_compaction(self):
+        return self.store is not None and self.removed_vectors() > self.compact_ratio * self.store.index.ntotal
+
+    def compact(self):
+        ''' Deletes the vectors of the tombstoned names from the index and the docstore. '''
+        report = Compaction_Report()
+        self.unmap()
+        if self.store is not None:
+            ids = self.ids()
+            doomed = [id_ for name in self.removed for id_ in ids[name]]
+            report.names, report.vectors = len(self.removed), len(doomed)
+            report.bytes_before = index_bytes(self.store.index)
+            report.docstore_bytes = sum(len(name.encode('utf-8', 'surrogatepass')) for name in self.removed)
+            import faiss
+            try:
+                if faiss.try_extract_index_ivf(self.store.index) is not None:
+                    # IVF lists keep the ids of their vectors, remove_ids leaves gaps where the store expects rows 0..n-1.
+                    raise RuntimeError('IVF ids are not renumbered')
+                if doomed:
+                    # One remove_ids call, the index is shifted once whatever the number of names.
+                    self.store.delete(doomed)
+            except RuntimeError:
+                # HNSW graphs can't remove vectors and IVF ids aren't renumbered, the live ones are copied into a new index instead.
+                self.rebuild()
+            else:
+                for name in self.removed:
+                    del ids[name]
+                self._row_extensions = None
+            report.bytes_after = index_bytes(self.store.index)
+        self.removed = set()
+        report.finish()
+        return report
+
+    def rebuild(self, index_type=None, train_size=100_000, chunk_size=100_000):
+        '''
+        Copies the live vectors into a new index of index_type (the current type by default), training it on a
+        random sample of them first. Tombstoned names are left out, so this compacts the store too. A store with
+        too few vectors to train index_type gets a flat index and keeps index_type, the next rebuild trains it.
+        '''
+        import faiss
+        import numpy as np
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+        from langchain_community.vectorstores import FAISS
+        self.unmap()
+        index_type = index_type or self.index_type
+        index, docstore = self.store.index, self.store.docstore
+        name_of = {id_: name for name, ids in self.ids().items() for id_ in ids}
+        rows = np.array([row for row, id_ in sorted(self.store.index_to_docstore_id.items())
+                         if name_of[id_] not in self.removed], dtype=np.int64)
+        new_index = faiss.index_factory(index.d, factory_string(index_type, len(rows), index.d))
+        if not new_index.is_trained:
+            rng = np.random.default_rng(0)
+            sample = np.sort(rng.choice(rows, min(train_size, len(rows)), replace=False))
+            new_index.train(np.concatenate([vectors for _, vectors in iter_vectors(index, sample, chunk_size)]))
+        # Copied a chunk at a time, memory stays at one chunk of float32 vectors on top of the two indexes.
+        for _, vectors in iter_vectors(index, rows, chunk_size):
+            new_index.add(vectors)
+        set_search_params(new_index, self.nprobe, self.ef_search)
+        index_to_id = self.store.index_to_docstore_id
+        ids = [index_to_id[row] for row in rows.tolist()]
+        self.store = FAISS(self.store.embedding_function, new_index, InMemoryDocstore({id_: docstore.search(id_) for id_ in ids}),
+                           dict(enumerate(ids)), distance_strategy=self.store.distance_strategy)
+        self.index_type = index_type
+        self.removed = set()
+        self._ids = None
+
+    def search(self, query, k):
+        ''' Names of the k nearest live vectors. '''
+        self.refresh()
+        if self.store is None:
+            return []
+        docs = self.store.similarity_search(query, self.fetch_k(k))
+        return [doc.page_content for doc in docs if doc.page_content not in self.removed][:k]
+
+    def search_by_vector(self, vector, k, extensions=None):
+        ''' (name, distance) of the k nearest live vectors to an embedded query, nearest first. '''
+        return self.search_by_vectors([vector], k, extensions)[0]
+
+    def search_by_vectors(self, vectors, k, extensions=None):
+        '''
+        search_by_vector() of every row of a query matrix, with one FAISS search call for all of them.
+        extensions (e.g. {'.exe', '.lnk'}) limits the search to names with one of them.
+        '''
+        import faiss
+        import numpy as np
+        self.refresh()
+        if self.store is None:
+            return [[] for _ in vectors]
+        store = self.store
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if extensions is None:
+            distances, rows = store.index.search(vectors, self.fetch_k(k))
+        else:
+            selected, selected_vectors = self.filter_rows(frozenset(extensions))
+            if not len(selected):
+                return [[] for _ in vectors]
+            if selected_vectors is not None:
+                distances, at = faiss.knn(vectors, selected_vectors, min(self.fetch_k(k), len(selected)))
+                rows = np.where(at >= 0, selected[np.maximum(at, 0)], -1)
+            else:
+                params = search_parameters(store.index, faiss.IDSelectorBatch(selected))
+                distances, rows = store.index.search(vectors, self.fetch_k(k), params=params)
+        results = []
+        for row_distances, row_ids in zip(distances.tolist(), rows.tolist()):
+            hits = []
+            for distance, row in zip(row_distances, row_ids):
+                if row < 0:
+                    continue
+                name = store.docstore.search(store.index_to_docstore_id[row]).page_content
+                if name not in self.removed:
+                    hits.append((name, distance))
+            results.append(hits[:k])
+        return results
+
+    def row_extensions(self):
+        ''' Extension id (see extension_ids) of the name of every index row, extended as rows are added. '''
+        import numpy as np
+        from file_metadata import extension
+        store = self.store
+        codes = self._row_extensions[1] if self._row_extensions and self._row_extensions[0] is store else np.zeros(0, np.int32)
+        if len(codes) < store.index.ntotal:
+            names = (store.docstore.search(store.index_to_docstore_id[row]).page_content
+                     for row in range(len(codes), store.index.ntotal))
+            new = np.fromiter((self.extension_ids.setdefault(extension(name), len(self.extension_ids)) for name in names),
+                              dtype=np.int32, count=store.index.ntotal - len(codes))
+            codes = np.concatenate([codes, new])
+            self._row_extensions = (store, codes)
+        return codes
+
+    def filter_rows(self, extensions):
+        '''
+        Rows whose name has one of the extensions, and their (decoded) vectors when there are at most
+        exact_filter_rows of them. With more, the vectors are None and the index is searched with an IDSelector
+        over the rows, an IVF search only reaches the few of them in its nprobe lists.
+        '''
+        import faiss
+        import numpy as np
+        codes = self.row_extensions()
+        cached = self._filtered.get(extensions)
+        if cached is not None and cached[0] is codes:
+            return cached[1], cached[2]
+        wanted = [self.extension_ids[ext] for ext in extensions if ext in self.extension_ids]
+        rows = np.flatnonzero(np.isin(codes, wanted)).astype(np.int64)
+        vectors = None
+        if 0 < len(rows) <= self.exact_filter_rows:
+            index = self.store.index
+            ivf = faiss.try_extract_index_ivf(index)
+            if ivf is not None:
+                ivf.make_direct_map()
+            try:
+                vectors = np.vstack([index.reconstruct(row) for row in rows.tolist()])
+            finally:
+                if ivf is not None:
+                    ivf.make_direct_map(False)
+        self._filtered = {**self._filtered, extensions: (codes, rows, vectors)}
+        return rows, vectors
+
+    def fetch_k(self, k):
+        ''' How many neighbours to ask for so k live ones are likely among them. '''
+        return k + min(len(self.removed), k)
+
+    def save(self, path):
+        '''
+        Saves into a new folder swapped in with renames, so processes mapping the old files keep reading them
+        (on Windows the swap fails while another process maps the store). Other files in the folder, like the
+        embedding job's cursor, are carried over. A store without vectors is saved as a folder without an index.
+        '''
+        from mapped_docstore import write_docstore_file
+        if self.mapped_path is not None:
+            if os.path.abspath(path) == os.path.abspath(self.mapped_path):
+                return
+            self.unmap()
+        tmp_path, old_path = path + '.saving', path + '.old'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if self.store is None:
+            os.makedirs(tmp_path)
+        else:
+            self.store.save_local(tmp_path)
+        with open(os.path.join(tmp_path, TOMBSTONES_NAME), 'w') as f:
+            json.dump(sorted(self.removed), f)
+        with open(os.path.join(tmp_path, INDEX_TYPE_NAME), 'w') as f:
+            json.dump(self.index_type, f)
+        if self.store is not None:
+            index_to_id, docstore = self.store.index_to_docstore_id, self.store.docstore
+            ids = [index_to_id[row] for row in range(self.store.index.ntotal)]
+            write_docstore_file(os.path.join(tmp_path, DOCSTORE_NAME), ids, [docstore.search(id_).page_content for id_ in ids])
+        if os.path.isdir(path):
+            for name in os.listdir(path):
+                if name not in STORE_FILES and not os.path.exists(os.path.join(tmp_path, name)):
+                    shutil.copy2(os.path.join(path, name), tmp_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+
+def load_file_vectors(path, embeddings, nprobe=16, ef_search=64, mapped=False):
+    '''
+    Loads the store saved in the folder. With mapped the FAISS index codes and the docstore are memory-mapped
+    instead of read: loading takes milliseconds, pages are read as queries touch them, and processes loading
+    the same store share them in the page cache. Stores saved before the docstore file existed load in full.
+    '''
+    from langchain_community.vectorstores import FAISS
+    index_type = 'Flat'
+    index_type_path = os.path.join(path, INDEX_TYPE_NAME)
+    if os.path.exists(index_type_path):
+        with open(index_type_path) as f:
+            index_type = json.load(f)
+    if not os.path.exists(os.path.join(path, 'index.faiss')):
+        # Saved without vectors (a root without files yet).
+        vectors = File_Vectors(index_type=index_type, nprobe=nprobe, ef_search=ef_search)
+    elif mapped and os.path.exists(os.path.join(path, DOCSTORE_NAME)):
+        import faiss
+        from mapped_docstore import Mapped_Docstore, Row_Ids
+        stamp = file_stamp(path)
+        flags = mmap_flags(index_type)
+        # Without a mapping flag the index is read (the docstore is still mapped) and the store behaves the same.
+        index = faiss.read_index(os.path.join(path, 'index.faiss'), *(() if flags is None else (flags,)))
+        docstore = Mapped_Docstore(os.path.join(path, DOCSTORE_NAME))
+        vectors = File_Vectors(FAISS(embeddings, index, docstore, Row_Ids(docstore)), index_type=index_type,
+                               nprobe=nprobe, ef_search=ef_search)
+        vectors.mapped_path, vectors.mapped_stamp = path, stamp
+    else:
+        vectors = File_Vectors(FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True),
+                               index_type=index_type, nprobe=nprobe, ef_search=ef_search)
+    tombstones_path = os.path.join(path, TOMBSTONES_NAME)
+    if os.path.exists(tombstones_path):
+        with open(tombstones_path) as f:
+            vectors.removed = set(json.load(f))
+    return vectors
+
+
+def benchmark_file_vectors(names=200_000, removed=0.2, size=64):
+    ''' Deleting removed names one by one from the FAISS store against tombstoning them and compacting once. '''
+    import numpy as np
+    from embedding_pipeline import Fake_Embeddings
+    rng = np.random.default_rng(0)
+    all_names = [f'file_{i}.txt' for i in range(names)]
+    vectors = rng.standard_normal((names, size)).astype(np.float32)
+    gone = [all_names[i] for i in rng.choice(names, int(names * removed), replace=False)]
+    embeddings = Fake_Embeddings(size=size)
+    lines = []
+
+    store = File_Vectors()
+    store.add(all_names, vectors, embeddings)
+    sample = gone[:200]
+    start = time.perf_counter()
+    for name in sample:
+        store.store.delete(store.ids().pop(name))
+    per_name = (time.perf_counter() - start) / len(sample)
+    lines.append(f'delete per name: {1e3 * per_name:.2f}ms each, about {per_name * len(gone):.1f}s for {len(gone)} names')
+
+    store = File_Vectors()
+    store.add(all_names, vectors, embeddings)
+    start = time.perf_counter()
+    store.remove(gone)
+    tombstoned = time.perf_counter() - start
+    query = store.search('file_1.txt', 10)
+    report = store.compact()
+    assert store.store.index.ntotal == names - len(gone) and len(query) == 10
+    lines.append(f'tombstones: {len(gone)} names in {1e3 * tombstoned:.1f}ms, then {report}')
+    return '\n'.join(lines)
+
+
+def benchmark_index_types(names=100_000, queries=500, k=10, nprobes=(8, 32), ef_searches=(32, 128)):
+    '''
+    Build time, memory, single query latency and recall@k against the flat index of every index type, on the
+    local embeddings of generated file names queried with shuffled words of one of them.
+    '''
+    import faiss
+    import numpy as np
+    from local_embeddings import Char_NGram_Embeddings
+    rng = np.random.default_rng(0)
+    words = ['annual', 'budget', 'report', 'invoice', 'resume', 'photo', 'setup', 'notes', 'project', 'draft',
+             'meeting', 'summary', 'final', 'backup', 'client', 'contract', 'design', 'holiday', 'lecture', 'thesis']
+    exts = ['.pdf', '.docx', '.txt', '.jpg', '.xlsx', '.pptx']
+    corpus, query_texts = [], []
+    for i in range(names):
+        ws = [words[j] for j in rng.choice(len(words), 3, replace=False)] + [str(int(rng.integers(0, 10_000)))]
+        corpus.append('_'.join(w.capitalize() for w in ws) + exts[i % len(exts)])
+        if len(query_texts) < queries:
+            rng.shuffle(ws)
+            query_texts.append(' '.join(ws))
+    embeddings = Char_NGram_Embeddings()
+    vectors = embeddings.embed_batch(corpus)
+    query_vectors = embeddings.embed_batch(query_texts)
+    d = vectors.shape[1]
+    flat = faiss.IndexFlatL2(d)
+    flat.add(vectors)
+    _, truth = flat.search(query_vectors, k)
+    lines = [f'index types over {names} names ({d} dimensions), {queries} single queries, recall@{k} against Flat:']
+    faiss.omp_set_num_threads(1)
+    for index_type in INDEX_TYPES:
+        spec = factory_string(index_type, names, d)
+        start = time.perf_counter()
+        index = faiss.index_factory(d, spec)
+        if not index.is_trained:
+            index.train(vectors[rng.choice(names, min(names, 100_000), replace=False)])
+        index.add(vectors)
+        build = time.perf_counter() - start
+        size = faiss.serialize_index(index).nbytes
+        knobs = [{'nprobe': n} for n in nprobes] if 'IVF' in spec else [{'ef_search': e} for e in ef_searches] if 'HNSW' in spec else [{}]
+        for knob in knobs:
+            set_search_params(index, **knob)
+            timings, found = [], 0
+            for q in range(queries):
+                start = time.perf_counter()
+                _, ids = index.search(query_vectors[q:q + 1], k)
+                timings.append(time.perf_counter() - start)
+                found += len(set(ids[0].tolist()) & set(truth[q].tolist()))
+            ms = np.array(timings) * 1e3
+            label = f'{spec} {" ".join(f"{key}={value}" for key, value in knob.items())}'
+            lines.append(f'  {label:22} build {build:6.2f}s, {size / 2**20:7.1f} MB, p50 {np.percentile(ms, 50):.3f}ms, '
+                         f'p99 {np.percentile(ms, 99):.3f}ms, recall@{k} {found / (queries * k):.3f}')
+    return '\n'.join(lines)
+
+
+def benchmark_mapped_load(names=300_000, size=384, processes=3, directory='.', index_types=('Flat', 'IVF-Flat')):
+    '''
+    Load time, first query time and private memory of a saved store loaded in full against memory-mapped, each
+    in its own process as several assistant processes would (private memory is only measured on Linux).
+    Whether flat codes are mapped depends on the faiss build (see mmap_flags), IVF lists always are.
+    '''
+    import sys
+    import subprocess
+    import tempfile
+    import numpy as np
+    from embedding_pipeline import Fake_Embeddings
+    rng = np.random.default_rng(0)
+    all_names = [f'file_{i}_{rng.integers(10**9)}.txt' for i in range(names)]
+    probe = f'''
+import sys, time
+sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})
+import numpy as np
+from file_vectors import load_file_vectors
+from embedding_pipeline import Fake_Embeddings
+start = time.perf_counter()
+vectors = load_file_vectors(sys.argv[1], Fake_Embeddings(size={size}, latency=0), mapped=sys.argv[2] == 'mapped')
+loaded = time.perf_counter() - start
+start = time.perf_counter()
+vectors.search('file_1.txt', 10)
+queried = time.perf_counter() - start
+try:
+    with open('/proc/self/status') as f:
+        private = [int(line.split()[1]) // 1024 for line in f if line.startswith('RssAnon')][0]
+except OSError:
+    private = -1
+print(loaded, queried, private)
+'''
+    import faiss
+    lines = [f'store of {names} names ({size} dimensions), loaded by {processes} processes each, faiss {faiss.__version__}:']
+    vectors = File_Vectors()
+    vectors.add(all_names, rng.standard_normal((names, size)).astype(np.float32), Fake_Embeddings(size=size))
+    for index_type in index_types:
+        if index_type != vectors.index_type:
+            vectors.rebuild(index_type)
+        mapped = 'codes mapped' if mmap_flags(index_type) is not None else 'codes read, docstore mapped'
+        with tempfile.TemporaryDirectory(dir=directory) as folder:
+            path = os.path.join(folder, 'store')
+            vectors.save(path)
+            for mode in ('full', 'mapped'):
+                runs = [subprocess.run([sys.executable, '-c', probe, path, mode], capture_output=True, text=True, check=True)
+                        for _ in range(processes)]
+                loaded, queried, private = np.array([[float(x) for x in run.stdout.split()] for run in runs]).mean(axis=0)
+                memory = f', {private:.0f} MB private memory each' if private >= 0 else ''
+                label = f'{mode} ({mapped})' if mode == 'mapped' else mode
+                lines.append(f'  {index_type:8} {label}: load {loaded:.3f}s, first query {1e3 * queried:.1f}ms{memory}')
+    return '\n'.join(lines)
+
+
+def benchmark_app_filter(names=200_000, apps=0.005, queries=200, k=30, size=128, index_types=('Flat', 'HNSW', 'IVF-Flat')):
+    '''
+    Searching k names and dropping everything but .exe/.lnk afterwards (as update_search_list did for apps)
+    against limiting the search to them: how many of the k results are apps, and the query latency.
+    '''
+    import numpy as np
+    from embedding_pipeline import Fake_Embeddings
+    rng = np.random.default_rng(0)
+    is_app = rng.random(names) < apps
+    all_names = [f'program_{i}.exe' if app else f'document_{i}.pdf' for i, app in enumerate(is_app.tolist())]
+    vectors = rng.standard_normal((names, size)).astype(np.float32)
+    query_vectors = rng.standard_normal((queries, size)).astype(np.float32)
+    extensions = frozenset({'.exe', '.lnk'})
+    lines = [f'{names} names, {is_app.sum()} apps, top {k} of {queries} queries ({size} dimensions):']
+    for index_type in index_types:
+        vectors_store = File_Vectors()
+        vectors_store.add(all_names, vectors, Fake_Embeddings(size=size, latency=0))
+        if index_type != 'Flat':
+            vectors_store.rebuild(index_type)
+        # Builds the extension array and the selected rows once, as the first app search does.
+        vectors_store.filter_rows(extensions)
+        for label, search in (('filter after', lambda q: [name for name, _ in vectors_store.search_by_vector(q, k) if name.endswith('.exe')]),
+                              ('filter inside', lambda q: [name for name, _ in vectors_store.search_by_vector(q, k, extensions)])):
+            start = time.perf_counter()
+            found = [len(search(q)) for q in query_vectors]
+            elapsed = time.perf_counter() - start
+            lines.append(f'  {index_type:8} {label:13}: {np.mean(found):.1f} apps per query, {1e3 * elapsed / queries:.2f}ms per query')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(benchmark_file_vectors())
+    print(benchmark_index_types())
+    print(benchmark_mapped_load())
+    print(benchmark_app_filter())
@@ -0,0 +1,517 @@
+import os
+import mmap
+import time
+import shutil
+import pickle
+import struct
+import tempfile
+import threading
+from array import array
+from path_store import Dir_Interner, Dir_Tree, split_path
+from itertools import accumulate, islice
+from contextlib import contextmanager
+from collections.abc import Mapping, MutableMapping, Sequence
+
+# On-disk layout of the files index (little endian header, arrays in machine byte order, sections 8 byte aligned):
+#   header        : magic, version, name, path and directory counts and the offset of each section
+#   name_offsets  : (names + 1) uint64 offsets into names_blob
+#   names_blob    : utf-8 names, sorted by their encoded bytes
+#   path_starts   : (names + 1) uint64, the paths of name i are path_dirs[path_starts[i]:path_starts[i + 1]]
+#   path_offsets  : (paths + 1) uint64 offsets of the path leaves into paths_blob
+#   paths_blob    : utf-8 leaves (file names) of the paths that are not just the name they are indexed under
+#   path_dirs     : uint32 per path, the directory node of the path, LEAF_IS_NAME set if the leaf is the name
+#   dir_parents   : uint32 per directory node, its parent node (see path_store.Dir_Interner)
+#   dir_offsets   : (dirs + 1) uint64 offsets into dirs_blob
+#   dirs_blob     : utf-8 directory components, each with its trailing separator
+# Version 1 files stored every full path in paths_blob and had no directory sections, they are still read.
+MAGIC = b'SOSFIDX\0'
+VERSION = 2
+PREFIX = struct.Struct('<8sI')
+HEADER = struct.Struct('<8sIIQQQQQQQQQQQQ')
+SECTIONS = ('name_offsets', 'names_blob', 'path_starts', 'path_offsets', 'paths_blob',
+            'path_dirs', 'dir_parents', 'dir_offsets', 'dirs_blob')
+HEADER_V1 = struct.Struct('<8sIIQQQQQQQ')
+SECTIONS_V1 = SECTIONS[:5]
+LEAF_IS_NAME = 0x80000000
+NO_DIR = 0x7FFFFFFF
+
+
+def encode(text):
+    # Windows file names may hold unpaired surrogates, keep them round-trippable.
+    return text.encode('utf-8', 'surrogatepass')
+
+
+def decode(data):
+    return data.decode('utf-8', 'surrogatepass')
+
+
+class Files_Index_File(Mapping):
+    """
+    Read-only {name: [paths]} mapping over a memory-mapped index file.
+    Opening it only reads the header, names are found by binary search over the sorted name table and
+    paths are decoded when asked for, so only the pages a query touches are ever loaded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = PREFIX.unpack_from(self.mm, 0)
+        if magic != MAGIC or version not in (1, VERSION):
+            self.mm.close()
+            raise ValueError(f'{path} is not a files index (version {VERSION}).')
+        self.version = version
+        if version == 1:
+            _, _, _, self.name_count, self.path_count, *offsets = HEADER_V1.unpack_from(self.mm, 0)
+            self.dir_count = 0
+            self.offsets = dict(zip(SECTIONS_V1, offsets))
+        else:
+            _, _, _, self.name_count, self.path_count, self.dir_count, *offsets = HEADER.unpack_from(self.mm, 0)
+            self.offsets = dict(zip(SECTIONS, offsets))
+        view = memoryview(self.mm)
+        self._views = [view]
+        self.name_offsets = self._array(view, 'name_offsets', self.name_count + 1)
+        self.path_starts = self._array(view, 'path_starts', self.name_count + 1)
+        self.path_offsets = self._array(view, 'path_offsets', self.path_count + 1)
+        self.names_base = self.offsets['names_blob']
+        self.paths_base = self.offsets['paths_blob']
+        if version > 1:
+            self.path_dirs = self._array(view, 'path_dirs', self.path_count, 'I')
+            self.dir_offsets = self._array(view, 'dir_offsets', self.dir_count + 1)
+            self.dirs_base = self.offsets['dirs_blob']
+            self.dirs = Dir_Tree(self._array(view, 'dir_parents', self.dir_count, 'I'), self.dir_component)
+
+    def _array(self, view, section, length, typecode='Q'):
+        start = self.offsets[section]
+        part = view[start:start + struct.calcsize(typecode) * length].cast(typecode)
+        self._views.append(part)
+        return part
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self.mm.close()
+
+    def name_at(self, i):
+        return decode(self.mm[self.names_base + self.name_offsets[i]:self.names_base + self.name_offsets[i + 1]])
+
+    def dir_component(self, node):
+        return decode(self.mm[self.dirs_base + self.dir_offsets[node]:self.dirs_base + self.dir_offsets[node + 1]])
+
+    def paths_at(self, i):
+        offsets, base = self.path_offsets, self.paths_base
+        if self.version == 1:
+            return [decode(self.mm[base + offsets[j]:base + offsets[j + 1]])
+                    for j in range(self.path_starts[i], self.path_starts[i + 1])]
+        paths, name = [], None
+        for j in range(self.path_starts[i], self.path_starts[i + 1]):
+            node = self.path_dirs[j]
+            if node & LEAF_IS_NAME:
+                if name is None:
+                    name = self.name_at(i)
+                leaf = name
+            else:
+                leaf = decode(self.mm[base + offsets[j]:base + offsets[j + 1]])
+            node &= ~LEAF_IS_NAME
+            paths.append(leaf if node == NO_DIR else self.dirs.path(node) + leaf)
+        return paths
+
+    def find(self, name):
+        ''' Position of the name in the sorted name table, -1 if it is not there. '''
+        if not isinstance(name, str):
+            return -1
+        key = encode(name)
+        mm, offsets, base = self.mm, self.name_offsets, self.names_base
+        lo, hi = 0, self.name_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if mm[base + offsets[mid]:base + offsets[mid + 1]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.name_count and mm[base + offsets[lo]:base + offsets[lo + 1]] == key:
+            return lo
+        return -1
+
+    def __getitem__(self, name):
+        i = self.find(name)
+        if i < 0:
+            raise KeyError(name)
+        return self.paths_at(i)
+
+    def __contains__(self, name):
+        return self.find(name) >= 0
+
+    def __len__(self):
+        return self.name_count
+
+    def __iter__(self):
+        for i in range(self.name_count):
+            yield self.name_at(i)
+
+    def items(self):
+        for i in range(self.name_count):
+            yield self.name_at(i), self.paths_at(i)
+
+
+class Read_Write_Lock():
+    """
+    Lets any number of readers hold it at once and a writer alone. New readers wait while a writer is waiting, so
+    saves are not starved by a stream of searches, but a thread already reading (iterating the index) can read
+    again without deadlocking.
+    """
+
+    def __init__(self):
+        self.readers = 0
+        self.writers_waiting = 0
+        self.writing = False
+        self._held = threading.local()
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def read(self):
+        held = getattr(self._held, 'count', 0)
+        with self._condition:
+            while self.writing or (self.writers_waiting and not held):
+                self._condition.wait()
+            self.readers += 1
+        self._held.count = held + 1
+        try:
+            yield
+        finally:
+            self._held.count = held
+            with self._condition:
+                self.readers -= 1
+                if not self.readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self.writers_waiting += 1
+            while self.writing or self.readers:
+                self._condition.wait()
+            self.writers_waiting -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.writing = False
+                self._condition.notify_all()
+
+
+class Files_Index(MutableMapping):
+    """
+    The {name: [paths]} files index used by Files_Handler.
+    Reads come from the memory-mapped index file, the names that are changed are kept in a small in-memory
+    overlay until save() writes a new file. Paths read from the file are a fresh list, a caller changing them
+    assigns them back (see file_crawler.add_path).
+    Reads hold the lock for reading and save()/swap() for writing, so the watcher thread saving the index never
+    closes the memory map under a search.
+    """
+
+    def __init__(self, path=None, changes=None):
+        self.path = path
+        self.base = Files_Index_File(path) if path and os.path.exists(path) else None
+        self.changes = dict(changes) if changes else {}
+        self.deleted = set()
+        self.lock = Read_Write_Lock()
+
+    def __getitem__(self, name):
+        with self.lock.read():
+            paths = self.changes.get(name)
+            if paths is not None:
+                return paths
+            if self.base is None or name in self.deleted:
+                raise KeyError(name)
+            return self.base[name]
+
+    def __setitem__(self, name, paths):
+        self.changes[name] = paths
+        self.deleted.discard(name)
+
+    def __delitem__(self, name):
+        with self.lock.read():
+            if name not in self:
+                raise KeyError(name)
+            self.changes.pop(name, None)
+            if self.base is not None and name in self.base:
+                self.deleted.add(name)
+
+    def __contains__(self, name):
+        with self.lock.read():
+            if name in self.changes:
+                return True
+            return self.base is not None and name not in self.deleted and name in self.base
+
+    def __len__(self):
+        with self.lock.read():
+            if self.base is None:
+                return len(self.changes)
+            return len(self.base) - len(self.deleted) + sum(1 for name in list(self.changes) if name not in self.base)
+
+    def __iter__(self):
+        for name, _ in self.sorted_items(values=None):
+            yield name
+
+    def items(self):
+        ''' (name, paths) pairs streamed in file order, without a lookup per name. '''
+        return self.sorted_items()
+
+    def sorted_items(self, values='paths'):
+        '''
+        Yields (name, paths) of the base file merged with the overlay, sorted by encoded name.
+        With values='count' the number of paths is yielded instead (without decoding them), with None nothing.
+        The index is not saved while the items are being read.
+        '''
+        with self.lock.read():
+            yield from self._sorted_items(values)
+
+    def _sorted_items(self, values):
+        # list() copies the keys in one step, other threads may read (and so cache) names meanwhile.
+        changed = sorted((encode(name), name) for name in list(self.changes))
+        changed_value = len if values == 'count' else (lambda paths: paths)
+        c = 0
+        if self.base is not None:
+            base = self.base
+            for i in range(len(base)):
+                key = base.mm[base.names_base + base.name_offsets[i]:base.names_base + base.name_offsets[i + 1]]
+                while c < len(changed) and changed[c][0] < key:
+                    yield changed[c][1], changed_value(self.changes[changed[c][1]])
+                    c += 1
+                if c < len(changed) and changed[c][0] == key:
+                    yield changed[c][1], changed_value(self.changes[changed[c][1]])
+                    c += 1
+                    continue
+                name = decode(key)
+                if name in self.deleted:
+                    continue
+                if values == 'paths':
+                    yield name, base.paths_at(i)
+                elif values == 'count':
+                    yield name, base.path_starts[i + 1] - base.path_starts[i]
+                else:
+                    yield name, None
+        for _, name in changed[c:]:
+            yield name, changed_value(self.changes[name])
+
+    def names(self):
+        return Index_Names(self)
+
+    def close(self):
+        with self.lock.write():
+            if self.base is not None:
+                self.base.close()
+                self.base = None
+
+    def save(self, path=None):
+        ''' Writes the merged index to a new file and reopens this index on it. '''
+        path = path or self.path
+        tmp_path = path + '.tmp'
+        write_files_index(tmp_path, self.sorted_items())
+        self.swap(tmp_path, path)
+
+    def swap(self, new_file, path=None):
+        ''' Replaces the index file with a newly written one, dropping the overlay. '''
+        path = path or self.path
+        with self.lock.write():
+            # An open memory map blocks replacing the file on Windows.
+            if self.base is not None:
+                self.base.close()
+                self.base = None
+            os.replace(new_file, path)
+            self.path = path
+            self.base = Files_Index_File(path)
+            self.changes = {}
+            self.deleted = set()
+
+
+class Index_Names(Sequence):
+    """
+    Names of a Files_Index as a sequence. Membership and iteration use the index directly, the
+    names are only materialized into a list when they are accessed by position (e.g. sliced into batches).
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self._names = None
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __getitem__(self, i):
+        if self._names is None:
+            self._names = list(self.index)
+        return self._names[i]
+
+
+class Spooled_Array():
+    """uint64 (or typecode) array that spills to a temporary file so writing an index needs constant memory."""
+
+    def __init__(self, directory, first=0, typecode='Q'):
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.typecode = typecode
+        self.buffer = array(typecode) if first is None else array(typecode, [first])
+        self.length = len(self.buffer)
+
+    def extend(self, values):
+        self.buffer.extend(values)
+        self.length += len(values)
+
+    def flush(self):
+        self.buffer.tofile(self.file)
+        self.buffer = array(self.typecode)
+
+
+def write_files_index(path, items, chunk=1 << 16):
+    '''
+    Writes an index file from (name, paths) pairs which must already be sorted by encoded name
+    (as Files_Index.sorted_items() yields them). Pairs are written in chunks and the sections are spooled
+    to temporary files, only the directory table (one entry per directory) is held in memory.
+    '''
+    directory = os.path.dirname(os.path.abspath(path))
+    name_offsets, path_starts, path_offsets, dir_offsets = (Spooled_Array(directory) for _ in range(4))
+    path_dirs, dir_parents = (Spooled_Array(directory, None, 'I') for _ in range(2))
+    names_blob, paths_blob, dirs_blob = (tempfile.TemporaryFile(dir=directory) for _ in range(3))
+    interner = Dir_Interner()
+    dir_ids = interner.ids
+    names_size = paths_size = path_count = dirs_size = 0
+    items = iter(items)
+    try:
+        while True:
+            batch = list(islice(items, chunk))
+            if not batch:
+                break
+            names = [name.encode('utf-8', 'surrogatepass') for name, _ in batch]
+            leaves, nodes = [], []
+            for name, ps in batch:
+                n = len(name)
+                for p in ps:
+                    # Fast path for the usual "<directory><separator><name>" path.
+                    if n and len(p) > n and p.endswith(name) and p[-n - 1] in '/\\':
+                        dir_path = p[:-n]
+                        node = dir_ids.get(dir_path)
+                        if node is None:
+                            node = interner.intern(dir_path)
+                        leaves.append(b'')
+                        nodes.append(node | LEAF_IS_NAME)
+                        continue
+                    dir_path, leaf = split_path(p)
+                    node = interner.intern(dir_path) if dir_path else NO_DIR
+                    if leaf == name:
+                        node |= LEAF_IS_NAME
+                        leaf = b''
+                    else:
+                        leaf = leaf.encode('utf-8', 'surrogatepass')
+                    leaves.append(leaf)
+                    nodes.append(node)
+            components = [c.encode('utf-8', 'surrogatepass') for c in interner.take_components()]
+            name_offsets.extend(array('Q', accumulate(map(len, names), initial=names_size))[1:])
+            path_offsets.extend(array('Q', accumulate(map(len, leaves), initial=paths_size))[1:])
+            path_starts.extend(array('Q', accumulate((len(ps) for _, ps in batch), initial=path_count))[1:])
+            dir_offsets.extend(array('Q', accumulate(map(len, components), initial=dirs_size))[1:])
+            path_dirs.extend(array('I', nodes))
+            dir_parents.extend(interner.parents[dir_parents.length:])
+            names_size = name_offsets.buffer[-1]
+            # A batch may add no paths or directories, their offset arrays are then left empty.
+            paths_size = path_offsets.buffer[-1] if path_offsets.buffer else paths_size
+            path_count = path_starts.buffer[-1]
+            dirs_size = dir_offsets.buffer[-1] if dir_offsets.buffer else dirs_size
+            names_blob.write(b''.join(names))
+            paths_blob.write(b''.join(leaves))
+            dirs_blob.write(b''.join(components))
+            for section in (name_offsets, path_starts, path_offsets, path_dirs, dir_parents, dir_offsets):
+                section.flush()
+        sections = [name_offsets, names_blob, path_starts, path_offsets, paths_blob,
+                    path_dirs, dir_parents, dir_offsets, dirs_blob]
+        sizes = [8 * name_offsets.length, names_size, 8 * path_starts.length, 8 * path_offsets.length, paths_size,
+                 4 * path_dirs.length, 4 * dir_parents.length, 8 * dir_offsets.length, dirs_size]
+        offsets, position = [], HEADER.size
+        for size in sizes:
+            position += -position % 8
+            offsets.append(position)
+            position += size
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, 0, name_offsets.length - 1, path_count, len(interner), *offsets))
+            for section, offset in zip(sections, offsets):
+                f.write(b'\0' * (offset - f.tell()))
+                if isinstance(section, Spooled_Array):
+                    section.flush()
+                    section = section.file
+                section.seek(0)
+                shutil.copyfileobj(section, f, 1 << 20)
+    finally:
+        for section in (name_offsets, path_starts, path_offsets, path_dirs, dir_parents, dir_offsets):
+            section.file.close()
+        for section in (names_blob, paths_blob, dirs_blob):
+            section.close()
+
+
+def save_files_index(path, file_index):
+    ''' Saves any {name: [paths]} mapping as an index file and returns a Files_Index opened on it. '''
+    if isinstance(file_index, Files_Index):
+        file_index.save(path)
+        return file_index
+    index = Files_Index(changes=file_index)
+    index.save(path)
+    return index
+
+
+def load_files_index(path, pickle_path=None):
+    ''' Opens the index file, converting an older pickled index if there is no index file yet. '''
+    if not os.path.exists(path) and pickle_path and os.path.exists(pickle_path):
+        with open(pickle_path, 'rb') as f:
+            return save_files_index(path, pickle.load(f))
+    return Files_Index(path)
+
+
+def benchmark_files_index(names=200_000, paths_per_name=3, directory='.'):
+    ''' Compares save/load time, file size and first lookup of the pickle and the memory-mapped index. '''
+    file_index = {f'file_{i:07d}.txt': [f'C:\\Users\\me\\Documents\\project_{i % 97}\\sub_{j}\\file_{i:07d}.txt'
+                                         for j in range(paths_per_name)] for i in range(names)}
+    pickle_path = os.path.join(directory, 'benchmark_index.pkl')
+    index_path = os.path.join(directory, 'benchmark_index.idx')
+    probe = f'file_{names // 2:07d}.txt'
+    lines = []
+    try:
+        start = time.perf_counter()
+        with open(pickle_path, 'wb') as f:
+            pickle.dump(file_index, f)
+        saved = time.perf_counter()
+        with open(pickle_path, 'rb') as f:
+            loaded = pickle.load(f)
+        opened = time.perf_counter()
+        loaded.get(probe)
+        looked_up = time.perf_counter()
+        lines.append(f'pickle : save {saved - start:.3f}s, load {opened - saved:.3f}s, '
+                     f'first lookup {1e6 * (looked_up - opened):.1f}us, {os.path.getsize(pickle_path) / 1e6:.1f} MB')
+        del loaded
+
+        start = time.perf_counter()
+        index = save_files_index(index_path, file_index)
+        index.close()
+        saved = time.perf_counter()
+        index = Files_Index(index_path)
+        opened = time.perf_counter()
+        index.get(probe)
+        looked_up = time.perf_counter()
+        lines.append(f'mmap   : save {saved - start:.3f}s, load {opened - saved:.3f}s, '
+                     f'first lookup {1e6 * (looked_up - opened):.1f}us, {os.path.getsize(index_path) / 1e6:.1f} MB')
+        index.close()
+    finally:
+        for p in (pickle_path, index_path):
+            if os.path.exists(p):
+                os.remove(p)
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(benchmark_files_index())
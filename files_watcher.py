@@ -0,0 +1,229 @@
+import os
+import sys
+import time
+import errno
+import queue
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+
+# inotify(7) event bits
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT = struct.Struct('iIII')
+
+
+class Inotify_Backend():
+    """
+    Linux backend on inotify through libc. inotify is not recursive, so every crawled directory gets a watch
+    (the directories in Files_Handler.dir_state) and new directories are added as their create events come in.
+    Reports the directories whose entries changed. A moved directory's watches are dropped with IN_MOVED_FROM and
+    added again at the new path with IN_MOVED_TO, so events below it are never reported at its old path.
+    """
+
+    mask = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = None
+        self.watches = {}
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def add_watch(self, dir_path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir_path), self.mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                print('logs: inotify watch limit reached, raise fs.inotify.max_user_watches to watch all directories.')
+            return False
+        self.watches[wd] = dir_path
+        return True
+
+    def add_tree(self, dir_path):
+        stack = [dir_path]
+        while stack:
+            dir_path = stack.pop()
+            if not self.add_watch(dir_path):
+                continue
+            try:
+                with os.scandir(dir_path) as it:
+                    stack.extend(entry.path for entry in it if entry.is_dir(follow_symlinks=False))
+            except OSError:
+                pass
+
+    def remove_tree(self, dir_path):
+        ''' Drops the watches of a directory and everything below it. '''
+        prefix = os.path.join(dir_path, '')
+        for wd, path in list(self.watches.items()):
+            if path == dir_path or path.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def start(self, root_paths, dir_paths, on_change):
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        for dir_path in dir_paths:
+            self.add_watch(dir_path)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, args=(on_change,), daemon=True)
+        self._thread.start()
+
+    def _run(self, on_change):
+        while not self._stop_event.is_set():
+            ready, _, _ = select.select([self.fd], [], [], 0.5)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                continue
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0'))
+                offset += EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost, refresh every watched directory.
+                    for dir_path in list(self.watches.values()):
+                        on_change(dir_path)
+                    continue
+                dir_path = self.watches.get(wd)
+                if dir_path is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self.watches[wd]
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    if mask & IN_MOVE_SELF:
+                        # Moved without a watched parent seeing it (a root), its watches hold the old paths.
+                        self.remove_tree(dir_path)
+                    on_change(os.path.dirname(dir_path))
+                    continue
+                if mask & IN_ISDIR and mask & IN_MOVED_FROM:
+                    # The watches below a moved directory keep its old path, they are added again from IN_MOVED_TO.
+                    self.remove_tree(os.path.join(dir_path, name))
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_tree(os.path.join(dir_path, name))
+                on_change(dir_path)
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.watches = {}
+
+
+class Watchdog_Backend():
+    """Backend on the watchdog package (ReadDirectoryChangesW on Windows, FSEvents on macOS), one recursive watch per root."""
+
+    def __init__(self):
+        self.observer = None
+
+    def start(self, root_paths, dir_paths, on_change):
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.event_type not in ('created', 'deleted', 'moved'):
+                    return
+                on_change(os.path.dirname(event.src_path))
+                if event.event_type == 'moved':
+                    on_change(os.path.dirname(event.dest_path))
+
+        self.observer = Observer()
+        for root_path in root_paths:
+            self.observer.schedule(Handler(), root_path, recursive=True)
+        self.observer.start()
+
+    def stop(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+
+
+def default_backend():
+    if sys.platform.startswith('linux'):
+        return Inotify_Backend()
+    return Watchdog_Backend()
+
+
+class Files_Watcher():
+    """
+    Keeps the files index current from filesystem events.
+    The backend reports the directories whose entries changed. Events are debounced (applied once no new event came
+    for `debounce` seconds, or at the latest after `max_delay`), coalesced per directory and handed to
+    apply_changes in batches of at most batch_size directories.
+    """
+
+    def __init__(self, apply_changes, root_paths, dir_paths, backend=None, debounce=1.0, max_delay=10.0, batch_size=200):
+        self.apply_changes = apply_changes
+        self.root_paths = root_paths
+        self.dir_paths = dir_paths
+        self.backend = backend or default_backend()
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self.events = queue.Queue()
+        self.applied_batches = 0
+        self.applied_dirs = 0
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self.backend.start(self.root_paths, self.dir_paths, self.events.put)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        print('logs: Files watcher started.')
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                dirty = {self.events.get(timeout=0.5)}
+            except queue.Empty:
+                continue
+            first = time.monotonic()
+            while time.monotonic() - first < self.max_delay:
+                try:
+                    dirty.add(self.events.get(timeout=self.debounce))
+                except queue.Empty:
+                    break
+            dirty = sorted(dirty)
+            for i in range(0, len(dirty), self.batch_size):
+                try:
+                    self.apply_changes(dirty[i:i + self.batch_size])
+                except Exception as e:
+                    print(f'logs: Files watcher failed to apply changes: {e}')
+                self.applied_batches += 1
+            self.applied_dirs += len(dirty)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self.backend.stop()
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        print(f'logs: Files watcher stopped after {self.applied_dirs} directory changes in {self.applied_batches} batches.')
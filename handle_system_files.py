@@ -1,30 +1,166 @@
 import os
+import time
 import pickle
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from background_load import Background_Load
 from langchain_core.tools import tool
 from typing import Annotated, Literal, List
 from langchain_core.output_parsers import BaseOutputParser
 from langchain_core.prompts import PromptTemplate
-from langchain.retrievers.multi_query import MultiQueryRetriever
 from gemini_llm import llm_gem as llm
+from file_crawler import Files_Crawler, read_dir_state, write_dir_state
+from files_index_store import load_files_index, save_files_index
+from index_shards import Sharded_Index_Builder
+from crawl_rules import load_crawl_rules
+from files_watcher import Files_Watcher
+from file_metadata import File_Metadata, load_file_metadata, save_file_metadata, extension
+from duplicate_finder import Duplicate_Finder, sized_files
+from embedding_pipeline import Embedding_Pipeline
+from embedding_job import Embedding_Job, recover_checkpoint
+from embedding_cache import Embedding_Cache, Cached_Embeddings
+from local_embeddings import Char_NGram_Embeddings
+from file_vectors import File_Vectors, load_file_vectors
+from vector_shards import Vector_Shards
+from query_cache import Query_Cache, normalize_query
+from name_resolver import Name_Resolver, load_name_aliases
+from name_search import Trigram_Index, Stem_Index, SymSpell_Index, BM25_Index, reciprocal_rank_fusion
 from dotenv import load_dotenv
 
 # Load environment variables from the .env file
 load_dotenv()
 
 
+def import_vector_store():
+    # The langchain integrations take seconds to import, they are only needed once the file tools are used.
+    import langchain_community.vectorstores
+    import langchain_google_genai
+
+
 class Files_Handler():
     def __init__(self):
-        self.all_files_path = 'all_files_index.pkl'
+        self.all_files_path = 'all_files_index.idx'
+        self.all_files_pickle_path = 'all_files_index.pkl'
+        # Single FAISS store of every root saved by older versions, split into faiss_shards_path on load.
         self.faiss_all_files_path = 'faiss_index_all_files'
+        self.faiss_shards_path = 'faiss_index_shards'
         self.default_paths_path = 'default_paths.pkl'
-        self.embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+        self.dir_state_path = 'dir_state.pkl'
+        self.file_metadata_path = 'files_metadata.pkl'
+        self.index_shards_path = 'all_files_index_shards'
+        self.index_shard_entries = 500_000
+        self.index_memory_limit = 256 * 2**20
+        self.crawl_rules_path = 'crawl_rules.txt'
+        # Alias -> app names the file search resolves without the LLM (see name_resolver.py).
+        self.name_aliases_path = 'name_aliases.txt'
+        # One request per batch, several in flight, kept under the API quota (see embedding_pipeline.py).
+        self.embedding_batch_size = 100
+        self.embedding_concurrency = 4
+        self.embedding_requests_per_minute = 1500
+        self.embedding_checkpoint_every = 20
+        self.embedding_job = None
+        self.embedding_root = None
+        # 'google' embeds names with the Gemini embeddings API, 'local' with hashed character n-grams on the CPU.
+        self.embedding_backend = os.getenv('EMBEDDING_BACKEND', 'google')
+        if self.embedding_backend == 'local':
+            # CPU bound and no quota: big batches, no rate limit, and a store of its own (the vectors differ).
+            self.embedding_batch_size = 2000
+            self.embedding_concurrency = 2
+            self.embedding_requests_per_minute = 10**9
+            self.faiss_all_files_path = 'faiss_index_all_files_local'
+            self.faiss_shards_path = 'faiss_index_shards_local'
+        self.embedding_model = 'models/embedding-001'
+        # FAISS index the store is moved into after embedding: Flat (exact), HNSW, IVF-Flat, IVF-PQ or SQfp16,
+        # see file_vectors.py. nprobe (IVF) and ef_search (HNSW) trade query speed for recall.
+        self.faiss_index_type = os.getenv('FAISS_INDEX_TYPE', 'Flat')
+        self.faiss_nprobe = 16
+        self.faiss_ef_search = 64
+        # Memory-maps the saved store instead of reading it, processes running the assistant share its pages.
+        self.faiss_mmap = os.getenv('FAISS_MMAP', 'false').lower() == 'true'
+        # Vectors of every name embedded so far, rebuilding the store only sends new names to the API.
+        self.embedding_cache_path = 'embedding_cache'
+        self.watcher = None
+        self.watcher_save_interval = 300
+        self.last_saved = time.monotonic()
+        # Held while the index is changed, the files watcher applies changes from its own thread.
+        self.lock = threading.RLock()
+        self.embeddings = None
         self.root_paths = [r"D:\\",r"C:\\"]
-        self.faiss_all_files = None
-        self.load_files()
-        self.load_faiss_files()
-        self.load_default_paths()
+        # One FAISS store per root path, searched in parallel, with the vectors of removed names tombstoned
+        # until the next compaction (see vector_shards.py).
+        self.file_vectors = Vector_Shards(self.faiss_shards_path, self.root_paths, self.first_path,
+                                          self.new_file_vectors, self.load_shard)
+        self.crawl_report = None
+        self.name_index = None
+        self.stem_index = None
+        self.fuzzy_index = None
+        self.token_index = None
+        # Results of the file search tools by normalized query, invalidated whenever the index or the vectors change.
+        self.query_cache = Query_Cache(max_entries=256, ttl=600)
+        self.name_resolver = Name_Resolver(load_name_aliases(self.name_aliases_path))
+        # Runs the FAISS query while the token index is searched on the calling thread.
+        self.search_pool = ThreadPoolExecutor(max_workers=2)
+        # Everything else is loaded in the background by start_loading(), see load().
+        self.ready = Background_Load(self.load, 'files_handler_load')
+        self.cold_start = {}
+
+    def new_file_vectors(self):
+        return File_Vectors(nprobe=self.faiss_nprobe, ef_search=self.faiss_ef_search)
+
+    def load_shard(self, path, mapped=None):
+        return load_file_vectors(path, self.embeddings, self.faiss_nprobe, self.faiss_ef_search,
+                                 mapped=self.faiss_mmap if mapped is None else mapped)
+
+    def first_path(self, name):
+        paths = self.all_files_index.get(name)
+        return paths[0] if paths else None
+
+    def files_items(self):
+        ''' (name, paths) of every indexed name, without caching them all in the index overlay. '''
+        if hasattr(self.all_files_index, 'sorted_items'):
+            return self.all_files_index.sorted_items()
+        return self.all_files_index.items()
+
+    def start_loading(self):
+        ''' Starts loading the indexes on a background thread, returns at once. '''
+        return self.ready.start()
+
+    def wait_ready(self, timeout=None):
+        ''' Blocks until the background load is done (starting it if needed), re-raising its error if it failed. '''
+        self.ready.wait(timeout)
+        return self
+
+    def load(self):
+        '''
+        Loads everything the file tools need, timing each phase into cold_start. Runs on the loading thread,
+        so the app (and the tools that don't touch files) respond while it runs.
+        '''
+        start = time.perf_counter()
+        phases = [('default paths', self.load_default_paths), ('files index', self.load_files),
+                  ('langchain imports', import_vector_store), ('embeddings client', self.load_embeddings),
+                  ('faiss store', self.load_faiss_files)]
+        for phase, load in phases:
+            phase_start = time.perf_counter()
+            load()
+            self.cold_start[phase] = time.perf_counter() - phase_start
+        self.cold_start['total'] = time.perf_counter() - start
+        print(f'logs: {self.cold_start_report()}')
+
+    def cold_start_report(self):
+        if self.ready.error() is not None:
+            return f'Files handler failed to load: {self.ready.error()}'
+        if 'total' not in self.cold_start:
+            return 'Files handler is still loading.'
+        return 'files handler loaded: ' + ', '.join(f'{phase} {seconds:.2f}s' for phase, seconds in self.cold_start.items())
+
+    def load_embeddings(self):
+        if self.embedding_backend == 'local':
+            self.embeddings = Char_NGram_Embeddings()
+            return
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        cache = Embedding_Cache(f'{self.embedding_cache_path}_{self.embedding_model.split("/")[-1]}', self.embedding_model)
+        self.embeddings = Cached_Embeddings(GoogleGenerativeAIEmbeddings(model=self.embedding_model), cache)
 
 
     def load_default_paths(self):
@@ -50,71 +186,348 @@ class Files_Handler():
             pickle.dump(self.default_paths, f) 
 
     def load_files(self):
-        if not os.path.exists(self.all_files_path):
+        if not (os.path.exists(self.all_files_path) or os.path.exists(self.all_files_pickle_path)):
             print('Fetch all files first and then retry.')
-
-        else:
-            with open(self.all_files_path, 'rb') as f:
-                self.all_files_index = pickle.load(f)  
-        self.all_files = list(self.all_files_index.keys()).copy()
+        # Memory-mapped, only the header is read here. An older pickled index is converted once.
+        self.stored_index = self.all_files_index = load_files_index(self.all_files_path, self.all_files_pickle_path)
+        self.all_files = self.all_files_index.names()
+        # Both grow with the number of directories and files, they are loaded on first use by get_dir_state() and
+        # get_file_metadata(): most sessions never update the index or filter by metadata.
+        self.dir_state = None
+        self.file_metadata = None
   
     def save_files(self):
-        with open(self.all_files_path, 'wb') as f:
-            pickle.dump(self.all_files_index, f)
+        with self.lock:
+            if self.all_files_index is not self.stored_index:
+                # A new crawl replaces the stored index, its memory map has to be released before the file is replaced.
+                self.stored_index.close()
+            self.stored_index = self.all_files_index = save_files_index(self.all_files_path, self.all_files_index)
+            self.all_files = self.all_files_index.names()
+            if self.dir_state is not None:
+                self.save_dir_state()
+            if self.file_metadata is not None:
+                save_file_metadata(self.file_metadata_path, self.file_metadata)
+            self.last_saved = time.monotonic()
+            self.index_changed()
+
+    def index_changed(self):
+        ''' Drops the indexes derived from all_files_index, they are rebuilt from it on next use. '''
+        self.name_index = None
+        self.stem_index = None
+        self.fuzzy_index = None
+        self.token_index = None
+        self.query_cache.bump()
+
+    def get_dir_state(self):
+        with self.lock:
+            if self.dir_state is None:
+                self.dir_state = {}
+                # update() reads the earlier listings from the metadata, without it check_updates() crawls everything.
+                if os.path.exists(self.dir_state_path) and os.path.exists(self.file_metadata_path):
+                    self.dir_state = read_dir_state(self.dir_state_path)
+                if any(len(record) > 2 for record in self.dir_state.values()):
+                    # Older versions kept the names of every directory here too, they are read from the metadata now.
+                    self.dir_state = {dir_path: record[:2] for dir_path, record in self.dir_state.items()}
+            return self.dir_state
+
+    def get_file_metadata(self):
+        with self.lock:
+            if self.file_metadata is None:
+                start = time.perf_counter()
+                self.file_metadata = load_file_metadata(self.file_metadata_path)
+                print(f'logs: Loaded the metadata of {len(self.file_metadata)} entries in {time.perf_counter() - start:.2f}s.')
+            return self.file_metadata
+
+    def get_name_index(self):
+        with self.lock:
+            if self.name_index is None:
+                self.name_index = Trigram_Index(name for name in self.all_files_index if name != 'none')
+                print(f'logs: Built the trigram name index over {len(self.name_index.names)} names in {self.name_index.build_time:.2f}s.')
+            return self.name_index
+
+    def get_stem_index(self):
+        with self.lock:
+            if self.stem_index is None:
+                self.stem_index = Stem_Index(name for name in self.all_files_index if name != 'none')
+                print(f'logs: Built the exact name lookup over {len(self.stem_index)} stems in {self.stem_index.build_time:.2f}s.')
+            return self.stem_index
+
+    def get_fuzzy_index(self):
+        with self.lock:
+            if self.fuzzy_index is None:
+                if hasattr(self.all_files_index, 'sorted_items'):
+                    name_counts = self.all_files_index.sorted_items('count')
+                else:
+                    name_counts = ((name, len(paths)) for name, paths in self.all_files_index.items())
+                self.fuzzy_index = SymSpell_Index((name, count) for name, count in name_counts if name != 'none')
+                print(f'logs: Built the fuzzy name index over {len(self.fuzzy_index.terms)} names in {self.fuzzy_index.build_time:.2f}s.')
+            return self.fuzzy_index
+
+    def get_token_index(self):
+        with self.lock:
+            if self.token_index is None:
+                self.token_index = BM25_Index(name for name in self.all_files_index if name != 'none')
+                print(f'logs: Built the BM25 token index over {len(self.token_index.names)} names in {self.token_index.build_time:.2f}s.')
+            return self.token_index
+
+    def exact_names(self, name, extensions=None, limit=100):
+        '''
+        Names that are the name, or are it without their extension ignoring case ("chrome" -> chrome.exe, Chrome.lnk),
+        with one of the extensions if given. A dict lookup, the fuzzy index is only built for typo searches.
+        '''
+        return self.get_stem_index().lookup(name, extensions, limit)
+
+    def hybrid_search(self, query, k=20, extensions=None):
+        '''
+        Names ranked by the BM25 token index and the FAISS store at once, fused with reciprocal rank fusion.
+        Both only rank names with one of the extensions when they are given.
+        Returns (names, exact), exact is True if the best lexical match holds every word of the query.
+        '''
+        token_index = self.get_token_index()
+        future = self.search_pool.submit(self.file_vectors.search, query, k, extensions)
+        lexical = token_index.search(query, k, extensions)
+        semantic = future.result()
+        exact = bool(lexical) and token_index.covers(query, lexical[0])
+        return reciprocal_rank_fusion([lexical, semantic], limit=k), exact
+
+    def save_dir_state(self):
+        write_dir_state(self.dir_state_path, [self.dir_state])
+
+    def fetch_all_files(self):
+        '''
+        Crawls the root paths straight into the index file, the dir state and the metadata file through sorted
+        on-disk shards, so memory stays under index_memory_limit however many files there are. An interrupted
+        fetch resumes from its last complete shard.
+        '''
+        builder = Sharded_Index_Builder(self.index_shards_path, self.index_shard_entries, self.index_memory_limit,
+                                        rules=load_crawl_rules(self.crawl_rules_path))
+        new_index_file, new_dir_state_file, new_metadata_file = builder.build(
+            self.root_paths, self.all_files_path, self.dir_state_path, self.file_metadata_path, extra={'none': ['none',]})
+        self.crawl_report = builder.report
+        print(f'logs: {self.crawl_report}')
+        with self.lock:
+            self.stored_index.swap(new_index_file, self.all_files_path)
+            self.all_files_index = self.stored_index
+            self.all_files = self.all_files_index.names()
+            os.replace(new_dir_state_file, self.dir_state_path)
+            os.replace(new_metadata_file, self.file_metadata_path)
+            # Read back on first use, see get_dir_state() and get_file_metadata().
+            self.dir_state = None
+            self.file_metadata = None
+            self.index_changed()
 
     def index_files_and_directories(self,root_paths):
-        file_index = {}
-        for root_path in root_paths:
-            for root, dirs, files in os.walk(root_path):
-                for name in files:
-                    if name not in file_index.keys():
-                        file_index[name] = []
-                    file_index[name].append(os.path.join(root, name))
-                for name in dirs:
-                    if name not in file_index.keys():
-                        file_index[name] = []
-                    file_index[name].append(os.path.join(root, name))
-        file_index['none']=['none',]                          
+        self.file_metadata = File_Metadata()
+        crawler = Files_Crawler(rules=load_crawl_rules(self.crawl_rules_path), metadata=self.file_metadata)
+        self.dir_state = {}
+        file_index = crawler.crawl(root_paths, self.dir_state)
+        file_index['none']=['none',]
+        self.crawl_report = crawler.report
+        print(f'logs: {self.crawl_report}')
         return file_index
     
 
+    def embedding_pipeline(self):
+        return Embedding_Pipeline(self.embeddings, self.embedding_batch_size, self.embedding_concurrency,
+                                  self.embedding_requests_per_minute)
+
+    def add_embeddings(self, files, vectors):
+        with self.lock:
+            self.file_vectors.add(files, vectors, self.embeddings)
+        self.query_cache.bump()
+
+    def remove_embeddings(self, files):
+        ''' Tombstones the vectors of names that are gone from the index, compact_embeddings() deletes them. '''
+        with self.lock:
+            removed = self.file_vectors.remove(files)
+        if removed:
+            self.query_cache.bump()
+            print(f'logs: Tombstoned the vectors of {removed} removed names, {len(self.file_vectors.removed)} awaiting compaction.')
+
+    def compact_embeddings(self):
+        with self.lock:
+            if not self.file_vectors.has_vectors():
+                return 'There are no embeddings to compact.'
+            if self.file_vectors.index_types() != {self.faiss_index_type}:
+                return self.rebuild_embeddings_index()
+            report = self.file_vectors.compact()
+            self.file_vectors.save()
+        print(f'logs: {report}')
+        return str(report)
+
+    def rebuild_embeddings_index(self):
+        ''' Moves the FAISS store into an index of type faiss_index_type (training it first), dropping tombstones. '''
+        with self.lock:
+            before = ', '.join(sorted(self.file_vectors.index_types()))
+            start = time.perf_counter()
+            self.file_vectors.rebuild(self.faiss_index_type)
+            self.file_vectors.save()
+        message = (f'Rebuilt the embeddings index from {before} into {self.faiss_index_type} '
+                   f'({len(self.file_vectors)} vectors) in {time.perf_counter() - start:.1f}s.')
+        print(f'logs: {message}')
+        return message
+
     def faiss_index_files_and_directories(self,files):
-        batch_size = 1000  
-        for i in range(0, len(files), batch_size):
-            batch_files = files[i:i + batch_size]
-            if self.faiss_all_files is None:
-                self.faiss_all_files = FAISS.from_texts(batch_files, self.embeddings)
-            else:
-                self.faiss_all_files.add_texts(batch_files)
-                print('added')
+        pipeline = self.embedding_pipeline()
+        pipeline.run(list(files), self.add_embeddings)
+        print(f'logs: {pipeline.report}')
+        print(f'logs: {self.embeddings.report()}')
+
+    def create_embeddings(self, roots=None):
+        '''
+        Starts embedding the file names of each root path (all of them by default) into a new FAISS shard on a
+        background thread, one root after the other. Searches and updates keep using the live shard of a root
+        until its new shard is complete (the names they add or remove meanwhile are replayed into it), the shards
+        of the other roots are not touched. Roots that don't exist on this machine are skipped.
+        '''
+        self.wait_ready()
+        if self.embedding_job is not None and self.embedding_job.state == 'running':
+            return self.embedding_status()
+        roots = self.root_paths if roots is None else roots
+        missing = [root for root in roots if not os.path.exists(root)]
+        if missing:
+            print(f'logs: Not embedding {", ".join(missing)}, not on this machine.')
+            roots = [root for root in roots if root not in missing]
+
+        def run():
+            # Changes from now on are replayed into the new shards, the names below are read after this.
+            for root in roots:
+                self.file_vectors.track_changes(root)
+            try:
+                names = self.file_vectors.group_names(self.files_items())
+            except Exception as e:
+                print(f'logs: Embedding job failed: {e}')
+                for root in roots:
+                    self.file_vectors.drop_changes(root)
+                return
+            for root in roots:
+                # A root that fails keeps its live shard and its .pending checkpoint, the others are still embedded.
+                try:
+                    self.embed_shard(root, names[root])
+                except Exception as e:
+                    self.file_vectors.drop_changes(root)
+                    print(f'logs: Embedding {root} failed: {e}')
+
+        threading.Thread(target=run, daemon=True).start()
+        return 'Creating embeddings in the background.'
+
+    def embed_shard(self, root, names):
+        '''
+        Embeds the names of one root into a new shard, checkpointed every embedding_checkpoint_every batches
+        in a folder of its own (starting again after a crash resumes from the last checkpoint), and swaps it in.
+        '''
+        path = self.file_vectors.shard_path(root) + '.pending'
+        recover_checkpoint(path)
+        shard = [self.load_shard(path, mapped=False) if os.path.exists(path) else self.new_file_vectors()]
+        self.embedding_root = root
+        self.embedding_job = Embedding_Job(path, self.embedding_pipeline(), self.embedding_checkpoint_every)
+
+        def write(batch, vectors):
+            shard[0].add(batch, vectors, self.embeddings)
+
+        def save(path):
+            shard[0].save(path)
+
+        def reset():
+            shard[0] = self.new_file_vectors()
+
+        def remove(stale):
+            shard[0].remove(stale)
+
+        report = self.embedding_job.run(names, write, save, reset, remove)
+        print(f'logs: {root} {report}')
+        print(f'logs: {self.embeddings.report()}')
+        if shard[0].store is not None and shard[0].index_type != self.faiss_index_type:
+            shard[0].rebuild(self.faiss_index_type)
+        self.file_vectors.replace(root, shard[0])
+        self.query_cache.bump()
+        with self.file_vectors.locks[root]:
+            shard[0].save(self.file_vectors.shard_path(root))
+        shutil.rmtree(path)
+
+    def embedding_status(self):
+        if self.embedding_job is None:
+            return 'No embedding job is running.'
+        return f'{self.embedding_root}: {self.embedding_job.status()}, {self.embeddings.report()}'
 
     
     def load_faiss_files(self):
-        if not os.path.exists(self.faiss_all_files_path):
+        self.file_vectors.load(self.embeddings)
+        recover_checkpoint(self.faiss_all_files_path)
+        if os.path.exists(os.path.join(self.faiss_all_files_path, 'index.faiss')):
+            # Stores saved before the shards are split once, their vectors are not embedded again.
+            self.file_vectors.split(self.load_shard(self.faiss_all_files_path, mapped=False), self.files_items())
+            shutil.rmtree(self.faiss_all_files_path)
+        if not self.file_vectors.has_vectors():
             print('Fetch all files first and then retry.')
-        else:
-            self.faiss_all_files = FAISS.load_local(self.faiss_all_files_path, self.embeddings, allow_dangerous_deserialization=True) 
 
     def save_faiss_files(self):
-        self.faiss_all_files.save_local(self.faiss_all_files_path)
+        self.file_vectors.save()
 
 
     def check_updates(self):
-        new_all_files_index = self.index_files_and_directories(self.root_paths)
-        new_all_files = list(new_all_files_index.keys()).copy()
-        updates = set(new_all_files) - set(self.all_files.copy())
-        print(f'updates : {list(updates)}')
-        self.all_files_index = new_all_files_index
-        self.all_files = list(self.all_files_index.keys()).copy()
-        self.save_files()
-        self.faiss_index_files_and_directories(list(updates))
-        self.save_faiss_files()
+        with self.lock:
+            if not self.get_dir_state():
+                # No directory state from an earlier crawl yet, do a full crawl which records it.
+                new_all_files_index = self.index_files_and_directories(self.root_paths)
+                updates = {name for name in new_all_files_index if name not in self.all_files}
+                gone = {name for name in self.all_files if name not in new_all_files_index}
+                self.all_files_index = new_all_files_index
+            else:
+                crawler = Files_Crawler(rules=load_crawl_rules(self.crawl_rules_path), metadata=self.get_file_metadata())
+                updates, gone = crawler.update(self.root_paths, self.all_files_index, self.dir_state)
+                self.crawl_report = crawler.report
+                print(f'logs: {self.crawl_report}')
+            print(f'updates : {list(updates)}')
+            self.save_files()
+            self.remove_embeddings(gone)
+            self.faiss_index_files_and_directories(list(updates))
+            self.save_faiss_files()
         return f'Update Done.'
 
+    def apply_file_changes(self, dir_paths):
+        ''' Re-lists directories the files watcher saw change and adds the new names to the FAISS store. '''
+        with self.lock:
+            crawler = Files_Crawler(rules=load_crawl_rules(self.crawl_rules_path), metadata=self.get_file_metadata())
+            updates, gone = crawler.update(dir_paths, self.all_files_index, self.get_dir_state(), refresh=True)
+            print(f'logs: {crawler.report}')
+            if updates or gone:
+                self.index_changed()
+            if gone:
+                self.remove_embeddings(gone)
+            if updates and self.file_vectors.has_vectors():
+                self.faiss_index_files_and_directories(sorted(updates))
+            # Saving rewrites the whole index file, so the watcher only does it every few minutes.
+            if time.monotonic() - self.last_saved > self.watcher_save_interval:
+                self.save_files()
+                if self.file_vectors.has_vectors():
+                    self.save_faiss_files()
+
+    def start_watcher(self):
+        self.wait_ready()
+        if self.watcher is not None:
+            return 'Files watcher is already running.'
+        if not self.get_dir_state():
+            return 'Fetch all files first and then start the files watcher.'
+        self.watcher = Files_Watcher(self.apply_file_changes, self.root_paths, list(self.dir_state))
+        self.watcher.start()
+        return 'Files watcher started.'
+
+    def stop_watcher(self):
+        if self.watcher is None:
+            return 'Files watcher is not running.'
+        self.watcher.stop()
+        self.watcher = None
+        self.save_files()
+        if self.file_vectors.has_vectors():
+            self.save_faiss_files()
+        return 'Files watcher stopped.'
+
 
 
 
 files_handler = Files_Handler()
+files_handler.start_loading()
 
 
 
@@ -159,6 +572,7 @@ def get_default_paths(
 
     Remember when user asks to open any app or important directories like (Desktop, downloads etc.), you have to consider this tool first among others.
     '''
+    files_handler.wait_ready()
     if operation == 'get':
         available = f'The readily available apps/files and their paths are:\n'
         available += ('\n').join([f'{k} : {v}' for k, v in files_handler.default_paths.items()])
@@ -196,6 +610,9 @@ class LineListOutputParser(BaseOutputParser[List[str]]):
         return list(filter(None, lines))      
      
 
+APP_EXTENSIONS = frozenset({'.exe', '.lnk'})
+
+
 @tool('Update_SearchList_Tool')
 def update_search_list(
 name : Annotated[str,'''The name of the file or directory the user asked for. This name is used for generating multiple names for searching in the available files from database. 
@@ -210,6 +627,7 @@ is_app : Annotated[Literal['True', 'False'],''' Set it to "True" if you are sear
     Whenever user asks to open for a file or directory, update the search list first using this tool instead of opening file directly.
     You can also use this tool for searching only if user don't know the exact name of file or folder. Otherwise do search with search tool.
     """
+    files_handler.wait_ready()
     output_parser = LineListOutputParser()
     
 
@@ -226,19 +644,54 @@ is_app : Annotated[Literal['True', 'False'],''' Set it to "True" if you are sear
 
     llm_chain = QUERY_PROMPT | llm | output_parser
     
-    retriever = MultiQueryRetriever(
-             retriever=files_handler.faiss_all_files.as_retriever(search_kwargs={"k": int(n)}), llm_chain=llm_chain, parser_key="lines"
-                )  
-    docs =retriever.invoke({'question':name})
-    files_ = [doc.page_content for doc in docs]
-    files = []
-    for f in files_:
-        if f not in files_handler.all_files:
-            continue
-        if eval(is_app):
-            if (len(f)<4) or (f[-4:] not in ['.exe', '.lnk']):
-                continue
-        files.append(f)     
+    timings = {}
+    # Apps are searched for among .exe and .lnk names only, inside the indexes, so n results are n apps.
+    extensions = APP_EXTENSIONS if eval(is_app) else None
+
+    def exact(query):
+        return files_handler.exact_names(query, extensions, int(n))
+
+    def alias(query):
+        return list(dict.fromkeys(f for alias_name in files_handler.name_resolver.alias_names(query)
+                                  for f in files_handler.exact_names(alias_name, extensions, int(n))))
+
+    def lexical(query):
+        # Confident when the best name holds every word of the query.
+        token_index = files_handler.get_token_index()
+        files_ = token_index.search(query, int(n), extensions)
+        return files_ if files_ and token_index.covers(query, files_[0]) else []
+
+    def expansion(query):
+        start = time.perf_counter()
+        files_, _ = files_handler.hybrid_search(query, int(n), extensions)
+        timings['hybrid'] = time.perf_counter() - start
+        start = time.perf_counter()
+        names = llm_chain.invoke({'question': query})
+        timings['llm'] = time.perf_counter() - start
+        # All the generated names are embedded in one request and searched as one query matrix.
+        found = files_handler.file_vectors.search_many(names, int(n), timings, extensions)
+        return reciprocal_rank_fusion([files_, list(dict.fromkeys(f for fs in found for f in fs))])
+
+    def search():
+        # The cheapest tier sure of the name answers, the LLM only expands names none of the others resolve.
+        files_, tier, seconds = files_handler.name_resolver.resolve(
+            name, [('exact', exact), ('alias', alias), ('lexical', lexical), ('expansion', expansion)])
+        timings[tier] = seconds
+        start = time.perf_counter()
+        # Names gone from the index since their vectors were added, a dict lookup in step with the index.
+        stem_index = files_handler.get_stem_index()
+        files = [f for f in files_ if f in stem_index]
+        timings['filter'] = time.perf_counter() - start
+        saved = files_handler.name_resolver.saved(seconds)
+        if tier != 'expansion' and saved is not None:
+            print(f'logs: "{name}" answered by the {tier} tier, about {1e3 * saved:.0f}ms faster than the LLM expansion.')
+        return files
+
+    start = time.perf_counter()
+    files = files_handler.query_cache.lookup(('update_search_list', normalize_query(name), int(n), is_app), search)
+    timings = timings or {'cached': time.perf_counter() - start}
+    print(f'logs: update_search_list "{name}": ' + ', '.join(f'{step} {1e3 * seconds:.0f}ms' for step, seconds in timings.items()))
+    print(f'logs: {files_handler.query_cache.report()}, {files_handler.name_resolver.report()}')
     empty_search_list()
     search_list.extend(files)
     paths = [files_handler.all_files_index.get(k,'none') for k in search_list]
@@ -253,6 +706,10 @@ is_app : Annotated[Literal['True', 'False'],''' Set it to "True" if you are sear
 @tool('File_Searching_Tool')    
 def search_files(
     name : Annotated[str,'''The name of object the user wants to search. '''],
+    mode : Annotated[Literal['auto', 'substring', 'prefix', 'fuzzy', 'hybrid', 'semantic'],'''How to match the name. 'substring' and 'prefix' look the exact fragment up in the local name index, which is instant.
+                     'fuzzy' finds names within two typos of the name (e.g. "chorme" finds chrome.exe). 'semantic' searches for similar names with embeddings.
+                     'hybrid' ranks names by their words (in any order, e.g. "budget report 2023" finds Report_Budget_2023.xlsx) together with the semantic search.
+                     'auto' tries the exact fragment first, then the fuzzy lookup, and falls back to the hybrid search if neither finds a name. Defaults to 'auto'.''']='auto',
 )->str:     
     
     '''
@@ -260,9 +717,28 @@ Implements a search algorithm to find and display files or directories based on
 Use this tool only when the user requests to search for a specific file or folder by name. Do not use this tool for opening files or directories.
 After obtaining the list of available files from this tool, display them neatly, each separated by a new line, and ask the user if they want to open any of these files.
     '''
-    retriever = files_handler.faiss_all_files.as_retriever(search_kwargs={"k": 100})
-    docs = retriever.invoke(name)
-    files = [doc.page_content for doc in docs]
+    files_handler.wait_ready()
+
+    def search():
+        files = []
+        if mode in ('auto', 'substring', 'prefix'):
+            files = files_handler.get_name_index().search(name, 'prefix' if mode == 'prefix' else 'substring', limit=100)
+            print(f'logs: {len(files)} names matched "{name}" in the name index ({mode}).')
+        if not files and mode in ('auto', 'fuzzy'):
+            matches = files_handler.get_fuzzy_index().lookup(name, max_distance=2, limit=100)
+            files = [match for match, _, _ in matches]
+            print(f'logs: {len(files)} names within {max((d for _, d, _ in matches), default=0)} typos of "{name}" in the fuzzy index.')
+        if not files and mode in ('auto', 'hybrid'):
+            files, _ = files_handler.hybrid_search(name, k=20)
+            print(f'logs: {len(files)} names from the hybrid search for "{name}".')
+        if not files and mode == 'semantic':
+            files = files_handler.file_vectors.search(name, 100)
+        return files
+
+    # The name index matches the fragment with its spaces, only its case is normalized for those modes.
+    query = name.lower() if mode in ('auto', 'substring', 'prefix') else normalize_query(name)
+    files = files_handler.query_cache.lookup(('search_files', query, mode), search)
+    print(f'logs: {files_handler.query_cache.report()}')
     paths = [files_handler.all_files_index.get(k,'none') for k in files]
     ans = f'The available files and their paths are:\n{('\n').join([f'{a} : {k}' for a,k in zip(files,paths)])}.'
     print(f'logs: {ans}')
@@ -270,6 +746,78 @@ After obtaining the list of available files from this tool, display them neatly,
 
     
 
+#### Tool for filtering files by size, date and type
+@tool('File_Metadata_Tool')
+def query_file_metadata(
+    extensions : Annotated[str,'''Comma separated file extensions to keep, e.g. ".pdf,.docx". Empty for any type.''']='',
+    min_size_mb : Annotated[float,'''Only files of at least this many megabytes (1 GB = 1024). Defaults to no limit.''']=None,
+    max_size_mb : Annotated[float,'''Only files of at most this many megabytes. Defaults to no limit.''']=None,
+    modified_within_days : Annotated[float,'''Only files modified in the last this many days (7 for "this week"). Defaults to any time.''']=None,
+    modified_before_days : Annotated[float,'''Only files last modified more than this many days ago. Defaults to any time.''']=None,
+    under_path : Annotated[str,'''Only files inside this folder. Can be a full path or a name from default paths like 'downloads' or 'desktop'. Empty for everywhere.''']='',
+    kind : Annotated[Literal['file', 'dir', 'any'],''''file' for files only, 'dir' for folders only, 'any' for both. Defaults to 'file'.''']='file',
+    sort_by : Annotated[Literal['mtime', 'size', 'name'],'''Order of the results: 'mtime' newest first, 'size' largest first, 'name' alphabetical. Defaults to 'mtime'.''']='mtime',
+    limit : Annotated[int,'''How many files to return. Defaults to 30.''']=30,
+)->str:
+
+    '''
+Finds files by their size, last modified date, type and folder, e.g. "PDFs I modified this week" or "files over 1 GB in Downloads" or "largest videos".
+Use this tool instead of PowerShell commands for such questions. All filters are optional and combined.
+    '''
+    files_handler.wait_ready()
+    metadata = files_handler.get_file_metadata()
+    if not len(metadata):
+        return 'No file sizes and dates are recorded yet. Ask the user to fetch all files once, then retry.'
+    now = time.time()
+    under_path = files_handler.default_paths.get(under_path.lower(), under_path) if under_path else None
+    rows = metadata.query(
+        extensions=[e.strip() for e in extensions.split(',') if e.strip()],
+        min_size=None if min_size_mb is None else min_size_mb * 2**20,
+        max_size=None if max_size_mb is None else max_size_mb * 2**20,
+        modified_after=None if modified_within_days is None else now - modified_within_days * 86400,
+        modified_before=None if modified_before_days is None else now - modified_before_days * 86400,
+        under=under_path, kind=None if kind == 'any' else kind,
+        sort_by=sort_by, descending=sort_by != 'name', limit=limit)
+    if not rows:
+        return 'No files match these filters.'
+    lines = [f'{path} : {size / 2**20:.1f} MB, modified {time.strftime("%Y-%m-%d %H:%M", time.localtime(mtime_ns / 1e9))}'
+             for path, size, mtime_ns, _ in rows]
+    ans = 'The matching files are:\n' + '\n'.join(lines)
+    print(f'logs: {ans}')
+    return ans
+
+
+
+#### Tool for finding duplicate files
+@tool('Duplicate_Files_Tool')
+def find_duplicate_files(
+    under_path : Annotated[str,'''Only look for duplicates inside this folder. Can be a full path or a name from default paths like 'downloads' or 'desktop'. Empty for all indexed files.''']='',
+    min_size_mb : Annotated[float,'''Ignore files smaller than this many megabytes. Defaults to 1.''']=1,
+    max_groups : Annotated[int,'''How many duplicate groups to return, the ones freeing the most space first. Defaults to 20.''']=20,
+)->str:
+
+    '''
+Finds files with identical content (duplicates) and how much space deleting the extra copies would free.
+Use this tool instead of PowerShell commands when the user asks about duplicate files or cleaning them up.
+Never delete anything yourself, show the groups and let the user choose which copies to remove.
+    '''
+    files_handler.wait_ready()
+    under_path = files_handler.default_paths.get(under_path.lower(), under_path) if under_path else None
+    files = sized_files(files_handler.all_files_index, files_handler.get_file_metadata(), under_path)
+    finder = Duplicate_Finder()
+    groups = finder.find(files, min_size=max(1, int(min_size_mb * 2**20)))
+    print(f'logs: {finder.report}')
+    if not groups:
+        return 'No duplicate files found.'
+    lines = [f'{len(groups)} groups of duplicates, {finder.report.reclaimable / 2**20:.1f} MB can be freed by keeping one copy of each.']
+    for size, paths in groups[:max_groups]:
+        lines.append(f'{len(paths)} copies of {size / 2**20:.1f} MB:\n' + '\n'.join(f'  {path}' for path in paths))
+    ans = '\n'.join(lines)
+    print(f'logs: {ans}')
+    return ans
+
+
+
 #### Tool to open file
 @tool('File_Opening_Tool')
 def open_file_or_dir(
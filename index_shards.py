@@ -0,0 +1,208 @@
+import os
+import json
+import heapq
+import pickle
+import shutil
+import struct
+from file_crawler import Files_Crawler, write_dir_state
+from file_metadata import listing_rows, write_file_metadata
+from files_index_store import write_files_index, encode, decode
+
+RECORD = struct.Struct('<II')
+# Sidecars of older builds hold (dir_path, record) only, such a build starts from scratch.
+MANIFEST_VERSION = 3
+# Rough size of one buffered (name, path) pair on top of the encoded bytes: tuple and two bytes objects.
+ENTRY_OVERHEAD = 130
+# Rough size of one buffered directory record (tuple, path, record, subdirs list) and of each metadata row in it.
+DIR_OVERHEAD = 250
+ROW_OVERHEAD = 150
+
+
+class Sharded_Index_Builder():
+    """
+    Builds the files index while crawling without keeping it in memory.
+    (name, path) pairs are buffered and flushed as sorted shard files whenever the buffer holds shard_entries
+    pairs or about max_memory bytes (directory records included). Every shard has a sidecar with the state,
+    subdirectories and metadata rows of the directories it covers and is only listed in the manifest once both
+    are on disk, so an interrupted build resumes after the last complete shard without entering the subtrees
+    finished before. build() merges the shards (external merge sort) straight into the index file and streams
+    the directory state and the metadata out of the sidecars a shard at a time, so memory follows max_memory
+    and the crawl frontier, not the number of files.
+    """
+
+    def __init__(self, work_dir, shard_entries=500_000, max_memory=256 * 2**20, max_workers=None, rules=None):
+        self.work_dir = work_dir
+        self.rules = rules
+        self.shard_entries = shard_entries
+        self.max_memory = max_memory
+        self.max_workers = max_workers
+        self.manifest_path = os.path.join(work_dir, 'manifest.json')
+        self.report = None
+
+    def load_manifest(self, root_paths, record_metadata):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if manifest['roots'] == list(root_paths) and manifest.get('version') == MANIFEST_VERSION and \
+                    manifest['metadata'] == record_metadata:
+                return manifest
+            print('logs: Root paths or shard format changed, starting the index build from scratch.')
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        os.makedirs(self.work_dir)
+        return {'roots': list(root_paths), 'shards': [], 'version': MANIFEST_VERSION, 'metadata': record_metadata}
+
+    def save_manifest(self, manifest):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def shard_path(self, shard):
+        return os.path.join(self.work_dir, shard)
+
+    def read_dir_records(self, shard):
+        '''
+        (dir_path, (mtime_ns, entry_count), subdir paths, metadata rows) of every directory of a complete shard,
+        rows are None without a File_Metadata.
+        '''
+        with open(self.shard_path(shard) + '.dirs', 'rb') as f:
+            return pickle.load(f)
+
+    def iter_dir_records(self, manifest):
+        for shard in manifest['shards']:
+            yield from self.read_dir_records(shard)
+
+    def flush(self, manifest, buffer, dir_records):
+        shard = f'shard_{len(manifest["shards"]):05d}'
+        path = self.shard_path(shard)
+        buffer.sort()
+        with open(path, 'wb') as f:
+            for name, p in buffer:
+                f.write(RECORD.pack(len(name), len(p)))
+                f.write(name)
+                f.write(p)
+        with open(path + '.dirs', 'wb') as f:
+            pickle.dump(dir_records, f)
+        manifest['shards'].append(shard)
+        self.save_manifest(manifest)
+
+    def read_shard(self, shard):
+        with open(self.shard_path(shard), 'rb') as f:
+            while True:
+                header = f.read(RECORD.size)
+                if not header:
+                    return
+                name_size, path_size = RECORD.unpack(header)
+                yield f.read(name_size), f.read(path_size)
+
+    def crawl(self, root_paths, record_metadata=False):
+        '''
+        Crawls the roots into shards, with the metadata rows of every listing in the sidecars if record_metadata
+        is set. Directories already in complete shards are not written again, and the ones whose whole subtree
+        is in them are not entered at all.
+        '''
+        manifest = self.load_manifest(root_paths, record_metadata)
+        unfinished, finished = resume_state(self.iter_dir_records(manifest))
+        if manifest['shards']:
+            print(f'logs: Resuming the index build after {len(manifest["shards"])} shards ({len(finished)} finished '
+                  f'subtrees, {len(unfinished)} dirs left to finish).')
+        crawler = Files_Crawler(self.max_workers, self.rules)
+        # Stat'ed in the worker threads, listing_rows() then reads the cached results.
+        crawler.stat_entries = record_metadata
+        crawler.dir_state = {}
+        buffer, dir_records, buffered_bytes = [], [], 0
+        for dir_path, entries, subdirs in crawler.iter_listings(root_paths, skip=finished):
+            record = crawler.dir_state.pop(dir_path)
+            if dir_path in unfinished:
+                continue
+            for entry, _ in entries:
+                name, path = encode(entry.name), encode(entry.path)
+                buffer.append((name, path))
+                buffered_bytes += len(name) + len(path) + ENTRY_OVERHEAD
+            subdirs = [entry.path for entry in subdirs]
+            rows = listing_rows(entries) if record_metadata else None
+            dir_records.append((dir_path, record, subdirs, rows))
+            buffered_bytes += DIR_OVERHEAD + 2 * (len(dir_path) + sum(map(len, subdirs)))
+            if rows is not None:
+                buffered_bytes += sum(len(row[0]) + ROW_OVERHEAD for row in rows)
+            if len(buffer) >= self.shard_entries or buffered_bytes >= self.max_memory:
+                self.flush(manifest, buffer, dir_records)
+                buffer, dir_records, buffered_bytes = [], [], 0
+        if buffer or dir_records:
+            self.flush(manifest, buffer, dir_records)
+        self.report = crawler.report
+        return manifest
+
+    def merge(self, manifest, index_path, extra=None):
+        ''' Merges the sorted shards into the index file, extra is a small {name: [paths]} dict added on top. '''
+        streams = [self.read_shard(shard) for shard in manifest['shards']]
+        if extra:
+            streams.append(sorted((encode(name), encode(p)) for name, paths in extra.items() for p in paths))
+
+        def grouped():
+            name, paths = None, []
+            for key, path in heapq.merge(*streams):
+                if key != name:
+                    if name is not None:
+                        yield decode(name), paths
+                    name, paths = key, []
+                paths.append(decode(path))
+            if name is not None:
+                yield decode(name), paths
+
+        write_files_index(index_path, grouped())
+
+    def build(self, root_paths, index_path, dir_state_path=None, metadata_path=None, extra=None):
+        '''
+        Crawls (or resumes crawling) the roots and merges the shards into a new index file next to index_path.
+        With dir_state_path and metadata_path the directory state and the metadata of the crawl are written next
+        to them too, a shard at a time (see file_crawler.write_dir_state and file_metadata.write_file_metadata).
+        Returns the new index, dir state and metadata files (None for the ones not asked for) so the caller can
+        swap them in. The shards are removed once all of them are complete.
+        '''
+        manifest = self.crawl(root_paths, record_metadata=metadata_path is not None)
+        tmp_path = index_path + '.new'
+        self.merge(manifest, tmp_path, extra)
+        dir_state_tmp_path = metadata_tmp_path = None
+        if dir_state_path is not None:
+            dir_state_tmp_path = dir_state_path + '.new'
+            write_dir_state(dir_state_tmp_path, ([(dir_path, record) for dir_path, record, _, _ in self.read_dir_records(shard)]
+                                                 for shard in manifest['shards']))
+        if metadata_path is not None:
+            metadata_tmp_path = metadata_path + '.new'
+            write_file_metadata(metadata_tmp_path, ([(dir_path, rows) for dir_path, _, _, rows in self.read_dir_records(shard)]
+                                                    for shard in manifest['shards']))
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        return tmp_path, dir_state_tmp_path, metadata_tmp_path
+
+
+def resume_state(dir_records):
+    '''
+    (unfinished, finished) of the (dir_path, record, subdir paths, rows) records of the complete shards:
+    unfinished are the recorded directories with a subdirectory still to crawl, finished the subtrees the crawl
+    skips (finished directories whose parent is not). A parent is recorded before its subdirectories, so a
+    directory is forgotten once its whole subtree is finished and only the crawl frontier is kept in memory.
+    '''
+    # dir_path -> [subdirs not finished yet, all subdirs, parent]
+    pending = {}
+    parents = {}
+    finished = set()
+    for dir_path, _, subdirs, _ in dir_records:
+        parent = parents.pop(dir_path, None)
+        if subdirs:
+            pending[dir_path] = [set(subdirs), subdirs, parent]
+            parents.update((subdir, dir_path) for subdir in subdirs)
+            continue
+        while True:
+            finished.add(dir_path)
+            if parent is None:
+                break
+            left, siblings, grandparent = pending[parent]
+            left.discard(dir_path)
+            if left:
+                break
+            # The parent is finished with all of its subtree, its subdirectories are covered by it.
+            del pending[parent]
+            finished.difference_update(siblings)
+            dir_path, parent = parent, grandparent
+    return set(pending), finished
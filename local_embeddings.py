@@ -0,0 +1,106 @@
+import time
+import zlib
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from name_search import name_tokens
+
+MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def normalize_name(name):
+    ''' "MyReport_2023v2.pdf" -> " my report 2023 v 2 pdf ", separators and case don't change the vector. '''
+    tokens = name_tokens(name)
+    return f' {" ".join(tokens)} ' if tokens else f' {name.lower()} '
+
+
+class Char_NGram_Embeddings(Embeddings):
+    """
+    Local embeddings of file names, no API calls: signed feature hashing of the character n-grams of the
+    normalized name (words lowercased and split on case changes, digits and punctuation) plus its whole words,
+    L2 normalized. N-grams are hashed with numpy over all names of a batch at once, and the hashes are stable
+    across processes (unlike hash()), so a FAISS store built with them can be saved and searched later.
+    """
+
+    def __init__(self, size=384, ngrams=(2, 3, 4), word_weight=2.0, batch_size=4096):
+        self.size = size
+        self.ngrams = ngrams
+        self.word_weight = word_weight
+        self.batch_size = batch_size
+
+    @property
+    def model(self):
+        return f'char-ngrams-{"".join(map(str, self.ngrams))}-{self.size}'
+
+    def report(self):
+        return f'{self.model} local embeddings, no API calls'
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        return np.concatenate([self.embed_batch(texts[i:i + self.batch_size])
+                               for i in range(0, len(texts), self.batch_size)]).tolist()
+
+    def embed_batch(self, texts):
+        ''' (len(texts), size) float32 array. '''
+        normalized = [normalize_name(text) for text in texts]
+        lengths = np.fromiter((len(text) for text in normalized), dtype=np.int64, count=len(normalized))
+        ends = np.cumsum(lengths)
+        codes = np.frombuffer(''.join(normalized).encode('utf-32-le', 'surrogatepass'), dtype=np.uint32).astype(np.uint64)
+        rows_of = np.repeat(np.arange(len(texts)), lengths)
+        cells, weights = [], []
+        for n in self.ngrams:
+            count = len(codes) - n + 1
+            if count <= 0:
+                continue
+            h = np.full(count, n, dtype=np.uint64)
+            for j in range(n):
+                h = h * MIX + codes[j:j + count]
+            rows = rows_of[:count]
+            # Windows running into the next name are not n-grams of either.
+            valid = np.arange(count) + n <= ends[rows]
+            h, rows = h[valid], rows[valid]
+            h ^= h >> np.uint64(31)
+            h *= MIX
+            h ^= h >> np.uint64(29)
+            cells.append(rows * self.size + (h % np.uint64(self.size)).astype(np.int64))
+            weights.append(1.0 - 2.0 * (h >> np.uint64(63)).astype(np.float64))
+        words = [(row, zlib.crc32(word.encode('utf-8', 'surrogatepass'))) for row, text in enumerate(normalized)
+                 for word in text.split()]
+        if words:
+            rows, h = np.array(words, dtype=np.int64).T
+            cells.append(rows * self.size + h % self.size)
+            weights.append(self.word_weight * (1.0 - 2.0 * ((h >> 31) & 1)))
+        vectors = np.bincount(np.concatenate(cells), weights=np.concatenate(weights),
+                              minlength=len(texts) * self.size).reshape(len(texts), self.size).astype(np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-6)
+        return vectors
+
+
+def benchmark_local_embeddings(names=20_000, queries=200, k=10):
+    '''
+    Throughput of the local embeddings, and the retrieval quality of the vector search of the hybrid search
+    benchmark with them against the hashed trigram stand-in and, when GOOGLE_API_KEY is set, the Google embeddings.
+    '''
+    import os
+    from name_search import benchmark_hybrid_search, Hashed_Trigram_Embeddings
+    embeddings = Char_NGram_Embeddings()
+    texts = [f'Project_Report_{i}_final v{i % 7}.docx' for i in range(names)]
+    start = time.perf_counter()
+    embeddings.embed_documents(texts)
+    elapsed = time.perf_counter() - start
+    lines = [f'{embeddings.model}: {names} names in {elapsed:.2f}s ({names / elapsed:.0f} names/sec)']
+    backends = [('local char n-grams', embeddings), ('hashed trigrams', Hashed_Trigram_Embeddings())]
+    if os.getenv('GOOGLE_API_KEY'):
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        backends.append(('google embedding-001', GoogleGenerativeAIEmbeddings(model='models/embedding-001')))
+    for label, backend in backends:
+        lines.append(f'{label}:')
+        lines.append(benchmark_hybrid_search(names, queries, k, embeddings=backend))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(benchmark_local_embeddings())
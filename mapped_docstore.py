@@ -0,0 +1,126 @@
+import os
+import mmap
+import struct
+from array import array
+from itertools import accumulate
+from collections.abc import Mapping
+from langchain_core.documents import Document
+from langchain_community.docstore.base import Docstore
+
+# On-disk layout of the docstore of a FAISS store (little endian header, arrays in machine byte order):
+#   header       : magic, rows, and the offset of each section
+#   name_offsets : (rows + 1) uint64 offsets into names_blob
+#   names_blob   : utf-8 text (the file name) of the document of every index row
+#   id_offsets   : (rows + 1) uint64 offsets into ids_blob, empty when every docstore id is its name
+#   ids_blob     : utf-8 docstore id of every index row
+MAGIC = b'SOSDOCS\0'
+HEADER = struct.Struct('<8sQQQQQ')
+SECTIONS = ('name_offsets', 'names_blob', 'id_offsets', 'ids_blob')
+
+
+def encode(text):
+    return text.encode('utf-8', 'surrogatepass')
+
+
+def decode(data):
+    return data.decode('utf-8', 'surrogatepass')
+
+
+def write_docstore_file(path, ids, names):
+    ''' Writes the docstore ids and names of the index rows 0..n-1 in the order of the rows. '''
+    names = [encode(name) for name in names]
+    same = all(id_ == name for id_, name in zip(ids, (decode(name) for name in names)))
+    ids = [] if same else [encode(id_) for id_ in ids]
+    sections = [array('Q', accumulate((len(name) for name in names), initial=0)).tobytes(), b''.join(names),
+                array('Q', accumulate((len(id_) for id_ in ids), initial=0)).tobytes() if ids else b'',
+                b''.join(ids)]
+    offsets, position = [], HEADER.size
+    for section in sections:
+        position += -position % 8
+        offsets.append(position)
+        position += len(section)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(names), *offsets))
+        for offset, section in zip(offsets, sections):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(section)
+    os.replace(tmp_path, path)
+
+
+class Mapped_Docstore(Docstore):
+    """
+    Read-only docstore over a memory-mapped docstore file: opening it reads the header, a search decodes the
+    one name it returns, so processes sharing a store share its pages instead of each unpickling a copy.
+    Stores whose docstore ids are their names (everything added since file_vectors.py keyed by name) need no id
+    lookup at all, the id -> row map of older stores is built on their first search.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.rows, *offsets = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.mm.close()
+            raise ValueError(f'{path} is not a docstore file.')
+        self.offsets = dict(zip(SECTIONS, offsets))
+        view = memoryview(self.mm)
+        self._views = [view]
+        self.name_offsets = self._array(view, 'name_offsets', self.rows + 1)
+        self.ids_same = self.offsets['ids_blob'] == self.offsets['id_offsets']
+        self.id_offsets = None if self.ids_same else self._array(view, 'id_offsets', self.rows + 1)
+        self._rows_of_ids = None
+
+    def _array(self, view, section, length):
+        start = self.offsets[section]
+        part = view[start:start + 8 * length].cast('Q')
+        self._views.append(part)
+        return part
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self.mm.close()
+
+    def __len__(self):
+        return self.rows
+
+    def name_at(self, row):
+        base = self.offsets['names_blob']
+        return decode(self.mm[base + self.name_offsets[row]:base + self.name_offsets[row + 1]])
+
+    def id_at(self, row):
+        if self.ids_same:
+            return self.name_at(row)
+        base = self.offsets['ids_blob']
+        return decode(self.mm[base + self.id_offsets[row]:base + self.id_offsets[row + 1]])
+
+    def search(self, search):
+        if self.ids_same:
+            return Document(id=search, page_content=search)
+        if self._rows_of_ids is None:
+            self._rows_of_ids = {self.id_at(row): row for row in range(self.rows)}
+        row = self._rows_of_ids.get(search)
+        if row is None:
+            return f'ID {search} not found.'
+        return Document(id=search, page_content=self.name_at(row))
+
+
+class Row_Ids(Mapping):
+    """index_to_docstore_id of a store with a Mapped_Docstore: index row -> docstore id, decoded on access."""
+
+    def __init__(self, docstore):
+        self.docstore = docstore
+
+    def __getitem__(self, row):
+        if not 0 <= row < self.docstore.rows:
+            raise KeyError(row)
+        return self.docstore.id_at(row)
+
+    def __len__(self):
+        return self.docstore.rows
+
+    def __iter__(self):
+        return iter(range(self.docstore.rows))
@@ -0,0 +1,123 @@
+import os
+import time
+import threading
+from query_cache import normalize_query
+
+
+def load_name_aliases(path):
+    ''' {alias: [names]} of an aliases file (see name_aliases.txt), empty if there is none. '''
+    aliases = {}
+    if not os.path.exists(path):
+        return aliases
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#') or ':' not in line:
+                continue
+            alias, names = line.split(':', 1)
+            names = [name.strip() for name in names.split(',') if name.strip()]
+            if names:
+                aliases.setdefault(normalize_query(alias), []).extend(names)
+    return aliases
+
+
+class Name_Resolver():
+    """
+    Answers a file name lookup with the cheapest tier that is confident about it, so the LLM query expansion only
+    runs for vague names. Tiers are tried in order, each returns the names it is sure of or nothing to pass the
+    name on, the last one always answers. Counts and times every tier, the latency a tier saved is the mean
+    latency of the last tier minus its own.
+    """
+
+    def __init__(self, aliases=None):
+        self.aliases = aliases or {}
+        # tier -> [answers, seconds]
+        self.stats = {}
+        self.fallback = None
+        self._lock = threading.Lock()
+
+    def alias_names(self, query):
+        ''' Names of the alias the whole query is ("Web  Browser" -> browser), "word document" is not "word". '''
+        return self.aliases.get(normalize_query(query), [])
+
+    def resolve(self, query, tiers):
+        '''
+        (names, tier, seconds) of the first of the (tier, answer(query)) tiers that answers, seconds counting the
+        tiers that passed too.
+        '''
+        start = time.perf_counter()
+        names, tier = [], None
+        for tier, answer in tiers:
+            names = answer(query)
+            if names:
+                break
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            stats = self.stats.setdefault(tier, [0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            self.fallback = tiers[-1][0]
+        return names, tier, elapsed
+
+    def mean(self, tier):
+        answers, seconds = self.stats.get(tier, (0, 0.0))
+        return seconds / answers if answers else None
+
+    def saved(self, seconds):
+        ''' Seconds an answer taking this long saved against the last tier, None until it has run once. '''
+        fallback = self.mean(self.fallback)
+        return None if fallback is None else fallback - seconds
+
+    def report(self):
+        tiers = ', '.join(f'{tier} {answers} ({1e3 * seconds / answers:.0f}ms mean)'
+                          for tier, (answers, seconds) in self.stats.items())
+        return f'name resolver: {tiers or "no lookups yet"}'
+
+
+def benchmark_name_resolver(names=200_000, queries=400, llm_latency=0.8, k=10):
+    '''
+    Latency of update_search_list style lookups answered by the tiers (exact name, alias, lexical, then the
+    LLM expansion) against sending every one to the expansion, on generated names and a fake LLM latency.
+    Queries are a mix of exact app names, aliases, the words of a file name and vague descriptions.
+    '''
+    import numpy as np
+    from name_search import Stem_Index, BM25_Index
+    rng = np.random.default_rng(0)
+    words = ['annual', 'budget', 'report', 'invoice', 'resume', 'photo', 'notes', 'project', 'draft', 'thesis']
+    apps = ['chrome.exe', 'msedge.exe', 'firefox.exe', 'code.exe', 'spotify.exe', 'vlc.exe', 'winword.exe', 'excel.exe']
+    corpus = apps + ['_'.join(w.capitalize() for w in rng.choice(words, 3, replace=False)) + f'_{i}.pdf'
+                     for i in range(names)]
+    stems = Stem_Index(corpus)
+    tokens = BM25_Index(corpus)
+    resolver = Name_Resolver(load_name_aliases(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'name_aliases.txt')))
+
+    def exact(query):
+        return stems.lookup(query, limit=k)
+
+    def lexical(query):
+        found = tokens.search(query, k)
+        return found if found and tokens.covers(query, found[0]) else []
+
+    def expansion(query):
+        time.sleep(llm_latency)
+        return tokens.search(query, k) or ['none']
+
+    tiers = [('exact', exact), ('alias', lambda query: [n for name in resolver.alias_names(query) for n in exact(name)]),
+             ('lexical', lexical), ('expansion', expansion)]
+    kinds = [lambda: rng.choice(['chrome', 'spotify', 'vlc', 'Code']),
+             lambda: rng.choice(['browser', 'web browser', 'music player', 'code editor']),
+             lambda: ' '.join(corpus[int(rng.integers(len(apps), len(corpus)))].split('_')[:2]),
+             lambda: rng.choice(['something to write my thesis in', 'the pictures from last trip'])]
+    stream = [kinds[int(rng.integers(len(kinds)))]() for _ in range(queries)]
+    start = time.perf_counter()
+    for query in stream:
+        resolver.resolve(query, tiers)
+    tiered = time.perf_counter() - start
+    expanded = resolver.mean('expansion') or llm_latency
+    return (f'{queries} lookups over {len(corpus)} names, {llm_latency * 1e3:.0f}ms per LLM expansion:\n'
+            f'  always expanding: {queries * expanded:.1f}s ({1e3 * expanded:.0f}ms per lookup)\n'
+            f'  tiered          : {tiered:.1f}s ({1e3 * tiered / queries:.0f}ms per lookup), {resolver.report()}')
+
+
+if __name__ == '__main__':
+    print(benchmark_name_resolver())
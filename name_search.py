@@ -0,0 +1,420 @@
+import os
+import re
+import time
+import math
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+import numpy as np
+from file_metadata import extension
+
+
+class Trigram_Index():
+    """
+    Inverted index from lowercase character trigrams to the ids of the names holding them.
+    A substring query intersects the posting lists of its trigrams, rarest first, and checks the few candidates
+    left with a plain substring test. Prefix queries use binary search over the names sorted in lowercase.
+    """
+
+    def __init__(self, names):
+        start = time.perf_counter()
+        self.names = list(names)
+        self.lower_names = [name.lower() for name in self.names]
+        postings = defaultdict(lambda: array('I'))
+        for i, name in enumerate(self.lower_names):
+            for gram in {name[j:j + 3] for j in range(len(name) - 2)}:
+                postings[gram].append(i)
+        # uint32 views of the arrays, ids are ascending so the lists are already sorted.
+        self.postings = {gram: np.frombuffer(ids, dtype=np.uint32) for gram, ids in postings.items()}
+        self.prefix_order = sorted(range(len(self.names)), key=self.lower_names.__getitem__)
+        self.build_time = time.perf_counter() - start
+
+    def candidates(self, query):
+        grams = {query[j:j + 3] for j in range(len(query) - 2)}
+        lists = []
+        for gram in grams:
+            ids = self.postings.get(gram)
+            if ids is None:
+                return []
+            lists.append(ids)
+        lists.sort(key=len)
+        ids = lists[0]
+        for other in lists[1:]:
+            # Checking a handful of names directly is cheaper than another intersection.
+            if len(ids) <= 64:
+                break
+            ids = np.intersect1d(ids, other, assume_unique=True)
+        return ids.tolist()
+
+    def substring(self, query, limit=100):
+        query = query.lower()
+        if len(query) < 3:
+            ids = [i for i, name in enumerate(self.lower_names) if query in name]
+        else:
+            ids = [i for i in self.candidates(query) if query in self.lower_names[i]]
+        return self.rank(query, ids, limit)
+
+    def prefix(self, query, limit=100):
+        query = query.lower()
+        start = bisect_left(self.prefix_order, query, key=self.lower_names.__getitem__)
+        ids = []
+        for i in self.prefix_order[start:]:
+            if not self.lower_names[i].startswith(query) or len(ids) >= limit:
+                break
+            ids.append(i)
+        return self.rank(query, ids, limit)
+
+    def rank(self, query, ids, limit):
+        # Exact names first, then names starting with the query, then shorter (closer) names.
+        lower = self.lower_names
+        ids = sorted(ids, key=lambda i: (lower[i] != query, not lower[i].startswith(query), len(lower[i])))
+        return [self.names[i] for i in ids[:limit]]
+
+    def search(self, query, mode='substring', limit=100):
+        if mode == 'prefix':
+            return self.prefix(query, limit)
+        return self.substring(query, limit)
+
+
+def name_stem(name):
+    ''' Lowercase name without its extension, what users type for a file ("chrome" for chrome.exe). '''
+    stem, ext = os.path.splitext(name.lower())
+    return stem if stem and len(ext) <= 6 else name.lower()
+
+
+class Stem_Index():
+    """
+    Names by their lowercase stem (see name_stem), so "chrome" finds chrome.exe and Chrome.lnk with one dict lookup.
+    Answers the exact tier of the name resolver without building the fuzzy index.
+    """
+
+    def __init__(self, names):
+        start = time.perf_counter()
+        self.stems = {}
+        for name in names:
+            self.stems.setdefault(name_stem(name), []).append(name)
+        self.build_time = time.perf_counter() - start
+
+    def __contains__(self, name):
+        return name in self.stems.get(name_stem(name), ())
+
+    def __len__(self):
+        return len(self.stems)
+
+    def lookup(self, name, extensions=None, limit=100):
+        ''' Names with the stem of name, name itself first, only the ones with one of the extensions if given. '''
+        names = self.stems.get(name_stem(name), [])
+        if name in names:
+            names = [name] + [other for other in names if other != name]
+        if extensions is not None:
+            names = [other for other in names if extension(other) in extensions]
+        return names[:limit]
+
+
+def deletes(term, max_distance):
+    ''' Every string made by deleting up to max_distance characters of term. '''
+    result = {term}
+    level = {term}
+    for _ in range(max_distance):
+        level = {word[:i] + word[i + 1:] for word in level for i in range(len(word))}
+        result |= level
+    return result
+
+
+def edit_distance(a, b, max_distance):
+    ''' Damerau-Levenshtein (optimal string alignment) distance, or max_distance + 1 once it is exceeded. '''
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class SymSpell_Index():
+    """
+    Typo tolerant lookup of file names (symmetric delete spelling correction).
+    Names are reduced to their lowercase stem. For every distinct prefix of prefix_length characters all variants
+    with up to max_distance deletions are precomputed, so a query only generates the deletes of its own prefix,
+    looks them up and computes the edit distance to the few terms that share one. Results are ranked by edit
+    distance, then by how often the name occurs on disk (frequency).
+    """
+
+    def __init__(self, name_counts, max_distance=2, prefix_length=7):
+        start = time.perf_counter()
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        terms = {}
+        for name, count in name_counts:
+            entry = terms.setdefault(name_stem(name), [0, []])
+            entry[0] += count
+            entry[1].append(name)
+        self.terms = list(terms)
+        self.frequency = [terms[term][0] for term in self.terms]
+        self.term_names = [terms[term][1] for term in self.terms]
+        prefixes = defaultdict(lambda: array('I'))
+        for i, term in enumerate(self.terms):
+            prefixes[term[:prefix_length]].append(i)
+        self.prefixes = list(prefixes)
+        self.prefix_terms = [prefixes[prefix] for prefix in self.prefixes]
+        # Terms sharing a prefix share its deletes, which keeps the table proportional to the distinct prefixes.
+        # The table is a sorted array of delete hashes next to the prefix ids, a fraction of the size of a dict.
+        # Hash collisions only add candidates, which the edit distance check drops.
+        hashes, prefix_ids = array('q'), array('I')
+        for i, prefix in enumerate(self.prefixes):
+            variants = deletes(prefix, max_distance)
+            hashes.extend(map(hash, variants))
+            prefix_ids.extend([i] * len(variants))
+        hashes = np.frombuffer(hashes, dtype=np.int64)
+        order = np.argsort(hashes, kind='stable')
+        self.delete_hashes = hashes[order]
+        self.delete_prefixes = np.frombuffer(prefix_ids, dtype=np.uint32)[order]
+        self.build_time = time.perf_counter() - start
+
+    def lookup(self, query, max_distance=None, limit=20):
+        ''' [(name, distance, frequency)] of the names within max_distance edits of the query. '''
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        query = name_stem(query)
+        variants = np.array([hash(variant) for variant in deletes(query[:self.prefix_length], max_distance)], dtype=np.int64)
+        lo = np.searchsorted(self.delete_hashes, variants, side='left')
+        hi = np.searchsorted(self.delete_hashes, variants, side='right')
+        seen_prefixes = set()
+        for a, b in zip(lo.tolist(), hi.tolist()):
+            if a < b:
+                seen_prefixes.update(self.delete_prefixes[a:b].tolist())
+        matches = []
+        for p in seen_prefixes:
+            for t in self.prefix_terms[p]:
+                distance = edit_distance(query, self.terms[t], max_distance)
+                if distance <= max_distance:
+                    matches.append((distance, -self.frequency[t], t))
+        matches.sort()
+        results = []
+        for distance, frequency, t in matches:
+            results.extend((name, distance, -frequency) for name in self.term_names[t])
+            if len(results) >= limit:
+                break
+        return results[:limit]
+
+
+# Words of a name: "MyReport_2023v2.pdf" -> my, report, 2023, v, 2, pdf.
+TOKEN = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+|[^\W\d_]+')
+
+
+def name_tokens(name):
+    return [token.lower() for token in TOKEN.findall(name)]
+
+
+class BM25_Index():
+    """
+    BM25 ranking of names over their tokens (split on case changes, underscores, punctuation and digits), so
+    "budget report 2023" finds Budget_Report_2023.xlsx whatever order or separators the words have. Postings hold
+    the name ids and term frequencies as numpy arrays, a query sums the scores of its tokens with bincount.
+    """
+
+    def __init__(self, names, k1=1.2, b=0.75):
+        start = time.perf_counter()
+        self.names = list(names)
+        self.k1 = k1
+        self.b = b
+        postings = defaultdict(lambda: (array('I'), array('H')))
+        lengths = array('H')
+        for i, name in enumerate(self.names):
+            tokens = name_tokens(name)
+            lengths.append(min(len(tokens), 65535))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                ids, tfs = postings[token]
+                ids.append(i)
+                tfs.append(min(count, 65535))
+        self.lengths = np.frombuffer(lengths, dtype=np.uint16).astype(np.float32)
+        self.average_length = float(self.lengths.mean()) if len(self.names) else 1.0
+        self.postings = {token: (np.frombuffer(ids, dtype=np.uint32), np.frombuffer(tfs, dtype=np.uint16))
+                         for token, (ids, tfs) in postings.items()}
+        self.build_time = time.perf_counter() - start
+
+    def idf(self, token):
+        n = len(self.postings[token][0])
+        return math.log(1 + (len(self.names) - n + 0.5) / (n + 0.5))
+
+    def scores(self, query):
+        ''' (ids, scores) of the names holding at least one token of the query. '''
+        all_ids, all_scores = [], []
+        for token in set(name_tokens(query)):
+            if token not in self.postings:
+                continue
+            ids, tfs = self.postings[token]
+            tfs = tfs.astype(np.float32)
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[ids] / self.average_length)
+            all_ids.append(ids)
+            all_scores.append(self.idf(token) * tfs * (self.k1 + 1) / (tfs + norm))
+        if not all_ids:
+            return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.float64)
+        ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        return ids, np.bincount(inverse, weights=np.concatenate(all_scores))
+
+    def search(self, query, limit=100, extensions=None):
+        ''' The limit best names, of names with one of the extensions (e.g. {'.exe', '.lnk'}) if given. '''
+        ids, scores = self.scores(query)
+        if extensions is not None and len(ids):
+            keep = np.fromiter((extension(self.names[i]) in extensions for i in ids.tolist()), dtype=bool, count=len(ids))
+            ids, scores = ids[keep], scores[keep]
+        if len(ids) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            ids, scores = ids[top], scores[top]
+        # Best score first, shorter names first on ties.
+        order = np.lexsort((self.lengths[ids], -scores))
+        return [self.names[i] for i in ids[order].tolist()]
+
+    def covers(self, query, name):
+        ''' True if the name holds every token of the query. '''
+        return set(name_tokens(query)) <= set(name_tokens(name))
+
+
+def reciprocal_rank_fusion(rankings, k=60, limit=None):
+    ''' Merges ranked lists of names, each name scores sum(1 / (k + rank)) over the lists holding it. '''
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, name in enumerate(ranking):
+            fused[name] += 1 / (k + rank + 1)
+    return sorted(fused, key=fused.__getitem__, reverse=True)[:limit]
+
+
+def benchmark_trigram_index(names=500_000, queries=200):
+    ''' Build time and query latency of the trigram index on generated file names. '''
+    rng = np.random.default_rng(0)
+    words = ['invoice', 'report', 'resume', 'photo', 'setup', 'chrome', 'notes', 'budget', 'project', 'draft']
+    exts = ['.pdf', '.docx', '.txt', '.jpg', '.exe', '.lnk', '.py', '.xlsx']
+    corpus = [f'{words[a]}_{b}{exts[c]}' for a, b, c in
+              zip(rng.integers(0, len(words), names), rng.integers(0, 100_000, names), rng.integers(0, len(exts), names))]
+    index = Trigram_Index(corpus)
+    picked = rng.integers(0, names, queries)
+    timings = []
+    for i in picked:
+        fragment = corpus[i][:-4]
+        start = time.perf_counter()
+        found = index.substring(fragment, limit=100)
+        timings.append(time.perf_counter() - start)
+        assert corpus[i] in found or len(found) == 100
+    timings = np.array(timings) * 1e3
+    return (f'trigram index over {names} names: build {index.build_time:.2f}s, substring query '
+            f'p50 {np.percentile(timings, 50):.3f}ms, p99 {np.percentile(timings, 99):.3f}ms')
+
+
+def benchmark_symspell_index(names=200_000, queries=200):
+    ''' Build time and latency of typo lookups (one random edit) on generated file names. '''
+    rng = np.random.default_rng(0)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    corpus = [''.join(rng.choice(list(letters), rng.integers(5, 14))) + '.txt' for _ in range(names)]
+    index = SymSpell_Index((name, 1) for name in corpus)
+    timings, hits = [], 0
+    for i in rng.integers(0, names, queries):
+        stem = corpus[i][:-4]
+        j = int(rng.integers(0, len(stem)))
+        typo = stem[:j] + letters[int(rng.integers(0, 26))] + stem[j + 1:]
+        start = time.perf_counter()
+        found = index.lookup(typo, max_distance=2)
+        timings.append(time.perf_counter() - start)
+        hits += any(name == corpus[i] for name, _, _ in found)
+    timings = np.array(timings) * 1e3
+    return (f'symspell index over {names} names: build {index.build_time:.2f}s, {len(index.delete_hashes)} deletes, lookup '
+            f'p50 {np.percentile(timings, 50):.3f}ms, p99 {np.percentile(timings, 99):.3f}ms, found {hits}/{queries}')
+
+
+class Hashed_Trigram_Embeddings():
+    """Stand-in for the embedding model in benchmarks: normalized bags of hashed character trigrams, no API calls."""
+
+    def __init__(self, size=256):
+        self.size = size
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def embed_documents(self, texts):
+        vectors = np.zeros((len(texts), self.size), dtype=np.float32)
+        for i, text in enumerate(texts):
+            text = f' {text.lower()} '
+            for j in range(len(text) - 2):
+                vectors[i, hash(text[j:j + 3]) % self.size] += 1
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-6)
+        return vectors.tolist()
+
+
+def benchmark_hybrid_search(names=50_000, queries=200, k=10, embeddings=None):
+    '''
+    recall@k and latency of the BM25 index, the vector search and both fused with reciprocal rank fusion, on
+    generated file names queried with their words in lowercase and shuffled ("budget report 2023" for
+    Report_Budget_2023.xlsx), sometimes without the year. Pass the real embeddings to measure them instead of the hashed trigram stand-in.
+    '''
+    import faiss
+    from concurrent.futures import ThreadPoolExecutor
+    rng = np.random.default_rng(0)
+    words = ['annual', 'budget', 'report', 'invoice', 'resume', 'photo', 'setup', 'notes', 'project', 'draft',
+             'meeting', 'summary', 'final', 'backup', 'client', 'contract', 'design', 'holiday', 'lecture', 'thesis']
+    exts = ['.pdf', '.docx', '.txt', '.jpg', '.xlsx', '.pptx']
+    styles = [lambda ws: '_'.join(w.capitalize() for w in ws), lambda ws: ''.join(w.capitalize() for w in ws),
+              lambda ws: '-'.join(ws), lambda ws: ' '.join(ws)]
+    corpus, queries_words = [], []
+    for _ in range(names):
+        ws = [words[i] for i in rng.choice(len(words), 3, replace=False)] + [str(int(rng.integers(1990, 2030)))]
+        corpus.append(styles[int(rng.integers(0, len(styles)))](ws) + exts[int(rng.integers(0, len(exts)))])
+        queries_words.append(ws)
+    embeddings = embeddings or Hashed_Trigram_Embeddings()
+    start = time.perf_counter()
+    vectors = np.array(embeddings.embed_documents(corpus), dtype=np.float32)
+    vector_index = faiss.IndexFlatIP(vectors.shape[1])
+    vector_index.add(vectors)
+    vector_build = time.perf_counter() - start
+    lexical = BM25_Index(corpus)
+
+    def vector_search(query):
+        _, ids = vector_index.search(np.array([embeddings.embed_query(query)], dtype=np.float32), k)
+        return [corpus[i] for i in ids[0] if i >= 0]
+
+    pool = ThreadPoolExecutor(1)
+    hits = {'bm25': 0, 'vector': 0, 'fused': 0}
+    timings = {'bm25': [], 'vector': [], 'fused': []}
+    for i in rng.integers(0, names, queries).tolist():
+        # Half of the queries leave the year out, several names then match every word of the query.
+        ws = list(queries_words[i][:3 if rng.random() < 0.5 else 4])
+        rng.shuffle(ws)
+        query = ' '.join(ws)
+        start = time.perf_counter()
+        lexical_found = lexical.search(query, k)
+        timings['bm25'].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        vector_found = vector_search(query)
+        timings['vector'].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        future = pool.submit(vector_search, query)
+        fused = reciprocal_rank_fusion([lexical.search(query, k), future.result()], limit=k)
+        timings['fused'].append(time.perf_counter() - start)
+        for method, found in (('bm25', lexical_found), ('vector', vector_found), ('fused', fused)):
+            hits[method] += corpus[i] in found
+    pool.shutdown()
+    lines = [f'hybrid search over {names} names: bm25 build {lexical.build_time:.2f}s, vector build {vector_build:.2f}s']
+    for method in hits:
+        ms = np.array(timings[method]) * 1e3
+        lines.append(f'  {method:6} recall@{k} {hits[method] / queries:.2f}, '
+                     f'p50 {np.percentile(ms, 50):.3f}ms, p99 {np.percentile(ms, 99):.3f}ms')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(benchmark_trigram_index())
+    print(benchmark_symspell_index())
+    print(benchmark_hybrid_search())
@@ -0,0 +1,112 @@
+import os
+import time
+from array import array
+
+NO_PARENT = 0xFFFFFFFF
+
+
+def split_path(path):
+    ''' (directory, leaf) with the directory ending in its separator: "C:\\a\\b.txt" -> ("C:\\a\\", "b.txt"). '''
+    # Split on both separators, any string round-trips exactly whatever the platform wrote it with.
+    k = max(path.rfind('/'), path.rfind('\\'))
+    return path[:k + 1], path[k + 1:]
+
+
+class Dir_Interner():
+    """
+    Interns the directories of the paths written to an index as nodes of a parent-pointer tree.
+    Every node holds only its own component ("Users\\"), a path is stored as the id of its directory plus its leaf.
+    Nodes are numbered in creation order, a parent always has a smaller id than its children.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.parents = array('I')
+        self.components = []
+
+    def __len__(self):
+        return len(self.parents)
+
+    def intern(self, dir_path):
+        node = self.ids.get(dir_path)
+        if node is not None:
+            return node
+        parent_path, component = split_path(dir_path[:-1])
+        parent = self.intern(parent_path) if parent_path else NO_PARENT
+        node = len(self.parents)
+        self.parents.append(parent)
+        # The component keeps its trailing separator, joining the chain rebuilds the exact string.
+        self.components.append(component + dir_path[-1])
+        self.ids[dir_path] = node
+        return node
+
+    def take_components(self):
+        ''' Components interned since the last call, to be written out in node order. '''
+        components, self.components = self.components, []
+        return components
+
+
+class Dir_Tree():
+    """
+    Read side of the directory tree: parents[node] and component(node) come from the index file and full
+    directory paths are rebuilt on demand. Recently built paths are cached, siblings share their parent's string.
+    """
+
+    def __init__(self, parents, component, cache_size=1 << 16):
+        self.parents = parents
+        self.component = component
+        self.cache_size = cache_size
+        self.cache = {}
+
+    def path(self, node):
+        cached = self.cache.get(node)
+        if cached is not None:
+            return cached
+        chain = []
+        while node != NO_PARENT and node not in self.cache:
+            chain.append(node)
+            node = self.parents[node]
+        path = self.cache[node] if node != NO_PARENT else ''
+        if len(self.cache) + len(chain) > self.cache_size:
+            self.cache = {}
+        for node in reversed(chain):
+            path += self.component(node)
+            self.cache[node] = path
+        return path
+
+
+def benchmark_path_store(files=300_000, directory='.'):
+    ''' Size of the index file and memory of the decoded index with full paths against the directory tree. '''
+    import tracemalloc
+    from files_index_store import Files_Index, save_files_index
+    base = 'C:\\Users\\someone\\Documents\\Projects\\'
+    tracemalloc.start()
+    file_index = {}
+    for i in range(files):
+        # About 40 files per directory, 5 levels below the base.
+        path = f'{base}client_{i // 40_000}\\project_{i // 4000}\\src\\module_{i // 400}\\part_{i // 40}\\file_{i:07d}.txt'
+        file_index.setdefault(split_path(path)[1], []).append(path)
+    dict_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    full_size = sum(len(p.encode()) for paths in file_index.values() for p in paths)
+    index_path = os.path.join(directory, 'benchmark_paths.idx')
+    try:
+        index = save_files_index(index_path, file_index)
+        index.close()
+        index = Files_Index(index_path)
+        start = time.perf_counter()
+        decoded = sum(len(paths) for _, paths in index.sorted_items())
+        seconds = time.perf_counter() - start
+        dirs = index.base.dir_count
+        size = os.path.getsize(index_path)
+        index.close()
+    finally:
+        if os.path.exists(index_path):
+            os.remove(index_path)
+    return (f'{files} paths in {dirs} directories: {full_size / 1e6:.1f} MB of path text, {dict_memory / 1e6:.1f} MB as a '
+            f'dict of path strings, index file {size / 1e6:.1f} MB, all paths rebuilt in {seconds:.2f}s '
+            f'({1e6 * seconds / decoded:.2f}us per path)')
+
+
+if __name__ == '__main__':
+    print(benchmark_path_store())
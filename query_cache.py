@@ -0,0 +1,109 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+def normalize_query(query):
+    ''' "  Open Chrome " -> "open chrome", queries differing only in case and spacing share a cache entry. '''
+    return ' '.join(query.lower().split())
+
+
+class Query_Cache():
+    """
+    Bounded cache of search results, least recently used entries evicted first and every entry expiring after
+    ttl seconds. Each entry records the generation it was computed at, bump() (called whenever the files index or
+    the FAISS store changes) makes all older entries misses without walking the cache.
+    """
+
+    def __init__(self, max_entries=256, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def bump(self):
+        with self._lock:
+            self.generation += 1
+
+    def get(self, key):
+        ''' (True, value) of a fresh entry, (False, None) on a miss. '''
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                generation, expires, value = entry
+                if generation == self.generation and time.monotonic() < expires:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self.entries[key]
+                self.stale += 1
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value, generation):
+        ''' Stores a value computed at generation, unless the index changed while it was computed. '''
+        with self._lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = (generation, time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def lookup(self, key, compute):
+        ''' Cached value of key, computing and storing it on a miss. '''
+        found, value = self.get(key)
+        if found:
+            return value
+        generation = self.generation
+        value = compute()
+        self.put(key, value, generation)
+        return value
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def report(self):
+        return (f'query cache: {len(self)} entries, {self.hits} hits, {self.misses} misses ({self.stale} expired or '
+                f'invalidated), {self.evictions} evictions, hit rate {100 * self.hit_rate:.1f}%, generation {self.generation}')
+
+
+def benchmark_query_cache(queries=2000, distinct=300, search_latency=0.02, max_entries=256, zipf=1.2, updates_every=500):
+    '''
+    Latency of repeated queries (Zipf distributed, like users asking for the same apps and files again) through
+    the cache against running every search, with the index changing every updates_every queries.
+    '''
+    import numpy as np
+    rng = np.random.default_rng(0)
+    stream = [f'query {i}' for i in np.minimum(rng.zipf(zipf, queries), distinct)]
+
+    def search(query):
+        time.sleep(search_latency)
+        return [query]
+
+    cache = Query_Cache(max_entries=max_entries)
+    start = time.perf_counter()
+    for i, query in enumerate(stream):
+        if i and i % updates_every == 0:
+            cache.bump()
+        cache.lookup(normalize_query(query), lambda: search(query))
+    cached = time.perf_counter() - start
+    uncached = len(stream) * search_latency
+    return (f'{queries} queries over {distinct} distinct ones, {search_latency * 1e3:.0f}ms per search:\n'
+            f'  no cache  : {uncached:.2f}s ({1e3 * uncached / queries:.2f}ms per query)\n'
+            f'  with cache: {cached:.2f}s ({1e3 * cached / queries:.2f}ms per query), {cache.report()}')
+
+
+if __name__ == '__main__':
+    print(benchmark_query_cache())
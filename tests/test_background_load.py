@@ -0,0 +1,72 @@
+import threading
+import concurrent.futures
+import pytest
+from background_load import Background_Load
+
+
+def test_waiters_block_until_the_load_is_done():
+    release, loaded = threading.Event(), []
+
+    def load():
+        release.wait(5)
+        loaded.append(True)
+        return 'indexes'
+
+    ready = Background_Load(load)
+    ready.start()
+    with pytest.raises(concurrent.futures.TimeoutError):
+        ready.wait(timeout=0.05)
+    answers = []
+    tools = [threading.Thread(target=lambda: answers.append((ready.wait(), list(loaded)))) for _ in range(3)]
+    for thread in tools:
+        thread.start()
+    assert not ready.done() and answers == []
+    release.set()
+    for thread in tools:
+        thread.join(5)
+    # Every tool saw the finished load, none ran before it.
+    assert answers == [('indexes', [True])] * 3
+    assert ready.done() and ready.error() is None
+
+
+def test_a_failed_load_raises_in_every_waiter_instead_of_hanging():
+    def load():
+        raise OSError('files_index.pkl is truncated')
+
+    ready = Background_Load(load)
+    errors = []
+
+    def tool():
+        try:
+            ready.wait(timeout=5)
+        except OSError as e:
+            errors.append(str(e))
+
+    tools = [threading.Thread(target=tool) for _ in range(3)]
+    for thread in tools:
+        thread.start()
+    for thread in tools:
+        thread.join(5)
+    assert errors == ['files_index.pkl is truncated'] * 3
+    assert isinstance(ready.error(), OSError)
+    with pytest.raises(OSError):
+        ready.wait()
+
+
+def test_the_load_runs_once_however_many_start_it():
+    calls, release = [], threading.Event()
+
+    def load():
+        calls.append(threading.current_thread().name)
+        release.wait(5)
+
+    ready = Background_Load(load, 'files_handler_load')
+    assert ready.error() is None and not ready.done()
+    starters = [threading.Thread(target=ready.start) for _ in range(8)]
+    for thread in starters:
+        thread.start()
+    for thread in starters:
+        thread.join(5)
+    release.set()
+    ready.wait(5)
+    assert len(calls) == 1 and calls[0].startswith('files_handler_load')
@@ -0,0 +1,38 @@
+import os
+import stat
+import pytest
+from types import SimpleNamespace
+from crawl_rules import Crawl_Rules, load_crawl_rules, dir_identity
+from file_crawler import Files_Crawler
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_identity_options_are_off_by_default():
+    rules = load_crawl_rules(os.path.join(REPO, 'crawl_rules.txt'))
+    assert not rules.follow_symlinks and not rules.skip_symlink_loops and not rules.same_filesystem
+
+
+def test_rules_and_symlink_loops(tmp_path):
+    (tmp_path / 'src' / 'node_modules' / 'x').mkdir(parents=True)
+    (tmp_path / 'venv' / 'lib').mkdir(parents=True)
+    (tmp_path / 'venv' / 'pyvenv.cfg').write_text('')
+    (tmp_path / 'src' / 'main.py').write_text('')
+    os.symlink(tmp_path, tmp_path / 'src' / 'loop')
+    rules = Crawl_Rules(['glob:node_modules', 'marker:pyvenv.cfg', 'option:follow_symlinks=true',
+                         'option:skip_symlink_loops=true'])
+    file_index = Files_Crawler(2, rules).crawl([str(tmp_path)])
+    assert 'node_modules' not in file_index and 'x' not in file_index
+    assert 'pyvenv.cfg' in file_index and 'lib' not in file_index
+    assert file_index['main.py'] == [str(tmp_path / 'src' / 'main.py')]
+    assert rules.option_rules['skip_symlink_loops'].entries == 1
+
+
+def test_plain_directories_are_not_stated_again_on_windows():
+    def entry(attributes):
+        st = SimpleNamespace(st_dev=0, st_ino=0, st_file_attributes=attributes)
+        return SimpleNamespace(path='C:\\missing', stat=lambda follow_symlinks=True: st)
+    assert dir_identity(entry(stat.FILE_ATTRIBUTE_DIRECTORY)) is None
+    # A junction is followed with os.stat.
+    with pytest.raises(FileNotFoundError):
+        dir_identity(entry(stat.FILE_ATTRIBUTE_DIRECTORY | stat.FILE_ATTRIBUTE_REPARSE_POINT))
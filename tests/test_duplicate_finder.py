@@ -0,0 +1,29 @@
+import os
+from duplicate_finder import Duplicate_Finder, sized_files
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_duplicates_by_content_not_by_size(tmp_path):
+    big = os.urandom(300_000)
+    middle = bytearray(big)
+    middle[150_000] ^= 0xFF
+    paths = [write(tmp_path / 'a.bin', big), write(tmp_path / 'b.bin', big), write(tmp_path / 'c.bin', bytes(middle)),
+             write(tmp_path / 'd.txt', b'same'), write(tmp_path / 'e.txt', b'same'), write(tmp_path / 'f.txt', b'diff')]
+    finder = Duplicate_Finder(2, block_size=4096)
+    groups = finder.find(sized_files({os.path.basename(p): [p] for p in paths}))
+    assert groups == [(300_000, paths[:2]), (4, paths[3:5])]
+    assert finder.report.reclaimable == 300_004
+
+
+def test_hard_links_are_not_duplicates(tmp_path):
+    original = write(tmp_path / 'a.bin', b'x' * 1000)
+    os.link(original, tmp_path / 'b.bin')
+    copy = write(tmp_path / 'c.bin', b'x' * 1000)
+    finder = Duplicate_Finder(2)
+    assert finder.find([(original, 1000), (str(tmp_path / 'b.bin'), 1000)]) == []
+    assert finder.find([(original, 1000), (str(tmp_path / 'b.bin'), 1000), (copy, 1000)]) == [(1000, [original, copy])]
+    assert finder.report.hard_links == 1 and finder.report.reclaimable == 1000
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from embedding_pipeline import Fake_Embeddings
+from embedding_cache import Embedding_Cache, Cached_Embeddings, text_key
+
+
+def names(n, start=0):
+    return [f'file_{i}.txt' for i in range(start, start + n)]
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / 'cache')
+
+
+def test_empty_input_does_not_touch_an_empty_cache(cache_path):
+    fake = Fake_Embeddings(size=8, latency=0)
+    embeddings = Cached_Embeddings(fake, Embedding_Cache(cache_path, 'fake'))
+    assert embeddings.embed_documents([]) == []
+    assert fake.calls == 0
+    assert embeddings.cache.hits == embeddings.cache.misses == 0
+
+
+def test_vectors_round_trip_through_float16(cache_path):
+    fake = Fake_Embeddings(size=8, latency=0)
+    embeddings = Cached_Embeddings(fake, Embedding_Cache(cache_path, 'fake'))
+    first = np.array(embeddings.embed_documents(names(20)))
+    cached = np.array(embeddings.embed_documents(names(20)))
+    assert fake.calls == 1
+    assert cached.shape == (20, 8)
+    assert np.allclose(cached, first, atol=1e-2)
+    assert np.array_equal(cached, first.astype(np.float16).astype(np.float32))
+
+
+def test_hits_and_misses_are_counted_per_text(cache_path):
+    fake = Fake_Embeddings(size=8, latency=0)
+    embeddings = Cached_Embeddings(fake, Embedding_Cache(cache_path, 'fake'))
+    embeddings.embed_documents(names(10))
+    mixed = embeddings.embed_documents(names(10, start=5))
+    cache = embeddings.cache
+    assert (cache.hits, cache.misses) == (5, 15)
+    assert len(cache) == 15 and cache.hit_rate == 0.25
+    assert np.allclose(mixed, fake.embed_documents(names(10, start=5)), atol=1e-2)
+    assert '15 vectors' in embeddings.report()
+
+
+def test_a_new_model_does_not_see_the_old_vectors(cache_path, tmp_path):
+    assert text_key('model-a', 'a.txt') != text_key('model-b', 'a.txt')
+    Cached_Embeddings(Fake_Embeddings(size=8, latency=0), Embedding_Cache(cache_path, 'model-a')).embed_documents(names(5))
+    with pytest.raises(ValueError):
+        Embedding_Cache(cache_path, 'model-b')
+    fake = Fake_Embeddings(size=8, latency=0)
+    embeddings = Cached_Embeddings(fake, Embedding_Cache(str(tmp_path / 'cache_b'), 'model-b'))
+    embeddings.embed_documents(names(5))
+    assert fake.calls == 1 and embeddings.cache.misses == 5
+
+
+def test_cached_vectors_persist_across_reopen(cache_path):
+    first = Cached_Embeddings(Fake_Embeddings(size=8, latency=0), Embedding_Cache(cache_path, 'fake'))
+    vectors = first.embed_documents(names(30))
+    first.embed_documents(names(10, start=30))
+    fake = Fake_Embeddings(size=8, latency=0)
+    reopened = Cached_Embeddings(fake, Embedding_Cache(cache_path, 'fake'))
+    assert len(reopened.cache) == 40
+    assert reopened.embed_documents(names(30)) == np.float16(vectors).astype(np.float32).tolist()
+    assert fake.calls == 0 and reopened.cache.hits == 30
@@ -0,0 +1,79 @@
+import os
+import json
+import pytest
+from embedding_pipeline import Embedding_Pipeline, Fake_Embeddings
+from embedding_job import Embedding_Job
+
+
+class Failing_Embeddings(Fake_Embeddings):
+    def __init__(self, fail_at):
+        super().__init__(size=16, latency=0)
+        self.fail_at = fail_at
+
+    def embed_documents(self, texts, **kwargs):
+        if self.calls + 1 == self.fail_at:
+            raise RuntimeError('connection reset')
+        return super().embed_documents(texts, **kwargs)
+
+
+class Json_Store():
+    """Vectors by name saved to a folder as JSON, the smallest store a job can checkpoint."""
+
+    def __init__(self, path=None):
+        self.vectors = {}
+        if path is not None and os.path.exists(os.path.join(path, 'store.json')):
+            with open(os.path.join(path, 'store.json')) as f:
+                self.vectors = json.load(f)
+
+    def add(self, names, vectors):
+        self.vectors.update(zip(names, vectors))
+
+    def remove(self, names):
+        for name in names:
+            del self.vectors[name]
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'store.json'), 'w') as f:
+            json.dump(self.vectors, f)
+
+
+def run_job(path, embeddings, names):
+    store = {'store': Json_Store(path)}
+    job = Embedding_Job(path, Embedding_Pipeline(embeddings, batch_size=10, concurrency=1, requests_per_minute=10**6),
+                        checkpoint_every=1)
+
+    def reset():
+        store['store'] = Json_Store()
+
+    job.run(names, lambda batch, vectors: store['store'].add(batch, vectors), lambda folder: store['store'].save(folder),
+            reset, lambda stale: store['store'].remove(stale))
+    return job, store['store']
+
+
+def test_embedding_job_resumes_after_the_last_checkpoint(tmp_path):
+    path = str(tmp_path / 'store')
+    names = [f'file_{i}.txt' for i in range(55)]
+    with pytest.raises(RuntimeError):
+        run_job(path, Failing_Embeddings(fail_at=4), names)
+    embeddings = Fake_Embeddings(size=16, latency=0)
+    job, store = run_job(path, embeddings, names)
+    assert job.resumed == 30 and embeddings.calls == 3 and job.state == 'done'
+    assert store.vectors == {name: embeddings.vector(name) for name in names}
+    # A finished job on the same names starts over.
+    embeddings = Fake_Embeddings(size=16, latency=0)
+    job, store = run_job(path, embeddings, names)
+    assert job.resumed == 0 and embeddings.calls == 6 and len(store.vectors) == 55
+
+
+def test_embedding_job_resumes_over_changed_names(tmp_path):
+    path = str(tmp_path / 'store')
+    names = [f'file_{i}.txt' for i in range(55)]
+    with pytest.raises(RuntimeError):
+        run_job(path, Failing_Embeddings(fail_at=4), names)
+    # A name added at the front and one of the embedded names gone: only the new and the unfinished are embedded.
+    changed = ['new.txt'] + [name for name in names if name != 'file_3.txt']
+    embeddings = Fake_Embeddings(size=16, latency=0)
+    job, store = run_job(path, embeddings, changed)
+    assert job.resumed == 29 and job.pipeline.report.texts == 26 and job.state == 'done'
+    assert store.vectors == {name: embeddings.vector(name) for name in changed}
@@ -0,0 +1,126 @@
+import threading
+import pytest
+import embedding_pipeline
+from embedding_pipeline import Token_Bucket, Embedding_Pipeline, Fake_Embeddings, Rate_Limit_Error
+
+
+class Clock():
+    """Stand-in for the time module of embedding_pipeline, sleeping only moves the clock."""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+    perf_counter = monotonic
+
+    def sleep(self, seconds):
+        # A real sleep always moves the clock, even for the rounding left of a wait.
+        self.now += max(seconds, 1e-9)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(embedding_pipeline, 'time', clock)
+    return clock
+
+
+def test_bucket_halves_once_per_burst_and_recovers_additively(clock):
+    bucket = Token_Bucket(20, capacity=4)
+    bucket.slow_down()
+    bucket.slow_down()
+    assert bucket.rate == 10 and bucket.tokens == 0
+    clock.now += 1.5
+    bucket.slow_down()
+    assert bucket.rate == 5
+    for _ in range(3):
+        bucket.speed_up()
+    assert bucket.rate == 8
+    for _ in range(20):
+        bucket.speed_up()
+    assert bucket.rate == 20
+
+
+def test_bucket_never_drops_below_a_64th_of_its_rate(clock):
+    bucket = Token_Bucket(64)
+    for _ in range(10):
+        bucket.slow_down()
+        clock.now += 1.0
+    assert bucket.rate == 1
+
+
+def test_bucket_waits_for_tokens_at_its_rate(clock):
+    bucket = Token_Bucket(10, capacity=2)
+    start = clock.now
+    for _ in range(12):
+        bucket.acquire()
+    assert clock.now - start == pytest.approx(1.0)
+    bucket.slow_down()
+    start = clock.now
+    for _ in range(5):
+        bucket.acquire()
+    assert clock.now - start == pytest.approx(1.0)
+
+
+class Throttled_Embeddings(Fake_Embeddings):
+    """Fake_Embeddings answering the calls whose numbers are in `rejected_calls` with a 429."""
+
+    def __init__(self, rejected_calls):
+        super().__init__(size=4, latency=0)
+        self.rejected_calls = set(rejected_calls)
+        self.attempts = 0
+
+    def embed_documents(self, texts, **kwargs):
+        with self._lock:
+            self.attempts += 1
+            attempt = self.attempts
+        if attempt in self.rejected_calls:
+            self.rejected += 1
+            raise Rate_Limit_Error('429 Resource has been exhausted (e.g. check quota).')
+        return super().embed_documents(texts, **kwargs)
+
+
+def run_pipeline(embeddings, names, concurrency, requests_per_minute=600, **kwargs):
+    pipeline = Embedding_Pipeline(embeddings, batch_size=10, concurrency=concurrency,
+                                  requests_per_minute=requests_per_minute, backoff=0.01, **kwargs)
+    writes = []
+
+    def write(batch, vectors):
+        writes.append((threading.current_thread(), list(batch), vectors))
+
+    return pipeline, pipeline.run(names, write), writes
+
+
+def test_rate_limited_batches_are_retried_and_slow_the_bucket(clock):
+    names = [f'file_{i}.txt' for i in range(100)]
+    embeddings = Throttled_Embeddings(rejected_calls=[3, 4])
+    pipeline, report, writes = run_pipeline(embeddings, names, concurrency=1)
+    assert report.rate_limited == report.retries == 2
+    assert report.texts == 100 and report.batches == 10 and embeddings.calls == 10
+    # Halved once, the second 429 came within the same second, then a step back up per success.
+    assert pipeline.bucket.rate == pytest.approx(10 / 2 + 8 * 10 / 20)
+    assert [name for _, batch, _ in writes for name in batch] == names
+
+
+def test_a_batch_failing_past_max_retries_raises(clock):
+    embeddings = Throttled_Embeddings(rejected_calls=range(1, 10))
+    with pytest.raises(Rate_Limit_Error):
+        run_pipeline(embeddings, ['a.txt'], concurrency=1, max_retries=3)
+    assert embeddings.attempts == 4
+
+
+@pytest.mark.parametrize('concurrency', [1, 4])
+def test_rows_are_written_once_in_batch_order_on_the_calling_thread(concurrency):
+    names = [f'file_{i}.txt' for i in range(250)]
+    embeddings = Throttled_Embeddings(rejected_calls=[2, 5, 6, 11])
+    _, report, writes = run_pipeline(embeddings, names, concurrency, requests_per_minute=60_000)
+    assert {thread for thread, _, _ in writes} == {threading.current_thread()}
+    written = [name for _, batch, _ in writes for name in batch]
+    assert sorted(written) == sorted(names) and report.texts == 250
+    for _, batch, vectors in writes:
+        assert vectors == [embeddings.vector(name) for name in batch]
+        assert batch == names[names.index(batch[0]):names.index(batch[0]) + len(batch)]
+    if concurrency == 1:
+        assert written == names
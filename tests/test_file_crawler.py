@@ -0,0 +1,85 @@
+import os
+import random
+import pytest
+from file_crawler import Files_Crawler, walk_index
+
+
+def sorted_index(file_index):
+    return {name: sorted(paths) for name, paths in file_index.items()}
+
+
+@pytest.fixture
+def tree(tmp_path):
+    rng = random.Random(0)
+    dirs = [tmp_path]
+    for i in range(60):
+        parent = rng.choice(dirs)
+        dirs.append(parent / f'dir_{i % 7}_{i}')
+        dirs[-1].mkdir()
+    for i in range(300):
+        (rng.choice(dirs) / f'file_{i % 40}.txt').write_text('x')
+    return tmp_path
+
+
+def test_crawl_matches_os_walk(tree):
+    expected, _ = walk_index([str(tree)])
+    crawler = Files_Crawler(4)
+    assert sorted_index(crawler.crawl([str(tree)])) == sorted_index(expected)
+    assert crawler.report.dirs == 61 and crawler.report.errors == 0
+
+
+def change_tree(tree):
+    dirs = sorted(p for p in tree.rglob('*') if p.is_dir())
+    for p in sorted(dirs[5].rglob('*'), reverse=True):
+        p.rmdir() if p.is_dir() else p.unlink()
+    dirs[5].rmdir()
+    (dirs[20] / 'new' / 'deeper').mkdir(parents=True)
+    (dirs[20] / 'new' / 'deeper' / 'brand_new.txt').write_text('x')
+    renamed = next(p for p in tree.rglob('*.txt') if dirs[5] not in p.parents)
+    renamed.rename(renamed.with_name('renamed.txt'))
+
+
+def test_update_matches_os_walk_after_changes(tree):
+    from file_metadata import File_Metadata
+    crawler = Files_Crawler(4, metadata=File_Metadata())
+    dir_state = {}
+    file_index = crawler.crawl([str(tree)], dir_state)
+    before = set(file_index)
+    change_tree(tree)
+    new_names, gone_names = crawler.update([str(tree)], file_index, dir_state)
+    expected, _ = walk_index([str(tree)])
+    assert sorted_index(file_index) == sorted_index(expected)
+    assert new_names == set(expected) - before and gone_names == before - set(expected)
+    assert {'brand_new.txt', 'renamed.txt', 'deeper'} <= new_names
+    assert sorted(dir_state) == sorted(root for root, _, _ in os.walk(tree))
+
+
+def test_refresh_relists_the_given_directories(tree):
+    from file_metadata import File_Metadata
+    crawler = Files_Crawler(4, metadata=File_Metadata())
+    dir_state = {}
+    file_index = crawler.crawl([str(tree)], dir_state)
+    changed = sorted(p for p in tree.rglob('*') if p.is_dir())[20]
+    (changed / 'sub').mkdir()
+    (changed / 'sub' / 'inside.txt').write_text('x')
+    new_names, _ = crawler.update([str(changed)], file_index, dir_state, refresh=True)
+    assert new_names == {'sub', 'inside.txt'}
+    assert file_index['inside.txt'] == [str(changed / 'sub' / 'inside.txt')]
+
+
+def test_update_needs_metadata(tree):
+    with pytest.raises(ValueError):
+        Files_Crawler(2).update([str(tree)], {}, {})
+
+
+def test_update_without_the_metadata_of_the_crawl_does_not_duplicate_paths(tree):
+    from file_metadata import File_Metadata
+    dir_state = {}
+    file_index = Files_Crawler(4, metadata=File_Metadata()).crawl([str(tree)], dir_state)
+    # The metadata file went missing: every directory looks new to update() and is listed again.
+    for dir_path in dir_state:
+        dir_state[dir_path] = (-1, 0)
+    Files_Crawler(4, metadata=File_Metadata()).update([str(tree)], file_index, dir_state)
+    expected, _ = walk_index([str(tree)])
+    assert {name: sorted(paths) for name, paths in file_index.items()} == sorted_index(expected)
+    assert all(len(paths) == len(set(paths)) for paths in file_index.values())
@@ -0,0 +1,33 @@
+import os
+from file_metadata import File_Metadata, is_under, load_file_metadata, save_file_metadata
+
+ROOT = os.path.abspath(os.sep)
+DIRS = [os.path.join(ROOT, *parts) for parts in
+        [(), ('a',), ('a', 'b'), ('a', 'b', 'c'), ('a', 'bc'), ('a', 'b-c'), ('ab',), ('z', 'a', 'b')]]
+
+
+def metadata_of(dir_paths):
+    metadata = File_Metadata()
+    for i, dir_path in enumerate(dir_paths):
+        metadata.set_rows(dir_path, [(f'f{i}.pdf', False, 100 * i, 1_000_000_000 * i)])
+    return metadata
+
+
+def test_under_matches_is_under():
+    metadata = metadata_of(DIRS)
+    for under in DIRS + [os.path.join(ROOT, 'a', 'b') + os.sep, os.path.join(ROOT, 'missing')]:
+        found = sorted(path for path, *_ in metadata.query(under=under, limit=100))
+        expected = sorted(os.path.join(d, f'f{i}.pdf') for i, d in enumerate(DIRS) if is_under(d, under))
+        assert found == expected, under
+
+
+def test_under_after_new_directories_and_compaction(tmp_path):
+    metadata = metadata_of(DIRS[:3])
+    assert len(metadata.query(under=os.path.join(ROOT, 'a'))) == 2
+    metadata.set_rows(DIRS[3], [('new.pdf', False, 1, 1)])
+    metadata.drop_dir(DIRS[1])
+    assert sorted(p for p, *_ in metadata.query(under=os.path.join(ROOT, 'a'))) == \
+        sorted([os.path.join(DIRS[2], 'f2.pdf'), os.path.join(DIRS[3], 'new.pdf')])
+    save_file_metadata(str(tmp_path / 'metadata.pkl'), metadata)
+    loaded = load_file_metadata(str(tmp_path / 'metadata.pkl'))
+    assert loaded.query(under=DIRS[3], extensions=['pdf']) == [(os.path.join(DIRS[3], 'new.pdf'), 1, 1, False)]
@@ -0,0 +1,139 @@
+import os
+import numpy as np
+import pytest
+from embedding_pipeline import Fake_Embeddings
+from embedding_job import Embedding_Job
+from file_vectors import File_Vectors, load_file_vectors, mmap_flags
+from mapped_docstore import Mapped_Docstore
+
+
+@pytest.fixture
+def embeddings():
+    return Fake_Embeddings(size=16, latency=0)
+
+
+def random_vectors(n, size=16, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, size)).astype(np.float32)
+
+
+def test_save_without_vectors_round_trips(tmp_path, embeddings):
+    path = str(tmp_path / 'store')
+    File_Vectors(index_type='IVF-PQ').save(path)
+    loaded = load_file_vectors(path, embeddings)
+    assert loaded.store is None and len(loaded) == 0 and loaded.index_type == 'IVF-PQ'
+    assert loaded.search('anything', 5) == []
+
+
+def test_save_without_vectors_replaces_an_older_store(tmp_path, embeddings):
+    path = str(tmp_path / 'store')
+    vectors = File_Vectors()
+    vectors.add(['a.txt', 'b.txt'], random_vectors(2), embeddings)
+    vectors.save(path)
+    File_Vectors().save(path)
+    assert load_file_vectors(path, embeddings).store is None
+    assert not os.path.exists(os.path.join(path, 'index.faiss'))
+
+
+def test_embedding_job_over_no_names_leaves_an_empty_store(tmp_path, embeddings):
+    from embedding_pipeline import Embedding_Pipeline
+    path = str(tmp_path / 'shard.pending')
+    vectors = File_Vectors()
+    job = Embedding_Job(path, Embedding_Pipeline(embeddings, requests_per_minute=10**6))
+    job.run([], lambda batch, batch_vectors: vectors.add(batch, batch_vectors, embeddings), vectors.save,
+            lambda: None, vectors.remove)
+    assert job.state == 'done'
+    assert load_file_vectors(path, embeddings).store is None
+
+
+@pytest.mark.parametrize('n', [1, 50, 300])
+@pytest.mark.parametrize('index_type', ['Flat', 'HNSW', 'IVF-Flat', 'IVF-PQ', 'SQfp16'])
+def test_remove_compact_and_rebuild(tmp_path, embeddings, index_type, n):
+    names = [f'name_{i}' for i in range(n)]
+    vectors = random_vectors(n)
+    store = File_Vectors()
+    store.add(names, vectors, embeddings)
+    store.rebuild(index_type)
+    assert store.index_type == index_type and len(store) == n
+    removed = set(names[::3])
+    assert store.remove(list(removed) + ['unknown']) == len(removed)
+    assert len(store) == n - len(removed) and not store.is_live(names[0])
+    found = {name for name, _ in store.search_by_vector(vectors[0], k=n)}
+    assert (found or n == 1) and not found & removed
+    store.compact()
+    assert store.store.index.ntotal == len(store) == n - len(removed) and not store.removed
+    assert set(store.ids()) == set(names) - removed
+    if n > 1:
+        # Exact for every type but the PQ codes.
+        name, _ = store.search_by_vector(vectors[1], k=1)[0]
+        assert name == names[1] or index_type == 'IVF-PQ'
+    # Adding a removed name back stores its vector again.
+    store.add([names[0]], vectors[:1], embeddings)
+    assert store.is_live(names[0])
+    store.save(str(tmp_path / 'store'))
+    loaded = load_file_vectors(str(tmp_path / 'store'), embeddings)
+    assert loaded.index_type == index_type and set(loaded.ids()) == set(store.ids()) and len(loaded) == len(store)
+
+
+def app_store(embeddings, index_type, n=400):
+    names = [f'app_{i}.exe' if i % 20 == 0 else f'app_{i}.lnk' if i % 20 == 1 else f'doc_{i}.pdf' for i in range(n)]
+    vectors = random_vectors(n, seed=1)
+    store = File_Vectors()
+    store.add(names, vectors, embeddings)
+    if index_type != 'Flat':
+        store.rebuild(index_type)
+    return store, names, vectors
+
+
+@pytest.mark.parametrize('exact_filter_rows', [50_000, 0])
+@pytest.mark.parametrize('index_type', ['Flat', 'HNSW', 'IVF-Flat'])
+def test_extension_filter_returns_only_apps(embeddings, index_type, exact_filter_rows):
+    store, names, vectors = app_store(embeddings, index_type)
+    store.exact_filter_rows = exact_filter_rows
+    apps = {'.exe', '.lnk'}
+    rows, selected_vectors = store.filter_rows(frozenset(apps))
+    assert sorted(rows.tolist()) == [i for i, name in enumerate(names) if name.endswith(('.exe', '.lnk'))]
+    assert (selected_vectors is None) == (exact_filter_rows == 0)
+    results = store.search_by_vectors(vectors[[20, 2]], k=10, extensions=apps)
+    for hits in results:
+        assert len(hits) == 10 and all(name.endswith(('.exe', '.lnk')) for name, _ in hits)
+    assert results[0][0][0] == 'app_20.exe' or index_type != 'Flat'
+    # Removed apps are left out, added ones are found.
+    store.remove(['app_20.exe'])
+    store.add(['new.lnk'], vectors[20:21], embeddings)
+    hits = store.search_by_vector(vectors[20], k=10, extensions=apps)
+    assert 'app_20.exe' not in dict(hits) and len(hits) == 10
+    assert hits[0][0] == 'new.lnk' or index_type != 'Flat'
+    assert store.search_by_vector(vectors[0], k=5, extensions={'.zip'}) == []
+
+
+@pytest.mark.parametrize('index_type', ['Flat', 'HNSW', 'IVF-Flat', 'SQfp16'])
+def test_mapped_load_searches_like_the_saved_store(tmp_path, embeddings, index_type):
+    path = str(tmp_path / 'store')
+    store, names, vectors = app_store(embeddings, index_type, n=300)
+    store.remove(names[5:10])
+    store.save(path)
+    mapped = load_file_vectors(path, embeddings, mapped=True)
+    assert isinstance(mapped.store.docstore, Mapped_Docstore) and mapped.mapped_path == path
+    assert mapped.index_type == index_type and mapped.removed == set(names[5:10]) and len(mapped) == len(store)
+    assert mapped.search_by_vectors(vectors[:20], 10) == store.search_by_vectors(vectors[:20], 10)
+    assert mapped.search_by_vectors(vectors[:5], 5, {'.exe'}) == store.search_by_vectors(vectors[:5], 5, {'.exe'})
+    # A change loads the store into memory first, the mapped files are left as they were.
+    mapped.add(['new.txt'], random_vectors(1, seed=2), embeddings)
+    assert mapped.mapped_path is None and mapped.is_live('new.txt')
+    assert not load_file_vectors(path, embeddings, mapped=True).is_live('new.txt')
+
+
+def test_mapped_load_reads_the_index_without_the_flat_mmap_flag(tmp_path, embeddings, monkeypatch):
+    import faiss
+    path = str(tmp_path / 'store')
+    store, names, vectors = app_store(embeddings, 'Flat', n=100)
+    store.save(path)
+    monkeypatch.delattr(faiss, 'IO_FLAG_MMAP_IFC', raising=False)
+    assert mmap_flags('Flat') is None and mmap_flags('IVF-Flat') is not None
+    calls = []
+    read_index = faiss.read_index
+    monkeypatch.setattr(faiss, 'read_index', lambda *args: calls.append(args) or read_index(*args))
+    mapped = load_file_vectors(path, embeddings, mapped=True)
+    assert [len(args) for args in calls] == [1]
+    assert isinstance(mapped.store.docstore, Mapped_Docstore)
+    assert mapped.search_by_vectors(vectors[:10], 5) == store.search_by_vectors(vectors[:10], 5)
@@ -0,0 +1,91 @@
+import os
+import pickle
+from array import array
+from itertools import accumulate
+from files_index_store import (Files_Index, Files_Index_File, HEADER_V1, MAGIC, encode, load_files_index,
+                               save_files_index)
+
+SEP = os.sep
+INDEX = {
+    'a.txt': [f'{SEP}home{SEP}a.txt', f'{SEP}home{SEP}docs{SEP}a.txt'],
+    'docs': [f'{SEP}home{SEP}docs'],
+    'café \udcff.pdf': [f'{SEP}home{SEP}docs{SEP}café \udcff.pdf'],
+    'odd': ['odd', f'{SEP}other{SEP}name'],
+    'z': [],
+}
+
+
+def write_v1(path, file_index):
+    ''' A version 1 file: full paths in paths_blob and no directory sections. '''
+    items = sorted(file_index.items(), key=lambda item: encode(item[0]))
+    names = [encode(name) for name, _ in items]
+    paths = [encode(p) for _, ps in items for p in ps]
+    sections = [array('Q', accumulate(map(len, names), initial=0)).tobytes(), b''.join(names),
+                array('Q', accumulate((len(ps) for _, ps in items), initial=0)).tobytes(),
+                array('Q', accumulate(map(len, paths), initial=0)).tobytes(), b''.join(paths)]
+    offsets, position = [], HEADER_V1.size
+    for section in sections:
+        position += -position % 8
+        offsets.append(position)
+        position += len(section)
+    with open(path, 'wb') as f:
+        f.write(HEADER_V1.pack(MAGIC, 1, 0, len(items), len(paths), *offsets))
+        for section, offset in zip(sections, offsets):
+            f.write(b'\0' * (offset - f.tell()) + section)
+
+
+def test_round_trip(tmp_path):
+    index = save_files_index(str(tmp_path / 'index.idx'), dict(INDEX))
+    reopened = Files_Index_File(str(tmp_path / 'index.idx'))
+    assert reopened.version == 2 and dict(reopened.items()) == INDEX
+    assert reopened['odd'] == INDEX['odd'] and 'missing' not in reopened
+    assert [name for name, _ in index.items()] == sorted(INDEX, key=encode)
+    reopened.close()
+    index.close()
+
+
+def test_version_1_files_are_read_and_rewritten_as_version_2(tmp_path):
+    path = str(tmp_path / 'index.idx')
+    write_v1(path, INDEX)
+    index = Files_Index(path)
+    assert index.base.version == 1 and dict(index.items()) == INDEX
+    index['new.txt'] = [f'{SEP}home{SEP}new.txt']
+    del index['docs']
+    index.save()
+    assert index.base.version == 2
+    assert dict(index.items()) == {**{k: v for k, v in INDEX.items() if k != 'docs'}, 'new.txt': [f'{SEP}home{SEP}new.txt']}
+    index.close()
+
+
+def test_pickled_index_is_converted(tmp_path):
+    with open(tmp_path / 'index.pkl', 'wb') as f:
+        pickle.dump(INDEX, f)
+    index = load_files_index(str(tmp_path / 'index.idx'), str(tmp_path / 'index.pkl'))
+    assert os.path.exists(tmp_path / 'index.idx') and dict(index.items()) == INDEX and len(index) == len(INDEX)
+    index.close()
+
+
+def test_saving_while_other_threads_read(tmp_path):
+    import threading
+    index = save_files_index(str(tmp_path / 'index.idx'), {f'name_{i}': [f'{SEP}d{SEP}name_{i}'] for i in range(2000)})
+    errors, stop = [], threading.Event()
+
+    def read():
+        while not stop.is_set():
+            try:
+                assert sum(1 for _ in index.items()) >= 2000 and index['name_7'] == [f'{SEP}d{SEP}name_7']
+            except Exception as e:
+                errors.append(e)
+                return
+
+    readers = [threading.Thread(target=read) for _ in range(3)]
+    for reader in readers:
+        reader.start()
+    for i in range(10):
+        index[f'added_{i}'] = [f'{SEP}d{SEP}added_{i}']
+        index.save()
+    stop.set()
+    for reader in readers:
+        reader.join()
+    assert not errors and len(index) == 2010
+    index.close()
@@ -0,0 +1,52 @@
+import os
+import sys
+import time
+import queue
+import pytest
+from files_watcher import Inotify_Backend
+
+
+def changed_dirs(events, timeout=2.0):
+    dirs = set()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            dirs.add(events.get(timeout=0.2))
+        except queue.Empty:
+            if dirs:
+                break
+    return dirs
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify is Linux only')
+def test_events_below_a_moved_directory_have_the_new_path(tmp_path):
+    (tmp_path / 'a' / 'sub').mkdir(parents=True)
+    (tmp_path / 'b').mkdir()
+    dir_paths = [str(tmp_path), str(tmp_path / 'a'), str(tmp_path / 'a' / 'sub'), str(tmp_path / 'b')]
+    backend, events = Inotify_Backend(), queue.Queue()
+    backend.start([str(tmp_path)], dir_paths, events.put)
+    try:
+        os.rename(tmp_path / 'a', tmp_path / 'b' / 'a')
+        assert changed_dirs(events) == {str(tmp_path), str(tmp_path / 'b')}
+        (tmp_path / 'b' / 'a' / 'sub' / 'new.txt').write_text('')
+        assert changed_dirs(events) == {str(tmp_path / 'b' / 'a' / 'sub')}
+        assert sorted(backend.watches.values()) == sorted([str(tmp_path), str(tmp_path / 'b'), str(tmp_path / 'b' / 'a'),
+                                                           str(tmp_path / 'b' / 'a' / 'sub')])
+    finally:
+        backend.stop()
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify is Linux only')
+def test_a_directory_moved_out_is_no_longer_watched(tmp_path):
+    (tmp_path / 'root' / 'a' / 'sub').mkdir(parents=True)
+    root = tmp_path / 'root'
+    backend, events = Inotify_Backend(), queue.Queue()
+    backend.start([str(root)], [str(root), str(root / 'a'), str(root / 'a' / 'sub')], events.put)
+    try:
+        os.rename(root / 'a', tmp_path / 'a')
+        assert changed_dirs(events) == {str(root)}
+        (tmp_path / 'a' / 'sub' / 'new.txt').write_text('')
+        assert changed_dirs(events, timeout=1.0) == set()
+        assert list(backend.watches.values()) == [str(root)]
+    finally:
+        backend.stop()
@@ -0,0 +1,77 @@
+import os
+import random
+import pytest
+from file_crawler import Files_Crawler, read_dir_state, walk_index
+from file_metadata import File_Metadata, load_file_metadata
+from files_index_store import Files_Index
+from index_shards import Sharded_Index_Builder, resume_state
+
+
+@pytest.fixture
+def tree(tmp_path):
+    rng = random.Random(1)
+    root = tmp_path / 'root'
+    dirs = [root]
+    root.mkdir()
+    for i in range(80):
+        dirs.append(rng.choice(dirs) / f'dir_{i}')
+        dirs[-1].mkdir()
+    for i in range(400):
+        (rng.choice(dirs) / f'file_{i % 50}.txt').write_text('x' * i)
+    return root
+
+
+def build(tmp_path, tree, **kwargs):
+    builder = Sharded_Index_Builder(str(tmp_path / 'shards'), max_workers=2, **kwargs)
+    files = builder.build([str(tree)], str(tmp_path / 'index.idx'), str(tmp_path / 'dir_state.pkl'),
+                          str(tmp_path / 'metadata.pkl'))
+    for new_file in files:
+        os.replace(new_file, new_file[:-len('.new')])
+    return builder
+
+
+def check_output(tmp_path, tree):
+    expected, _ = walk_index([str(tree)])
+    index = Files_Index(str(tmp_path / 'index.idx'))
+    assert {name: sorted(paths) for name, paths in index.items()} == {name: sorted(paths) for name, paths in expected.items()}
+    index.close()
+    assert sorted(read_dir_state(str(tmp_path / 'dir_state.pkl'))) == sorted(root for root, _, _ in os.walk(tree))
+    metadata = File_Metadata()
+    Files_Crawler(2, metadata=metadata).crawl([str(tree)])
+    assert sorted(load_file_metadata(str(tmp_path / 'metadata.pkl')).query(limit=10**6)) == sorted(metadata.query(limit=10**6))
+
+
+def test_small_limits_flush_many_shards(tmp_path, tree):
+    builder = Sharded_Index_Builder(str(tmp_path / 'shards'), shard_entries=10**6, max_memory=4096, max_workers=2)
+    manifest = builder.crawl([str(tree)], record_metadata=True)
+    assert len(manifest['shards']) > 10
+    build(tmp_path, tree, shard_entries=10**6, max_memory=4096)
+    check_output(tmp_path, tree)
+    assert not os.path.exists(tmp_path / 'shards')
+
+
+def test_resume_after_an_interrupted_build(tmp_path, tree, monkeypatch):
+    flush = Sharded_Index_Builder.flush
+    flushed = []
+
+    def flush_then_die(self, manifest, buffer, dir_records):
+        if len(flushed) == 6:
+            raise KeyboardInterrupt
+        flushed.append(len(dir_records))
+        flush(self, manifest, buffer, dir_records)
+
+    monkeypatch.setattr(Sharded_Index_Builder, 'flush', flush_then_die)
+    with pytest.raises(KeyboardInterrupt):
+        build(tmp_path, tree, shard_entries=30)
+    monkeypatch.setattr(Sharded_Index_Builder, 'flush', flush)
+    builder = build(tmp_path, tree, shard_entries=30)
+    # Finished subtrees are not listed again, only the directories on the way to them.
+    assert builder.report.dirs < 81
+    check_output(tmp_path, tree)
+
+
+def test_resume_state_keeps_only_the_frontier():
+    records = [('/r', None, ['/r/a', '/r/b'], None), ('/r/a', None, ['/r/a/x'], None), ('/r/a/x', None, [], None),
+               ('/r/b', None, ['/r/b/y', '/r/b/z'], None), ('/r/b/y', None, [], None)]
+    assert resume_state(records) == ({'/r', '/r/b'}, {'/r/a', '/r/b/y'})
+    assert resume_state(records + [('/r/b/z', None, [], None)]) == (set(), {'/r'})
@@ -0,0 +1,49 @@
+import os
+import sys
+import json
+import subprocess
+import numpy as np
+import pytest
+from local_embeddings import Char_NGram_Embeddings, normalize_name
+
+NAMES = ['Budget_Report_2023.xlsx', 'budget.txt', 'report.docx', 'chrome.exe', 'Chromebook Notes.pdf', 'notes.txt',
+         'MyReport_2023v2.pdf', 'photo_001.jpg', 'setup.exe', 'Setup Guide.pdf', 'résumé.pdf', 'bad\udcff.lnk', 'a']
+
+
+def test_vectors_have_the_size_and_unit_length():
+    for size in (64, 384):
+        vectors = np.array(Char_NGram_Embeddings(size=size).embed_documents(NAMES))
+        assert vectors.shape == (len(NAMES), size)
+        assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0, atol=1e-5)
+    assert Char_NGram_Embeddings().embed_documents([]) == []
+    assert len(Char_NGram_Embeddings(size=64).embed_query('')) == 64
+
+
+def test_vectors_are_deterministic_across_batches_and_processes():
+    embeddings = Char_NGram_Embeddings(size=128)
+    vectors = embeddings.embed_documents(NAMES)
+    assert Char_NGram_Embeddings(size=128, batch_size=3).embed_documents(NAMES) == vectors
+    assert [embeddings.embed_query(name) for name in NAMES] == vectors
+    script = ('import sys, json; from local_embeddings import Char_NGram_Embeddings; '
+              'print(json.dumps(Char_NGram_Embeddings(size=128).embed_documents(json.loads(sys.argv[1]))))')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    names = [name for name in NAMES if '\udcff' not in name]
+    run = subprocess.run([sys.executable, '-c', script, json.dumps(names)], capture_output=True, text=True, cwd=root,
+                         env={**os.environ, 'PYTHONHASHSEED': '12345'}, check=True)
+    assert json.loads(run.stdout) == embeddings.embed_documents(names)
+
+
+def test_case_and_separators_do_not_change_the_vector():
+    embeddings = Char_NGram_Embeddings()
+    assert normalize_name('MyReport_2023v2.pdf') == ' my report 2023 v 2 pdf '
+    assert embeddings.embed_query('Budget_Report.pdf') == embeddings.embed_query('budget report pdf')
+
+
+@pytest.mark.parametrize('query, expected', [('budget report', 'Budget_Report_2023.xlsx'), ('chrme.exe', 'chrome.exe'),
+                                             ('setup guide', 'Setup Guide.pdf'), ('résumé', 'résumé.pdf'),
+                                             ('photo 1', 'photo_001.jpg'), ('chromebook', 'Chromebook Notes.pdf')])
+def test_similar_names_rank_first(query, expected):
+    embeddings = Char_NGram_Embeddings()
+    vectors = np.array(embeddings.embed_documents(NAMES))
+    scores = vectors @ np.array(embeddings.embed_query(query))
+    assert NAMES[int(np.argmax(scores))] == expected
@@ -0,0 +1,53 @@
+import pytest
+from mapped_docstore import Mapped_Docstore, Row_Ids, write_docstore_file
+
+NAMES = ['a.txt', 'résumé.pdf', '', 'ファイル.exe', 'bad\udcff.lnk']
+
+
+@pytest.fixture
+def docstore_path(tmp_path):
+    return str(tmp_path / 'docstore.bin')
+
+
+def test_names_as_ids_need_no_id_section(docstore_path):
+    write_docstore_file(docstore_path, NAMES, NAMES)
+    docstore = Mapped_Docstore(docstore_path)
+    assert docstore.ids_same and len(docstore) == len(NAMES)
+    assert [docstore.name_at(row) for row in range(len(NAMES))] == NAMES
+    assert docstore.search('anything.txt').page_content == 'anything.txt'
+    docstore.close()
+
+
+def test_other_ids_are_looked_up_by_row(docstore_path):
+    ids = [f'uuid-{i}' for i in range(len(NAMES))]
+    write_docstore_file(docstore_path, ids, NAMES)
+    docstore = Mapped_Docstore(docstore_path)
+    assert not docstore.ids_same
+    assert [docstore.id_at(row) for row in range(len(NAMES))] == ids
+    assert docstore.search('uuid-3').page_content == NAMES[3]
+    assert docstore.search('uuid-9') == 'ID uuid-9 not found.'
+    docstore.close()
+
+
+def test_row_ids_map_every_row_to_its_id(docstore_path):
+    ids = [f'uuid-{i}' for i in range(len(NAMES))]
+    write_docstore_file(docstore_path, ids, NAMES)
+    docstore = Mapped_Docstore(docstore_path)
+    row_ids = Row_Ids(docstore)
+    assert len(row_ids) == len(NAMES) and list(row_ids) == list(range(len(NAMES)))
+    assert dict(row_ids) == dict(enumerate(ids))
+    assert row_ids.get(len(NAMES)) is None and row_ids.get(-1) is None
+    with pytest.raises(KeyError):
+        row_ids[len(NAMES)]
+    docstore.close()
+
+
+def test_empty_docstore_and_foreign_files(docstore_path, tmp_path):
+    write_docstore_file(docstore_path, [], [])
+    docstore = Mapped_Docstore(docstore_path)
+    assert len(docstore) == 0 and len(Row_Ids(docstore)) == 0
+    docstore.close()
+    other = tmp_path / 'index.pkl'
+    other.write_bytes(b'\x80\x04' + b'\0' * 64)
+    with pytest.raises(ValueError):
+        Mapped_Docstore(str(other))
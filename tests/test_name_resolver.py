@@ -0,0 +1,54 @@
+import os
+import pytest
+from name_resolver import Name_Resolver, load_name_aliases
+from name_search import BM25_Index, Stem_Index
+
+NAMES = ['chrome.exe', 'firefox.exe', 'Annual_Budget_Report.pdf', 'Budget_Notes.txt', 'thesis_draft.docx']
+
+
+@pytest.fixture
+def resolver(tmp_path):
+    (tmp_path / 'aliases.txt').write_text('# alias: names\nWeb  Browser: chrome.exe, firefox.exe\nbroken line\n')
+    return Name_Resolver(load_name_aliases(str(tmp_path / 'aliases.txt')))
+
+
+@pytest.fixture
+def tiers(resolver):
+    stems, tokens, expanded = Stem_Index(NAMES), BM25_Index(NAMES), []
+
+    def exact(query):
+        return stems.lookup(query)
+
+    def lexical(query):
+        found = tokens.search(query, 10)
+        return found if found and tokens.covers(query, found[0]) else []
+
+    def expansion(query):
+        expanded.append(query)
+        return ['none']
+
+    return expanded, [('exact', exact), ('alias', lambda query: [n for name in resolver.alias_names(query) for n in exact(name)]),
+                      ('lexical', lexical), ('expansion', expansion)]
+
+
+def test_each_query_is_answered_by_the_cheapest_confident_tier(resolver, tiers):
+    expanded, tiers = tiers
+    assert resolver.resolve('Chrome', tiers)[:2] == (['chrome.exe'], 'exact')
+    assert resolver.resolve('web browser', tiers)[:2] == (['chrome.exe', 'firefox.exe'], 'alias')
+    names, tier, _ = resolver.resolve('budget report', tiers)
+    assert tier == 'lexical' and names == ['Annual_Budget_Report.pdf', 'Budget_Notes.txt']
+    assert resolver.resolve('something to write in', tiers)[:2] == (['none'], 'expansion')
+    # "browser" alone is not the alias, and a word the top name lacks is not lexical.
+    assert resolver.resolve('browser', tiers)[1] == 'expansion'
+    assert resolver.resolve('budget thesis', tiers)[1] == 'expansion'
+    assert expanded == ['something to write in', 'browser', 'budget thesis']
+    assert {tier: answers for tier, (answers, _) in resolver.stats.items()} == \
+        {'exact': 1, 'alias': 1, 'lexical': 1, 'expansion': 3}
+    assert resolver.saved(0.0) == pytest.approx(resolver.mean('expansion'))
+
+
+def test_aliases_file():
+    assert load_name_aliases(os.path.join(os.sep, 'missing', 'aliases.txt')) == {}
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    aliases = load_name_aliases(os.path.join(repo, 'name_aliases.txt'))
+    assert aliases and all(key == ' '.join(key.lower().split()) and names for key, names in aliases.items())
@@ -0,0 +1,80 @@
+import random
+import pytest
+from name_search import Trigram_Index
+
+NAMES = ['Budget_Report_2023.xlsx', 'budget.txt', 'report.docx', 'chrome.exe', 'Chrome', 'Chromebook Notes.pdf',
+         'notes.txt', 'MyReport_2023v2.pdf', 'photo_001.jpg', 'photo_002.jpg', 'setup.exe', 'Setup Guide.pdf', 'ab']
+
+
+@pytest.fixture(scope='module')
+def many_names():
+    rng = random.Random(0)
+    words = ['report', 'budget', 'photo', 'notes', 'chrome', 'setup', 'final', 'draft', 'tax', 'résumé']
+    return [f'{rng.choice(words)}{rng.choice(["_", " ", "-", ""])}{rng.choice(words).title()}_{rng.randint(0, 999)}'
+            f'{rng.choice([".pdf", ".txt", ".exe", ""])}' for _ in range(3000)]
+
+
+def test_trigram_substring_and_prefix_match_a_scan(many_names):
+    index = Trigram_Index(many_names)
+    for query in ['rep', 'ORT_', 'get notes', 'sumé', 'ax_1', 'xyz', 'ft-ta', 'a']:
+        expected = sorted(name for name in many_names if query.lower() in name.lower())
+        assert sorted(index.substring(query, limit=len(many_names))) == expected, query
+    for query in ['photo', 'Tax_', 'r', 'zzz']:
+        expected = sorted(name for name in many_names if name.lower().startswith(query.lower()))
+        assert sorted(index.prefix(query, limit=len(many_names))) == expected, query
+
+
+def test_trigram_ranking():
+    index = Trigram_Index(NAMES)
+    assert index.search('chrome') == ['Chrome', 'chrome.exe', 'Chromebook Notes.pdf']
+    assert index.search('report', limit=2) == ['report.docx', 'MyReport_2023v2.pdf']
+    assert index.search('set', mode='prefix') == ['setup.exe', 'Setup Guide.pdf']
+
+
+def test_symspell_finds_typos_and_matches_brute_force(many_names):
+    from name_search import SymSpell_Index, edit_distance, name_stem
+    counts = {}
+    for name in many_names + NAMES:
+        counts[name] = counts.get(name, 0) + 1
+    index = SymSpell_Index(counts.items(), max_distance=2)
+    assert index.lookup('chrom', limit=2) == [('chrome.exe', 1, 2), ('Chrome', 1, 2)]
+    assert [name for name, _, _ in index.lookup('setpu')] == ['setup.exe']
+    assert index.lookup('budgte.txt')[0] == ('budget.txt', 1, 1)
+    for query in ['notes', 'ntoes', 'photo_01', 'reprt_Tax_12', 'xyzzy']:
+        stem = name_stem(query)
+        expected = sorted(name for name in counts if edit_distance(stem, name_stem(name), 2) <= 2)
+        assert sorted(name for name, _, _ in index.lookup(query, limit=len(counts))) == expected, query
+
+
+def test_edit_distance_counts_transpositions_once():
+    from name_search import edit_distance
+    assert edit_distance('chrome', 'chrome', 2) == 0
+    assert edit_distance('chrome', 'hcrome', 2) == 1
+    assert edit_distance('chrome', 'cr', 2) == 3
+
+
+def test_bm25_finds_names_by_their_words_in_any_order():
+    from name_search import BM25_Index, name_tokens
+    assert name_tokens('MyReport_2023v2.pdf') == ['my', 'report', '2023', 'v', '2', 'pdf']
+    index = BM25_Index(NAMES)
+    assert index.search('report budget 2023')[0] == 'Budget_Report_2023.xlsx'
+    assert index.search('notes')[:2] == ['notes.txt', 'Chromebook Notes.pdf']
+    assert index.search('unknown words') == []
+    assert index.search('setup', extensions={'.pdf'}) == ['Setup Guide.pdf']
+    assert index.covers('2023 report', 'MyReport_2023v2.pdf') and not index.covers('report tax', 'report.docx')
+
+
+def test_reciprocal_rank_fusion():
+    from name_search import reciprocal_rank_fusion
+    assert reciprocal_rank_fusion([['a', 'b', 'c'], ['b', 'c'], ['c']]) == ['c', 'b', 'a']
+    assert reciprocal_rank_fusion([['a', 'b'], ['a']], limit=1) == ['a']
+
+
+def test_stem_index_finds_names_by_their_stem():
+    from name_search import Stem_Index
+    index = Stem_Index(NAMES + ['chrome.lnk'])
+    assert index.lookup('CHROME') == ['chrome.exe', 'Chrome', 'chrome.lnk']
+    assert index.lookup('chrome.lnk') == ['chrome.lnk', 'chrome.exe', 'Chrome']
+    assert index.lookup('chrome', extensions={'.lnk'}) == ['chrome.lnk']
+    assert index.lookup('chrom') == [] and index.lookup('setup', limit=1) == ['setup.exe']
+    assert 'Setup Guide.pdf' in index and 'setup guide.pdf' not in index
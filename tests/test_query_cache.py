@@ -0,0 +1,38 @@
+import time
+from query_cache import Query_Cache, normalize_query
+
+
+def test_bump_invalidates_older_entries():
+    cache = Query_Cache()
+    calls = []
+    compute = lambda: calls.append(1) or len(calls)
+    assert cache.lookup('q', compute) == 1 and cache.lookup('q', compute) == 1
+    cache.bump()
+    assert cache.lookup('q', compute) == 2
+    assert (cache.hits, cache.misses, cache.stale) == (1, 2, 1)
+
+
+def test_result_computed_across_a_bump_is_not_stored():
+    cache = Query_Cache()
+
+    def compute():
+        # The index changes while the search runs.
+        cache.bump()
+        return 'old'
+
+    assert cache.lookup('q', compute) == 'old'
+    assert len(cache) == 0 and cache.get('q') == (False, None)
+
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    cache = Query_Cache(max_entries=2, ttl=10)
+    for key in 'abc':
+        cache.put(key, key.upper(), cache.generation)
+    assert cache.get('a') == (False, None) and cache.evictions == 1
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 11)
+    assert cache.get('b') == (False, None) and cache.stale == 1
+
+
+def test_normalize_query():
+    assert normalize_query('  Open   Chrome ') == normalize_query('open chrome') == 'open chrome'
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+from embedding_pipeline import Fake_Embeddings
+from file_vectors import File_Vectors
+from vector_shards import Vector_Shards
+
+
+@pytest.fixture
+def shards(tmp_path):
+    (tmp_path / 'c').mkdir()
+    (tmp_path / 'd').mkdir()
+    roots = [str(tmp_path / 'missing'), str(tmp_path / 'c'), str(tmp_path / 'd')]
+    paths = {'a.txt': f'{roots[1]}/a.txt', 'b.txt': f'{roots[2]}/b.txt', 'c.txt': f'{roots[1]}/c.txt', 'none': 'none'}
+    shards = Vector_Shards(str(tmp_path / 'shards'), roots, paths.get, File_Vectors, None)
+    shards.embeddings = Fake_Embeddings(size=8, latency=0)
+    return shards
+
+
+def vectors(n):
+    return np.random.default_rng(n).standard_normal((n, 8)).astype(np.float32)
+
+
+def test_names_without_a_root_go_to_the_first_existing_root(shards):
+    shards.add(['a.txt', 'b.txt', 'none'], vectors(3), shards.embeddings)
+    missing, c, d = shards.roots
+    assert shards.shards[missing].store is None
+    assert sorted(shards.shards[c].ids()) == ['a.txt', 'none']
+    assert sorted(shards.shards[d].ids()) == ['b.txt']
+
+
+def test_replace_applies_the_changes_made_while_the_new_shard_was_built(shards):
+    c = shards.roots[1]
+    shards.add(['a.txt'], vectors(1), shards.embeddings)
+    shards.track_changes(c)
+    new_shard = File_Vectors()
+    new_shard.add(['a.txt'], vectors(1), shards.embeddings)
+    shards.add(['c.txt'], vectors(1), shards.embeddings)
+    shards.remove(['a.txt'])
+    shards.replace(c, new_shard)
+    assert shards.shards[c] is new_shard
+    assert new_shard.is_live('c.txt') and not new_shard.is_live('a.txt')
+    assert c not in shards.changes
+
+
+def test_search_with_extensions_returns_only_apps_from_every_shard(tmp_path):
+    roots = [str(tmp_path / 'c'), str(tmp_path / 'd')]
+    for root in roots:
+        (tmp_path / root).mkdir()
+    names = [f'file{i}.{ext}' for i, ext in enumerate(['exe', 'txt', 'lnk', 'pdf'] * 50)]
+    paths = {name: f'{roots[i % 3 % 2]}/{name}' for i, name in enumerate(names)}
+    shards = Vector_Shards(str(tmp_path / 'shards'), roots, paths.get, File_Vectors, None)
+    shards.embeddings = Fake_Embeddings(size=8, latency=0)
+    shards.add(names, vectors(len(names)), shards.embeddings)
+    found = shards.search('file1', 20, ['.exe', '.lnk'])
+    assert len(found) == 20
+    assert all(name.endswith(('.exe', '.lnk')) for name in found)
+    assert {paths[name][:-len(name) - 1] for name in found} == set(roots)
+
+
+def spread_shards(tmp_path, n=300):
+    roots = [str(tmp_path / f'root{i}') for i in range(3)]
+    for root in roots:
+        (tmp_path / root).mkdir()
+    names = [f'file{i}.{"exe" if i % 4 == 0 else "txt"}' for i in range(n)]
+    paths = {name: f'{roots[i % 3]}/{name}' for i, name in enumerate(names)}
+    shards = Vector_Shards(str(tmp_path / 'shards'), roots, paths.get, File_Vectors, None)
+    shards.embeddings = Fake_Embeddings(size=8, latency=0)
+    shards.add(names, np.array(shards.embeddings.embed_documents(names), dtype=np.float32), shards.embeddings)
+    return shards, names
+
+
+@pytest.mark.parametrize('extensions', [None, ['.exe']])
+def test_search_many_matches_one_search_per_query(tmp_path, extensions):
+    shards, names = spread_shards(tmp_path)
+    shards.remove(names[:30:2])
+    queries = ['file7.txt', 'file12.exe', 'report', 'file299.txt']
+    timings = {}
+    results = shards.search_many(queries, 15, timings, extensions)
+    assert results == [shards.search(query, 15, extensions) for query in queries]
+    assert all(len(found) == 15 for found in results) and set(timings) == {'embed', 'search'}
+    assert shards.search_many([], 15) == []
+
+
+def test_merge_keeps_the_best_k_over_all_shards(tmp_path):
+    shards, names = spread_shards(tmp_path)
+    query = 'file42.txt'
+    vector = np.array(shards.embeddings.embed_query(query), dtype=np.float32)
+    everything = np.array(shards.embeddings.embed_documents(names), dtype=np.float32)
+    best = [names[i] for i in np.argsort(((everything - vector) ** 2).sum(axis=1), kind='stable')[:12]]
+    assert shards.search(query, 12) == best
+    assert shards.search_many([query], 12) == [best]
+    assert best[0] == query and len({shards.root_of(shards.first_path(name)) for name in best}) > 1
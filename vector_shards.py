@@ -0,0 +1,339 @@
+import os
+import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from file_metadata import is_under
+from embedding_job import recover_checkpoint
+from embedding_cache import embed_queries
+from file_vectors import Compaction_Report, iter_vectors
+
+
+def shard_name(root):
+    ''' Folder name of the shard of a root path: "C:\\" -> "C", "/home/me" -> "home_me". '''
+    return re.sub(r'[^\w.-]+', '_', root).strip('_') or 'root'
+
+
+class Vector_Shards():
+    """
+    The FAISS store of file names split into one File_Vectors shard per root path, each saved in its own folder
+    under path and guarded by its own lock. A name goes to the shard of the root its first path is under.
+    A query is embedded once and searched in every shard on a thread pool (faiss releases the GIL), the hits are
+    merged by distance. Re-embedding a root builds a new shard off to the side and swaps it in with replace(),
+    so searches and updates of the other roots never wait for it. The names added and removed meanwhile are
+    logged (see track_changes) and replayed into the new shard before it is swapped in.
+    Names without a path under a root (like 'none') go to the first root that exists on this machine.
+    """
+
+    def __init__(self, path, roots, first_path, new_vectors, load_vectors):
+        self.path = path
+        self.roots = list(roots)
+        # name -> one of its paths, decides the shard of the name.
+        self.first_path = first_path
+        self.new_vectors = new_vectors
+        self.load_vectors = load_vectors
+        self.embeddings = None
+        self.shards = {root: new_vectors() for root in self.roots}
+        self.locks = {root: threading.RLock() for root in self.roots}
+        # root -> [(op, names, vectors)] of the changes since its new shard started, see track_changes().
+        self.changes = {}
+        self.pool = ThreadPoolExecutor(max_workers=max(1, len(self.roots)), thread_name_prefix='vector_shards')
+
+    def shard_path(self, root):
+        return os.path.join(self.path, shard_name(root))
+
+    def root_of(self, path):
+        if path is not None:
+            for root in self.roots:
+                if is_under(path, root):
+                    return root
+        return None
+
+    def fallback_root(self):
+        ''' First root that exists, names without a path under a root go to it (no shard for a missing drive). '''
+        return next((root for root in self.roots if os.path.exists(root)), self.roots[0])
+
+    def group_by_root(self, names, *columns):
+        ''' {root: (names, *columns)} of the names, names without a path under a root go to fallback_root(). '''
+        groups = {}
+        fallback = self.fallback_root()
+        for row in zip(names, *columns):
+            root = self.root_of(self.first_path(row[0])) or fallback
+            groups.setdefault(root, []).append(row)
+        return {root: tuple(map(list, zip(*rows))) for root, rows in groups.items()}
+
+    def group_names(self, items):
+        ''' {root: [names]} of the (name, paths) items of a files index. '''
+        groups = {root: [] for root in self.roots}
+        fallback = self.fallback_root()
+        for name, paths in items:
+            groups[self.root_of(paths[0] if paths else None) or fallback].append(name)
+        return groups
+
+    def load(self, embeddings):
+        self.embeddings = embeddings
+        for root in self.roots:
+            path = self.shard_path(root)
+            recover_checkpoint(path)
+            if os.path.exists(path):
+                shard = self.load_vectors(path)
+                with self.locks[root]:
+                    self.shards[root] = shard
+
+    def split(self, vectors, items):
+        '''
+        Moves the live vectors of a single store (saved before the shards) into the shards, without embedding
+        anything again. items are the (name, paths) of the files index the names are placed by.
+        '''
+        import numpy as np
+        start = time.perf_counter()
+        owners = {name: root for root, names in self.group_names(items).items() for name in names}
+        store = vectors.store
+        rows = np.arange(store.index.ntotal, dtype=np.int64)
+        fallback = self.fallback_root()
+        for chunk, chunk_vectors in iter_vectors(store.index, rows):
+            names = [store.docstore.search(store.index_to_docstore_id[row]).page_content for row in chunk.tolist()]
+            live = [i for i, name in enumerate(names) if name not in vectors.removed]
+            names, chunk_vectors = [names[i] for i in live], chunk_vectors[live]
+            groups = {}
+            for name, vector in zip(names, chunk_vectors):
+                root_names, root_vectors = groups.setdefault(owners.get(name, fallback), ([], []))
+                root_names.append(name)
+                root_vectors.append(vector)
+            for root, (root_names, root_vectors) in groups.items():
+                with self.locks[root]:
+                    self.shards[root].add(root_names, root_vectors, self.embeddings)
+        self.save()
+        print(f'logs: Split the FAISS store into {len(self.roots)} shards ({len(self)} vectors) in {time.perf_counter() - start:.1f}s.')
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards.values())
+
+    def has_vectors(self):
+        return any(shard.store is not None for shard in self.shards.values())
+
+    @property
+    def removed(self):
+        return set().union(*(shard.removed for shard in self.shards.values()))
+
+    def index_types(self):
+        return {shard.index_type for shard in self.shards.values() if shard.store is not None}
+
+    def add(self, names, vectors, embeddings):
+        added = 0
+        for root, (root_names, root_vectors) in self.group_by_root(names, vectors).items():
+            with self.locks[root]:
+                added += self.shards[root].add(root_names, root_vectors, embeddings)
+                if root in self.changes:
+                    self.changes[root].append(('add', root_names, root_vectors))
+        return added
+
+    def remove(self, names):
+        names = list(names)
+        removed = 0
+        for root in self.roots:
+            with self.locks[root]:
+                removed += self.shards[root].remove(names)
+                if root in self.changes:
+                    self.changes[root].append(('remove', names, None))
+        return removed
+
+    def track_changes(self, root):
+        ''' Logs the names added to and removed from a root from now on, until replace() or drop_changes(). '''
+        with self.locks[root]:
+            self.changes[root] = []
+
+    def drop_changes(self, root):
+        with self.locks[root]:
+            self.changes.pop(root, None)
+
+    def replace(self, root, vectors):
+        '''
+        Swaps in a shard built off to the side (by an embedding job), searches never see it half built. The
+        changes logged since track_changes() are applied to it first, in order.
+        '''
+        with self.locks[root]:
+            for op, names, columns in self.changes.pop(root, []):
+                if op == 'add':
+                    vectors.add(names, columns, self.embeddings)
+                else:
+                    vectors.remove(names)
+            self.shards[root] = vectors
+
+    def search_shard(self, root, vector, k, extensions=None):
+        with self.locks[root]:
+            return self.shards[root].search_by_vector(vector, k, extensions)
+
+    def search(self, query, k, extensions=None):
+        ''' Names of the k nearest live vectors over all shards, of names with one of the extensions if given. '''
+        if not self.has_vectors():
+            return []
+        vector = self.embeddings.embed_query(query)
+        futures = [self.pool.submit(self.search_shard, root, vector, k, extensions) for root in self.roots]
+        hits = sorted((hit for future in futures for hit in future.result()), key=lambda hit: hit[1])
+        names, seen = [], set()
+        for name, _ in hits:
+            if name not in seen:
+                seen.add(name)
+                names.append(name)
+        return names[:k]
+
+    def search_many(self, queries, k, timings=None, extensions=None):
+        '''
+        Names of the k nearest live vectors of each query: the queries are embedded as queries in one request where
+        the model allows it (see embed_queries) and every shard is searched with the whole query
+        matrix in one call. Adds the 'embed' and 'search' seconds to timings.
+        '''
+        if not queries or not self.has_vectors():
+            return [[] for _ in queries]
+        start = time.perf_counter()
+        vectors = embed_queries(self.embeddings, queries)
+        embedded = time.perf_counter()
+        futures = [self.pool.submit(self.search_shard_many, root, vectors, k, extensions) for root in self.roots]
+        shard_hits = [future.result() for future in futures]
+        results = []
+        for q in range(len(queries)):
+            hits = sorted((hit for hits in shard_hits for hit in hits[q]), key=lambda hit: hit[1])
+            results.append(list(dict.fromkeys(name for name, _ in hits))[:k])
+        if timings is not None:
+            timings['embed'] = timings.get('embed', 0.0) + embedded - start
+            timings['search'] = timings.get('search', 0.0) + time.perf_counter() - embedded
+        return results
+
+    def search_shard_many(self, root, vectors, k, extensions=None):
+        with self.locks[root]:
+            return self.shards[root].search_by_vectors(vectors, k, extensions)
+
+    def compact(self):
+        ''' Compacts every shard, returns the totals. '''
+        report = Compaction_Report()
+        for root in self.roots:
+            with self.locks[root]:
+                shard_report = self.shards[root].compact()
+            for field in ('names', 'vectors', 'bytes_before', 'bytes_after', 'docstore_bytes'):
+                setattr(report, field, getattr(report, field) + getattr(shard_report, field))
+        report.finish()
+        return report
+
+    def rebuild(self, index_type):
+        for root in self.roots:
+            with self.locks[root]:
+                if self.shards[root].store is not None:
+                    self.shards[root].rebuild(index_type)
+
+    def save(self):
+        ''' Saves every shard, compacting the ones with too many tombstones first. '''
+        for root in self.roots:
+            with self.locks[root]:
+                shard = self.shards[root]
+                if shard.store is None:
+                    continue
+                if shard.needs_compaction():
+                    print(f'logs: {root} {shard.compact()}')
+                shard.save(self.shard_path(root))
+
+
+def benchmark_vector_shards(names=200_000, roots=4, queries=200, k=10, size=384):
+    '''
+    Query latency of one store against the same names in one shard per root, and the latency of queries
+    while one root is re-embedded into a new shard (swapped in at the end) against while the single store is.
+    '''
+    import numpy as np
+    from file_vectors import File_Vectors
+    from embedding_pipeline import Fake_Embeddings
+    rng = np.random.default_rng(0)
+    root_paths = [f'/drive_{r}' for r in range(roots)]
+    all_names = [f'file_{i}.txt' for i in range(names)]
+    paths = {name: f'{root_paths[i % roots]}/docs/{name}' for i, name in enumerate(all_names)}
+    vectors = rng.standard_normal((names, size)).astype(np.float32)
+    embeddings = Fake_Embeddings(size=size, latency=0)
+    query_vectors = rng.standard_normal((queries, size)).astype(np.float32).tolist()
+    embeddings.embed_query = lambda text, vectors=iter(query_vectors * 1000): next(vectors)
+
+    single = File_Vectors()
+    single.add(all_names, vectors, embeddings)
+    lock = threading.Lock()
+
+    def single_search(query):
+        with lock:
+            return single.search_by_vector(embeddings.embed_query(query), k)
+
+    shards = Vector_Shards(None, root_paths, paths.get, File_Vectors, None)
+    shards.embeddings = embeddings
+    shards.add(all_names, vectors, embeddings)
+
+    def timed(search):
+        timings = []
+        for q in range(queries):
+            start = time.perf_counter()
+            search(f'query {q}')
+            timings.append(time.perf_counter() - start)
+        return np.array(timings) * 1e3
+
+    lines = [f'{names} names in 1 store against {roots} shards ({size} dimensions):']
+    for label, search in (('1 store', single_search), (f'{roots} shards', lambda query: shards.search(query, k))):
+        ms = timed(search)
+        lines.append(f'  {label:10} query p50 {np.percentile(ms, 50):.2f}ms, p99 {np.percentile(ms, 99):.2f}ms')
+
+    # Re-embedding one root: the single store is locked for the whole rebuild, a shard only for its swap.
+    one_root = [name for name in all_names if paths[name].startswith(root_paths[0] + '/')]
+    rebuilt = rng.standard_normal((len(one_root), size)).astype(np.float32)
+
+    def rebuild_single():
+        with lock:
+            single.remove(one_root)
+            single.compact()
+            single.add(one_root, rebuilt, embeddings)
+
+    def rebuild_shard():
+        new_shard = File_Vectors()
+        new_shard.add(one_root, rebuilt, embeddings)
+        shards.replace(root_paths[0], new_shard)
+
+    for label, rebuild, search in (('1 store', rebuild_single, single_search),
+                                   (f'{roots} shards', rebuild_shard, lambda query: shards.search(query, k))):
+        worker = threading.Thread(target=rebuild)
+        start = time.perf_counter()
+        worker.start()
+        ms = timed(search)
+        worker.join()
+        lines.append(f'  {label:10} while re-embedding {root_paths[0]} ({time.perf_counter() - start:.2f}s): query '
+                     f'p50 {np.percentile(ms, 50):.2f}ms, max {ms.max():.0f}ms')
+    return '\n'.join(lines)
+
+
+def benchmark_multi_query(names=100_000, variants=5, queries=50, k=30, size=384, latency=0.1):
+    '''
+    The name variants of update_search_list embedded and searched one at a time (as the MultiQueryRetriever did)
+    against embedded in one request and searched as one query matrix, on Fake_Embeddings with a request latency.
+    '''
+    import numpy as np
+    from file_vectors import File_Vectors
+    from embedding_pipeline import Fake_Embeddings
+    embeddings = Fake_Embeddings(size=size, latency=latency)
+    all_names = [f'file_{i}.txt' for i in range(names)]
+    vectors = np.random.default_rng(0).standard_normal((names, size)).astype(np.float32)
+    shards = Vector_Shards(None, ['/'], lambda name: None, File_Vectors, None)
+    shards.embeddings = embeddings
+    shards.add(all_names, vectors, embeddings)
+    lines = [f'{queries} questions of {variants} name variants over {names} names, {latency * 1e3:.0f}ms per embeddings request:']
+    for label in ('one at a time', 'batched'):
+        timings = {}
+        calls = embeddings.calls
+        start = time.perf_counter()
+        for q in range(queries):
+            texts = [f'variant {v} of question {q}' for v in range(variants)]
+            if label == 'batched':
+                shards.search_many(texts, k, timings)
+            else:
+                for text in texts:
+                    shards.search_many([text], k, timings)
+        elapsed = time.perf_counter() - start
+        lines.append(f'  {label:13}: {1e3 * elapsed / queries:.0f}ms per question (embed {1e3 * timings["embed"] / queries:.0f}ms, '
+                     f'search {1e3 * timings["search"] / queries:.1f}ms), {embeddings.calls - calls} embeddings requests')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(benchmark_vector_shards())
+    print(benchmark_multi_query())